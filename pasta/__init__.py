@@ -14,17 +14,146 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import ast
+import functools
+import multiprocessing
+import multiprocessing.pool
+
 from pasta.base import annotate
-from pasta.base import ast_utils
+from pasta.base import chunks
 from pasta.base import codegen
+from pasta.base import incremental
+from pasta.base import parallel
+from pasta.base import scope
+from pasta.base import stream as _stream
+
+
+def parse(src, parallel_threshold=None, analyze=False, imports_only=False,
+          record_spans=False, line_ranges=None):
+  """Parse python source code into a syntax tree annotated with formatting.
+
+  Arguments:
+    src: (string) Python source code to parse.
+    parallel_threshold: (int) If given, sources of at least this many characters
+      are split into chunks of top-level statements which are annotated in
+      separate worker processes. See pasta.base.parallel.
+    analyze: (bool) Whether to also analyze the scope of names in the tree, in
+      the same traversal as annotation.
+    imports_only: (bool) Whether to only annotate top-level import statements,
+      keeping the source of all other statements verbatim. This is much faster
+      for changes which only rewrite imports, but any other statement of the
+      resulting tree must not be modified. See chunks.annotate_imports.
+    record_spans: (bool) Whether to record the span of source each node came
+      from, so that dumping the tree copies unchanged subtrees straight from the
+      source. See codegen.record_spans.
+    line_ranges: (list of (int, int)) If given, only the top-level statements
+      in these ranges of lines (first and last line, inclusive) are annotated,
+      keeping the source of all other statements verbatim, as for imports_only.
+      See chunks.annotate_lines.
+  Returns:
+    The annotated ast.Module or, if analyze is True, a tuple of the annotated
+    ast.Module and its scope.RootScope.
+  """
+  scope_visitor = None
+  if imports_only and line_ranges is not None:
+    raise ValueError('imports_only and line_ranges cannot be used together')
+  if imports_only:
+    t = chunks.annotate_imports(src)
+  elif line_ranges is not None:
+    t = chunks.annotate_lines(src, line_ranges)
+  elif parallel_threshold is not None and len(src) >= parallel_threshold:
+    t = parallel.parse(src)
+  else:
+    t = ast.parse(src)
+    scope_visitor = scope.ScopeVisitor() if analyze else None
+    annotator = annotate.AstAnnotator(src, scope_visitor=scope_visitor)
+    annotator.visit(t)
+
+  if record_spans:
+    codegen.record_spans(t, src)
+  if not analyze:
+    return t
+  if scope_visitor is None:
+    return t, scope.analyze(t)
+  return t, scope_visitor.root_scope
+
+
+def reparse(tree, old_src, new_src):
+  """Update a syntax tree after an edit to the source it was parsed from.
+
+  Only the top-level statements touched by the edit are parsed and annotated
+  again; the others keep their nodes. See pasta.base.incremental.
+
+  Arguments:
+    tree: (ast.Module) Module returned by parse(old_src), not since changed.
+    old_src: (string) Source the tree was parsed from.
+    new_src: (string) Edited source.
+  Returns:
+    The tree, changed in place to match new_src.
+  """
+  return incremental.reparse(tree, old_src, new_src)
+
+
+def parse_all(sources, threads=None, **kwargs):
+  """Parse many sources at once, using a pool of threads.
+
+  Parsing shares no state between calls, so this scales with the number of
+  threads on builds of python without a global interpreter lock.
+
+  Arguments:
+    sources: (list of string) Python source code to parse.
+    threads: (int) Number of threads to use. Defaults to the number of CPUs.
+    **kwargs: Arguments to pass to parse for each source.
+  Returns:
+    A list of the results of parse for each source, in the same order.
+  """
+  pool = multiprocessing.pool.ThreadPool(
+      threads or multiprocessing.cpu_count())
+  try:
+    return pool.map(functools.partial(parse, **kwargs), sources, chunksize=1)
+  finally:
+    pool.close()
+    pool.join()
+
+
+def dump(tree, source_map=False):
+  """Get the source code of a syntax tree.
+
+  Arguments:
+    tree: (ast.AST) Syntax tree to generate source code for.
+    source_map: (bool) Whether to also return a codegen.SourceMap, which maps
+      offsets in the code back to positions in the source the tree was parsed
+      from.
+  Returns:
+    The source code or, if source_map is True, a tuple of the source code and
+    its SourceMap.
+  """
+  return codegen.to_str(tree, source_map=source_map)
+
+
+def dump_to(tree, fileobj):
+  """Write the source code of a syntax tree to a file-like object.
+
+  The source is written in chunks as it is generated, rather than being built
+  up in memory first.
+
+  Arguments:
+    tree: (ast.AST) Syntax tree to write out.
+    fileobj: (file-like object) Object to write to, such as an open file.
+  """
+  codegen.to_file(tree, fileobj)
 
 
-def parse(src):
-  t = ast_utils.parse(src)
-  annotator = annotate.AstAnnotator(src)
-  annotator.visit(t)
-  return t
+def stream(lines, fileobj, transforms=()):
+  """Parse, transform and write out a module one top-level statement at a time.
 
+  Only one top-level statement is held in memory at once, so this can handle
+  modules far too large to parse whole. See pasta.base.stream.transform.
 
-def dump(tree):
-  return codegen.to_str(tree)
+  Arguments:
+    lines: (iterable of string) Lines of python source, such as an open file.
+    fileobj: (file-like object) Object to write the transformed source to.
+    transforms: (list of callable) Functions to call with the ast.Module of each
+      statement, which can change it in place.
+  """
+  _stream.transform(lines, fileobj, transforms)
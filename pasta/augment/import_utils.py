@@ -18,9 +18,8 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
-import copy
-
 from pasta.augment import errors
+from pasta.base import ast_utils
 
 
 def split_import(sc, node, alias_to_remove):
@@ -41,15 +40,15 @@ def split_import(sc, node, alias_to_remove):
   for a in ('body', 'orelse', 'finalbody'):
     if hasattr(parent, a) and node in getattr(parent, a):
       parent_list = getattr(parent, a)
+      field = a
       break
   else:
     raise errors.InvalidAstError('Unable to find list containing import %r on '
                                  'parent node %r' % (node, parent))
 
   idx = parent_list.index(node)
-  new_import = copy.deepcopy(node)
+  new_import = ast_utils.clone(node)
   new_import.names = [alias_to_remove]
-  node.names.remove(alias_to_remove)
-
-  parent_list.insert(idx + 1, new_import)
+  ast_utils.remove_child(node, 'names', alias_to_remove)
+  ast_utils.insert_child(parent, field, idx + 1, new_import)
   return new_import
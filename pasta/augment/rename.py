@@ -23,6 +23,7 @@ import copy
 import itertools
 
 from pasta.augment import import_utils
+from pasta.base import ast_utils
 from pasta.base import scope
 
 
@@ -69,7 +70,8 @@ def rename_external(t, old_name, new_name):
         assert _rename_name_in_importfrom(sc, parent, old_name, new_name)
         already_changed.append(parent)
       else:
-        node.name = new_name + node.name[len(old_name):]
+        ast_utils.set_field(node, 'name',
+                            new_name + node.name[len(old_name):])
     elif isinstance(node, ast.ImportFrom):
       if node not in already_changed:
         assert _rename_name_in_importfrom(sc, node, old_name, new_name)
@@ -88,7 +90,8 @@ def _rename_name_in_importfrom(sc, node, old_name, new_name):
 
   # If just the module is changing, rename it
   if module_parts[:len(old_parts)] == old_parts:
-    node.module = '.'.join(new_parts + module_parts[len(old_parts):])
+    ast_utils.set_field(
+        node, 'module', '.'.join(new_parts + module_parts[len(old_parts):]))
     return True
     
   # Find the alias node to be changed
@@ -98,14 +101,14 @@ def _rename_name_in_importfrom(sc, node, old_name, new_name):
   else:
     return False
 
-  alias_to_change.name = new_parts[-1]
+  ast_utils.set_field(alias_to_change, 'name', new_parts[-1])
 
   # Split the import if the package has changed
   if module_parts != new_parts[:-1]:
     if len(node.names) > 1:
       new_import = import_utils.split_import(sc, node, alias_to_change)
-      new_import.module = '.'.join(new_parts[:-1])
+      ast_utils.set_field(new_import, 'module', '.'.join(new_parts[:-1]))
     else:
-      node.module = '.'.join(new_parts[:-1])
+      ast_utils.set_field(node, 'module', '.'.join(new_parts[:-1]))
 
   return True
@@ -21,6 +21,7 @@ from __future__ import print_function
 import ast
 import unittest
 
+import pasta
 from pasta.augment import rename
 from pasta.base import test_utils
 
@@ -85,6 +86,14 @@ class RenameTest(test_utils.TestCase):
     self.assertEqual(t.body[0].names[0].name, 'yyy')
     self.assertEqual(t.body[0].names[0].asname, 'abc')
 
+  def test_rename_external_imports_only(self):
+    src = 'from aaa.bbb import ccc, ddd\n\ndef f():\n  return ccc + ddd\n'
+    expected = pasta.parse(src)
+    self.assertTrue(rename.rename_external(expected, 'aaa.bbb.ccc', 'xxx.yyy'))
+    t = pasta.parse(src, imports_only=True)
+    self.assertTrue(rename.rename_external(t, 'aaa.bbb.ccc', 'xxx.yyy'))
+    self.assertMultiLineEqual(pasta.dump(expected), pasta.dump(t))
+
 
 def suite():
   result = unittest.TestSuite()
@@ -0,0 +1,248 @@
+# coding=utf-8
+"""Insert copies of a snippet of code, parsing and annotating it only once."""
+# Copyright 2017 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import ast
+import textwrap
+
+import six
+
+import pasta
+from pasta.base import ast_utils
+from pasta.base import codegen
+from pasta.base import formatting
+
+# Formatting attributes which hold source code other than whitespace and
+# comments, so must not be indented.
+_LITERAL_ATTRS = frozenset(('content', 'verbatim', formatting.SPAN))
+
+
+class Template(object):
+  """A snippet of code with placeholders, to be inserted many times.
+
+  The snippet is parsed and annotated once. Each instance of it is a clone of
+  the annotated statements with the placeholders filled in, so its formatting
+  is that of the snippet, indented for where it is inserted.
+
+  Placeholders are identifiers. Any field of a node in the snippet which is
+  exactly a placeholder is filled in; e.g. the names in imports, the ids of
+  names, attribute names and function names. A placeholder used as a name in an
+  expression can also be filled in with a syntax tree, which replaces the name.
+
+  For example:
+
+      template = Template('from MODULE import NAME\n', ['MODULE', 'NAME'])
+      template.insert(tree, 'body', 0, {'MODULE': 'a.b', 'NAME': 'c'})
+  """
+
+  def __init__(self, src, placeholders=()):
+    """Parse a snippet.
+
+    Arguments:
+      src: (string) Source code of one or more statements, which is dedented.
+      placeholders: (list of string) Identifiers to fill in.
+    Raises:
+      ValueError: if a placeholder does not appear in the snippet.
+    """
+    self._tree = pasta.parse(textwrap.dedent(src))
+    self._placeholders = frozenset(placeholders)
+    # Where each placeholder is used, as a path from the module to a node (a
+    # list of (field, index) pairs, with index None for single nodes) and the
+    # field of the node it fills in.
+    self._uses = {name: [] for name in self._placeholders}
+    stack = [(self._tree, [])]
+    while stack:
+      node, path = stack.pop()
+      for field, value in ast.iter_fields(node):
+        if isinstance(value, six.string_types):
+          if value in self._placeholders:
+            self._uses[value].append((path, field))
+        elif isinstance(value, ast.AST):
+          stack.append((value, path + [(field, None)]))
+        elif isinstance(value, list):
+          stack.extend((child, path + [(field, i)])
+                       for i, child in enumerate(value)
+                       if isinstance(child, ast.AST))
+    for name, uses in six.iteritems(self._uses):
+      if not uses:
+        raise ValueError('Placeholder %r is not used in %r' % (name, src))
+
+  def instantiate(self, values=None, indent=''):
+    """Make a copy of the snippet's statements.
+
+    Arguments:
+      values: (dict) Value of each placeholder; either a string, or a syntax
+        tree for placeholders used as names in expressions.
+      indent: (string) Indentation of the block the statements are for. Each
+        line of the snippet, and the line after it, is indented by this much.
+    Returns:
+      A list of the annotated statements.
+    Raises:
+      KeyError: if no value is given for a placeholder.
+    """
+    values = values or {}
+    tree = ast_utils.clone(self._tree)
+    for name in self._placeholders:
+      value = values[name]
+      for path, field in self._uses[name]:
+        parent, step, node = None, None, tree
+        for step in path:
+          parent = node
+          node = _child(node, step)
+        if isinstance(value, ast.AST):
+          if not isinstance(node, ast.Name) or parent is None:
+            raise ValueError('Placeholder %r is not a name' % name)
+          _replace(parent, step, node, value)
+        else:
+          setattr(node, field, value)
+    if indent:
+      _indent(tree, indent)
+    return tree.body
+
+  def insert(self, parent, field, index, values=None, indent=None):
+    """Insert a copy of the snippet's statements into a block of statements.
+
+    The statements are inserted with ast_utils.insert_child, as part of any
+    transaction open on the tree.
+
+    Arguments:
+      parent: (ast.AST) Node whose block of statements to insert into.
+      field: (string) Name of the block, e.g. 'body' or 'orelse'.
+      index: (int) Index in the block to insert the statements at. Except in a
+        module, where statements can also be added at the end, it must be the
+        index of an existing statement of the block.
+      values: (dict) Value of each placeholder, as for instantiate.
+      indent: (string) Indentation of the block. By default, it is the column of
+        the statement at the index in spaces, or none for a module.
+    Returns:
+      A list of the inserted statements.
+    Raises:
+      ValueError: if the index is past the end of a nested block, or is that of
+        a statement on the same line as the start of its block (as in
+        `if a: b`). The formatting which ends a block also indents the
+        statement after it, so statements added there would be indented
+        wrongly.
+    """
+    block = getattr(parent, field)
+    module = isinstance(parent, ast.Module)
+    if not module and index >= len(block):
+      raise ValueError('Cannot insert at the end of a nested block')
+    if indent is None:
+      indent = '' if module else ' ' * block[index].col_offset
+    statements = self.instantiate(values, indent)
+    if not statements:
+      return statements
+    if not module and index == 0:
+      _start_block(parent, block[0], statements[0], indent)
+    elif (module and block and index == len(block) and
+          not codegen.to_str(block[-1]).endswith('\n')):
+      # The module does not end with a newline.
+      ast_utils.prependprop(statements[0], 'prefix', '\n')
+    for i, stmt in enumerate(statements):
+      ast_utils.insert_child(parent, field, index + i, stmt)
+    return statements
+
+
+def _child(node, step):
+  field, index = step
+  value = getattr(node, field)
+  return value if index is None else value[index]
+
+
+def _replace(parent, step, name, value):
+  """Replace a placeholder name with (a clone of) a syntax tree."""
+  field, index = step
+  value = ast_utils.clone(value) if hasattr(value, 'a') else value
+  for attr in ('prefix', 'suffix'):
+    ast_utils.setprop(value, attr, ast_utils.prop(name, attr))
+  if index is None:
+    setattr(parent, field, value)
+  else:
+    getattr(parent, field)[index] = value
+
+
+def _start_block(parent, stmt, first, indent):
+  """Make a statement inserted at the start of a block start a line.
+
+  The newline ending the line which starts a block, and the indentation after
+  it, are printed either by the block's parent or in the prefix of the block's
+  first statement. In the latter case, they are moved to the inserted statement.
+
+  Arguments:
+    parent: (ast.AST) Node whose block the statement is inserted into.
+    stmt: (ast.stmt) First statement of the block.
+    first: (ast.stmt) First of the statements inserted before it.
+    indent: (string) Indentation of the block.
+  Raises:
+    ValueError: if stmt is on the same line as the start of the block.
+  """
+  before = _code_before(parent, stmt)
+  if '\n' in before and not before[before.rfind('\n') + 1:].strip():
+    return
+  prefix = ast_utils.prop(stmt, 'prefix')
+  newline = prefix.find('\n')
+  if newline < 0:
+    raise ValueError('Cannot insert before a statement on the same line as the '
+                     'start of its block')
+  # Anything on the block's first line, like a comment, stays on it.
+  ast_utils.prependprop(first, 'prefix', prefix[:newline + 1] + indent)
+  rest = prefix[newline + 1:]
+  # The inserted statements end with the indentation of the next line.
+  ast_utils.setprop(stmt, 'prefix',
+                    rest[len(indent):] if rest.startswith(indent) else rest)
+
+
+class _Stop(Exception):
+  pass
+
+
+class _PrefixPrinter(codegen.Printer):
+  """Printer which stops when it reaches a node."""
+
+  _use_spans = False
+
+  def __init__(self, stop):
+    super(_PrefixPrinter, self).__init__()
+    self._stop = stop
+
+  def enter_node(self, node):
+    if node is self._stop:
+      raise _Stop()
+    return super(_PrefixPrinter, self).enter_node(node)
+
+
+def _code_before(parent, node):
+  """Get the code printed for a node before one of its descendants."""
+  printer = _PrefixPrinter(node)
+  try:
+    printer.visit(parent)
+  except _Stop:
+    pass
+  return printer.code
+
+
+def _indent(tree, indent):
+  """Indent every line of the formatting of a tree after the first."""
+  for node in ast.walk(tree):
+    if not hasattr(node, 'a'):
+      continue
+    for name, value in node.a.items():
+      if (isinstance(value, six.string_types) and '\n' in value and
+          name not in _LITERAL_ATTRS and not name.endswith('__src')):
+        node.a[name] = value.replace('\n', '\n' + indent)
@@ -0,0 +1,121 @@
+# coding=utf-8
+"""Tests for augment.template."""
+# Copyright 2017 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import ast
+import unittest
+
+import pasta
+from pasta.augment import template
+from pasta.base import ast_utils
+from pasta.base import test_utils
+
+
+class TemplateTest(test_utils.TestCase):
+
+  def test_insert_import(self):
+    snippet = template.Template('from MODULE import NAME  # Added\n',
+                                ['MODULE', 'NAME'])
+    t = pasta.parse('import os\n\nx = 1\n')
+    snippet.insert(t, 'body', 1, {'MODULE': 'aaa.bbb', 'NAME': 'ccc'})
+    snippet.insert(t, 'body', 3, {'MODULE': 'ddd', 'NAME': 'eee'})
+    self.assertMultiLineEqual(
+        'import os\n\nfrom aaa.bbb import ccc  # Added\nx = 1\n'
+        'from ddd import eee  # Added\n',
+        pasta.dump(t))
+
+  def test_insert_indented(self):
+    snippet = template.Template('''\
+        if COND:
+          # Comment
+          NAME = [1,
+                  2]
+        ''', ['COND', 'NAME'])
+    src = 'def f():\n    a = 1\n    return a\n'
+    t = pasta.parse(src)
+    statements = snippet.insert(t.body[0], 'body', 1,
+                                {'COND': 'b', 'NAME': 'c'})
+    self.assertEqual(1, len(statements))
+    self.assertIs(statements[0], t.body[0].body[1])
+    self.assertMultiLineEqual(
+        'def f():\n    a = 1\n    if b:\n      # Comment\n      c = [1,\n'
+        '              2]\n    return a\n',
+        pasta.dump(t))
+
+  def test_insert_start_of_block(self):
+    snippet = template.Template('import NAME\n', ['NAME'])
+    t = pasta.parse('def f():  # c\n  a = 1\n\nif b:\n  c = 2\n')
+    snippet.insert(t.body[0], 'body', 0, {'NAME': 'd'})
+    snippet.insert(t.body[1], 'body', 0, {'NAME': 'e'})
+    self.assertMultiLineEqual(
+        'def f():  # c\n  import d\n  a = 1\n\nif b:\n  import e\n'
+        '  c = 2\n',
+        pasta.dump(t))
+
+  def test_insert_start_of_block_same_line(self):
+    snippet = template.Template('import NAME\n', ['NAME'])
+    t = pasta.parse('if a: b = 1\n')
+    with self.assertRaises(ValueError):
+      snippet.insert(t.body[0], 'body', 0, {'NAME': 'c'})
+
+  def test_insert_no_final_newline(self):
+    snippet = template.Template('import NAME\n', ['NAME'])
+    t = pasta.parse('x = 1')
+    snippet.insert(t, 'body', 1, {'NAME': 'a'})
+    self.assertEqual('x = 1\nimport a\n', pasta.dump(t))
+
+  def test_instances_are_independent(self):
+    snippet = template.Template('NAME = 1\n', ['NAME'])
+    first = snippet.instantiate({'NAME': 'a'})
+    second = snippet.instantiate({'NAME': 'b'})
+    ast_utils.setprop(first[0], 'prefix', '# First\n')
+    self.assertMultiLineEqual('# First\na = 1\n', pasta.dump(first[0]))
+    self.assertMultiLineEqual('b = 1\n', pasta.dump(second[0]))
+
+  def test_fill_in_expression(self):
+    snippet = template.Template('x = (VALUE)\n', ['VALUE'])
+    value = pasta.parse('[a  +  b, c]\n').body[0].value.elts[0]
+    statements = snippet.instantiate({'VALUE': value})
+    self.assertMultiLineEqual('x = (a  +  b)\n', pasta.dump(statements[0]))
+    self.assertIsNot(value, statements[0].value)
+
+    statements = snippet.instantiate({'VALUE': ast.Name('y', ast.Load())})
+    self.assertMultiLineEqual('x = (y)\n', pasta.dump(statements[0]))
+
+  def test_errors(self):
+    with self.assertRaises(ValueError):
+      template.Template('a = 1\n', ['NAME'])
+    snippet = template.Template('import NAME\n', ['NAME'])
+    with self.assertRaises(KeyError):
+      snippet.instantiate({})
+    with self.assertRaises(ValueError):
+      snippet.instantiate({'NAME': ast.Name('y', ast.Load())})
+    t = pasta.parse('if a:\n  b = 1\n')
+    with self.assertRaises(ValueError):
+      snippet.insert(t.body[0], 'body', 1, {'NAME': 'os'})
+
+
+def suite():
+  result = unittest.TestSuite()
+  result.addTests(unittest.makeSuite(TemplateTest))
+  return result
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -21,35 +21,181 @@ from __future__ import print_function
 import abc
 import ast
 import contextlib
+import inspect
+import threading
 import six
 from six.moves import zip
 
 from pasta.base import ast_constants
 from pasta.base import ast_utils
+from pasta.base import formatting
 from pasta.base import token_generator
 
 
+# Markers which can be used in the patterns passed to BaseVisitor.attr, standing
+# for some amount of whitespace.
+WS = object()
+WS_ONELINE = object()
+
+# Patterns for BaseVisitor.attr which appear in many layouts.
+_WS = (WS,)
+_WS_ONELINE = (WS_ONELINE,)
+_AS = (WS, 'as', WS)
+_ARROW = (WS, '->', WS)
+_COLON = (WS, ':', WS)
+_DOT = (WS, '.', WS)
+_EQUALS = (WS, '=')
+_STAR = (WS, '*')
+_STAR_WS = (WS, '*', WS)
+_DOUBLE_STAR = (WS, '**')
+_DOUBLE_STAR_WS = (WS, '**', WS)
+_OPEN_TRY = ('try', WS, ':')
+_OPEN_ELSE = ('else', WS, ':')
+_OPEN_FINALLY = ('finally', WS, ':')
+
+# Patterns for the modules of ast.ImportFrom nodes, by level and module name.
+# The same few modules are imported from all over a codebase, so each pattern is
+# only built once.
+_module_patterns = {}
+
+# Patterns for operators made of more than one token.
+_MULTI_TOKEN_OPERATORS = {
+    ast.IsNot: ('is', WS, 'not'),
+    ast.NotIn: ('not', WS, 'in'),
+}
+
+
+def _operator_patterns():
+  """Build the patterns for operators, by type and whether they are spaced."""
+  patterns = {}
+  for op_type, tokens in six.iteritems(ast_constants.NODE_TYPE_TO_TOKENS):
+    pattern = _MULTI_TOKEN_OPERATORS.get(op_type, tuple(tokens))
+    patterns[op_type, False] = pattern
+    patterns[op_type, True] = (WS,) + pattern + (WS_ONELINE,)
+  return patterns
+
+
+# Patterns for each operator, by type and whether it is spaced.
+_OPERATOR_PATTERNS = _operator_patterns()
+
+# Guards the creation of the table of compiled visitors of each visitor class,
+# which is shared by all instances of the class.
+_visitors_lock = threading.Lock()
+
+# Kinds of layout a visit method can be decorated with.
+_PARENTHESIZABLE = 'parenthesizable'
+_SPACED = 'spaced'
+
+
 def parenthesizable(f):
   """Decorates a function where the node visited can be wrapped in parens."""
-  @contextlib.wraps(f)
-  def wrapped(self, node, *args, **kwargs):
-    with self.scope(node):
+  if inspect.isgeneratorfunction(f):
+    @contextlib.wraps(f)
+    def wrapped(self, node, *args, **kwargs):
+      self.open_scope(node)
+      self.prefix(node)
+      for child in f(self, node, *args, **kwargs):
+        yield child
+      self.suffix(node, oneline=True)
+      self.close_scope(node)
+  else:
+    @contextlib.wraps(f)
+    def wrapped(self, node, *args, **kwargs):
+      self.open_scope(node)
       self.prefix(node)
       f(self, node, *args, **kwargs)
       self.suffix(node, oneline=True)
+      self.close_scope(node)
+  wrapped.layout = (_PARENTHESIZABLE, f)
   return wrapped
 
 
 def spaced(f):
   """Decorates a function where the node visited can have space around it."""
-  @contextlib.wraps(f)
-  def wrapped(self, node, *args, **kwargs):
-    self.prefix(node)
-    f(self, node, *args, **kwargs)
-    self.suffix(node, oneline=True)
+  if inspect.isgeneratorfunction(f):
+    @contextlib.wraps(f)
+    def wrapped(self, node, *args, **kwargs):
+      self.prefix(node)
+      for child in f(self, node, *args, **kwargs):
+        yield child
+      self.suffix(node, oneline=True)
+  else:
+    @contextlib.wraps(f)
+    def wrapped(self, node, *args, **kwargs):
+      self.prefix(node)
+      f(self, node, *args, **kwargs)
+      self.suffix(node, oneline=True)
+  wrapped.layout = (_SPACED, f)
   return wrapped
 
 
+def _module_pattern(level, module):
+  """Get the pattern for the module of an ast.ImportFrom, such as `..a.b`."""
+  key = (level, module)
+  try:
+    return _module_patterns[key]
+  except KeyError:
+    pass
+  pattern = ('.', WS) * level
+  if module:
+    parts = module.split('.')
+    for part in parts[:-1]:
+      pattern += (WS, part, '.')
+    pattern += (WS, parts[-1])
+  return _module_patterns.setdefault(key, pattern)
+
+
+def _function(visitor_cls, name):
+  """Get the plain function implementing a method of a visitor class."""
+  method = getattr(visitor_cls, name, None)
+  return getattr(method, '__func__', method)
+
+
+def _compile_visitor(visitor_cls, node_type):
+  """Build the functions used by a visitor class to visit a type of node.
+
+  The layout described by the decorators on a visit method is compiled into
+  functions to call before and after the body of the method, skipping parts that
+  are no-ops for the visitor class (e.g. parentheses are only tracked while
+  annotating).
+
+  Arguments:
+    visitor_cls: (type) A subclass of BaseVisitor.
+    node_type: (type) A subclass of ast.AST.
+  Returns:
+    A tuple (before, body, after) of functions taking the visitor and a node of
+    type node_type. `before` and `after` may be None. `body` returns None or, if
+    the node has children, an iterator over them in the order they are visited.
+  """
+  body = _function(visitor_cls, 'visit_' + node_type.__name__)
+  if body is None:
+    return None, _function(visitor_cls, 'generic_visit'), None
+  layout, body = getattr(body, 'layout', (None, body))
+
+  if layout is None:
+    return None, body, None
+
+  prefix = _function(visitor_cls, 'prefix')
+  suffix = _function(visitor_cls, 'suffix')
+  open_scope = _function(visitor_cls, 'open_scope')
+  close_scope = _function(visitor_cls, 'close_scope')
+  if (layout == _SPACED or
+      open_scope is _function(BaseVisitor, 'open_scope') and
+      close_scope is _function(BaseVisitor, 'close_scope')):
+    def after_spaced(self, node):
+      suffix(self, node, oneline=True)
+    return prefix, body, after_spaced
+
+  def before_parenthesizable(self, node):
+    open_scope(self, node)
+    prefix(self, node)
+
+  def after_parenthesizable(self, node):
+    suffix(self, node, oneline=True)
+    close_scope(self, node)
+  return before_parenthesizable, body, after_parenthesizable
+
+
 class BaseVisitor(ast.NodeVisitor):
   """Walks a syntax tree in the order it appears in code.
 
@@ -59,22 +205,83 @@ class BaseVisitor(ast.NodeVisitor):
 
   Each visit method in this class specifies the order in which both child nodes
   and syntax tokens appear, plus where to account for whitespace, commas,
-  parentheses, etc.
+  parentheses, etc. Methods which visit child nodes are generators that yield
+  each child in turn; the methods are compiled once per subclass into a table
+  keyed by node type, and `visit` walks the tree with an explicit stack, so the
+  depth of a tree is not limited by the python stack.
   """
 
   __metaclass__ = abc.ABCMeta
 
   def visit(self, node):
+    """Visit a node and all of its children."""
+    cls = type(self)
+    visitors = cls.__dict__.get('_visitors')
+    if visitors is None:
+      with _visitors_lock:
+        visitors = cls.__dict__.get('_visitors')
+        if visitors is None:
+          visitors = cls._visitors = {}
+
+    nodes = []
+    iterators = []
+    afters = []
+    while True:
+      if node is not None and not self.enter_node(node):
+        try:
+          before, body, after = visitors[node.__class__]
+        except KeyError:
+          before, body, after = visitors.setdefault(
+              node.__class__, _compile_visitor(cls, node.__class__))
+        if before is not None:
+          before(self, node)
+        children = body(self, node)
+        if children is not None:
+          nodes.append(node)
+          iterators.append(children)
+          afters.append(after)
+        else:
+          if after is not None:
+            after(self, node)
+          self.leave_node(node)
+
+      if not iterators:
+        return
+      try:
+        node = next(iterators[-1])
+      except StopIteration:
+        iterators.pop()
+        node = nodes.pop()
+        after = afters.pop()
+        if after is not None:
+          after(self, node)
+        self.leave_node(node)
+        node = None
+
+  def generic_visit(self, node):
+    """Visit each child of a node which has no specific layout."""
+    for child in ast.iter_child_nodes(node):
+      yield child
+
+  def enter_node(self, node):
+    """Called when a node is reached, before anything in it is visited.
+
+    Returns:
+      True if the node has been completely accounted for, in which case nothing
+      in it is visited and leave_node is not called for it.
+    """
     ast_utils.setup_props(node)
-    super(BaseVisitor, self).visit(node)
+
+  def leave_node(self, node):
+    """Called once a node and everything in it has been visited."""
 
   def suffix(self, node, oneline=False):
     """Account for some amount of whitespace as the suffix to a node."""
-    self.attr(node, 'suffix', [lambda: self.ws(oneline=oneline)])
+    self.attr(node, 'suffix', _WS_ONELINE if oneline else _WS)
 
   def prefix(self, node):
     """Account for some amount of whitespace as the prefix to a node."""
-    self.attr(node, 'prefix', [self.ws])
+    self.attr(node, 'prefix', _WS)
 
   def ws(self, oneline=False):
     """Account for some amount of whitespace.
@@ -84,6 +291,12 @@ class BaseVisitor(ast.NodeVisitor):
     """
     return ''
 
+  def open_scope(self, node):
+    """Account for a parenthesized scope opening before a node."""
+
+  def close_scope(self, node):
+    """Account for a parenthesized scope closing after a node."""
+
   @abc.abstractmethod
   def token():
     """Account for a specific token."""
@@ -92,10 +305,19 @@ class BaseVisitor(ast.NodeVisitor):
   def optional_suffix(node, attr_name, token_val):
     """Account for a suffix that may or may not occur."""
 
+  @abc.abstractmethod
+  def operator(node, attr_name, op, spaced=False):
+    """Account for an operator belonging to a node, e.g. the op of a BinOp.
+
+    ast.parse shares a single instance of each operator type between all nodes,
+    so any formatting of an operator is stored on the node it belongs to.
+    """
+
   @spaced
   def visit_Module(self, node):
-    self.generic_visit(node)
-    self.attr(node, 'suffix', [self.ws])
+    for child in self.generic_visit(node):
+      yield child
+    self.attr(node, 'suffix', _WS)
 
   @abc.abstractmethod
   def visit_Str(self, node):
@@ -107,12 +329,12 @@ class BaseVisitor(ast.NodeVisitor):
 
   @parenthesizable
   def visit_Expr(self, node):
-    self.visit(node.value)
+    yield node.value
 
   @parenthesizable
   def visit_Tuple(self, node):
     for elt in node.elts:
-      self.visit(elt)
+      yield elt
       self.suffix(elt)
       if elt != node.elts[-1]:
         self.token(',')
@@ -122,52 +344,52 @@ class BaseVisitor(ast.NodeVisitor):
   @parenthesizable
   def visit_Assign(self, node):
     for target in node.targets:
-      self.visit(target)
+      yield target
       self.suffix(target)
       self.token('=')
-    self.visit(node.value)
+    yield node.value
 
   @parenthesizable
   def visit_AugAssign(self, node):
-    self.visit(node.target)
+    yield node.target
     self.suffix(node.target)
     op_token = '%s=' % ast_constants.NODE_TYPE_TO_TOKENS[type(node.op)][0]
     self.token(op_token)
-    self.visit(node.value)
+    yield node.value
 
   @parenthesizable
   def visit_BinOp(self, node):
-    self.visit(node.left)
+    yield node.left
     self.suffix(node.left)
-    self.visit(node.op)
-    self.visit(node.right)
+    self.operator(node, 'op', node.op)
+    yield node.right
     self.suffix(node.right)
 
   @parenthesizable
   def visit_BoolOp(self, node):
     for value in node.values:
-      self.visit(value)
+      yield value
       if value != node.values[-1]:
         self.suffix(value)
-        self.visit(node.op)
+        self.operator(node, 'op', node.op)
 
   @parenthesizable
   def visit_UnaryOp(self, node):
-    self.visit(node.op)
-    self.visit(node.operand)
+    self.operator(node, 'op', node.op)
+    yield node.operand
 
   @parenthesizable
   def visit_Lambda(self, node):
     self.token('lambda')
-    self.visit(node.args)
+    yield node.args
     self.token(':')
-    self.visit(node.body)
+    yield node.body
 
   @spaced
   def visit_Import(self, node):
     self.token('import')
     for alias in node.names:
-      self.visit(alias)
+      yield alias
       if alias != node.names[-1]:
         self.suffix(alias)
         self.token(',')
@@ -175,153 +397,51 @@ class BaseVisitor(ast.NodeVisitor):
   @spaced
   def visit_ImportFrom(self, node):
     self.token('from')
-    self.attr(node, 'module_prefix', [self.ws], default=' ')
-
-    module_pattern = ['.', self.ws] * node.level
-    if node.module:
-      parts = node.module.split('.')
-      for part in parts[:-1]:
-        module_pattern += [self.ws, part, '.']
-      module_pattern += [self.ws, parts[-1]]
+    self.attr(node, 'module_prefix', _WS, default=' ')
 
-    self.attr(node, 'module', module_pattern,
+    self.attr(node, 'module', _module_pattern(node.level, node.module),
               deps=('level', 'module'),
               default='.' * node.level + (node.module or ''))
-    self.attr(node, 'module_suffix', [self.ws], default=' ')
+    self.attr(node, 'module_suffix', _WS, default=' ')
 
     self.token('import')
     for alias in node.names:
-      self.visit(alias)
+      yield alias
       if alias != node.names[-1]:
         self.token(',')
 
   @parenthesizable
   def visit_Compare(self, node):
-    self.visit(node.left)
-    for op, comparator in zip(node.ops, node.comparators):
-      self.visit(op)
-      self.visit(comparator)
-
-  def visit_Add(self, node):
-    self.token(ast_constants.NODE_TYPE_TO_TOKENS[type(node)][0])
-
-  def visit_Sub(self, node):
-    self.token(ast_constants.NODE_TYPE_TO_TOKENS[type(node)][0])
-
-  def visit_Mult(self, node):
-    self.token(ast_constants.NODE_TYPE_TO_TOKENS[type(node)][0])
-
-  def visit_Div(self, node):
-    self.token(ast_constants.NODE_TYPE_TO_TOKENS[type(node)][0])
-
-  def visit_Mod(self, node):
-    self.token(ast_constants.NODE_TYPE_TO_TOKENS[type(node)][0])
-
-  def visit_Pow(self, node):
-    self.token(ast_constants.NODE_TYPE_TO_TOKENS[type(node)][0])
-
-  def visit_LShift(self, node):
-    self.token(ast_constants.NODE_TYPE_TO_TOKENS[type(node)][0])
-
-  def visit_RShift(self, node):
-    self.token(ast_constants.NODE_TYPE_TO_TOKENS[type(node)][0])
-
-  def visit_BitAnd(self, node):
-    self.token(ast_constants.NODE_TYPE_TO_TOKENS[type(node)][0])
-
-  def visit_BitOr(self, node):
-    self.token(ast_constants.NODE_TYPE_TO_TOKENS[type(node)][0])
-
-  def visit_BitXor(self, node):
-    self.token(ast_constants.NODE_TYPE_TO_TOKENS[type(node)][0])
-
-  def visit_FloorDiv(self, node):
-    self.token(ast_constants.NODE_TYPE_TO_TOKENS[type(node)][0])
-
-  def visit_Invert(self, node):
-    self.token(ast_constants.NODE_TYPE_TO_TOKENS[type(node)][0])
-
-  def visit_Not(self, node):
-    self.token(ast_constants.NODE_TYPE_TO_TOKENS[type(node)][0])
-
-  def visit_UAdd(self, node):
-    self.token(ast_constants.NODE_TYPE_TO_TOKENS[type(node)][0])
-
-  def visit_USub(self, node):
-    self.token(ast_constants.NODE_TYPE_TO_TOKENS[type(node)][0])
-
-  def visit_And(self, node):
-    self.token(ast_constants.NODE_TYPE_TO_TOKENS[type(node)][0])
-
-  def visit_Or(self, node):
-    self.token(ast_constants.NODE_TYPE_TO_TOKENS[type(node)][0])
-
-  @spaced
-  def visit_Eq(self, node):
-    self.token(ast_constants.NODE_TYPE_TO_TOKENS[type(node)][0])
-
-  @spaced
-  def visit_NotEq(self, node):
-    self.token(ast_constants.NODE_TYPE_TO_TOKENS[type(node)][0])
-
-  @spaced
-  def visit_Lt(self, node):
-    self.token(ast_constants.NODE_TYPE_TO_TOKENS[type(node)][0])
-
-  @spaced
-  def visit_LtE(self, node):
-    self.token(ast_constants.NODE_TYPE_TO_TOKENS[type(node)][0])
-
-  @spaced
-  def visit_Gt(self, node):
-    self.token(ast_constants.NODE_TYPE_TO_TOKENS[type(node)][0])
-
-  @spaced
-  def visit_GtE(self, node):
-    self.token(ast_constants.NODE_TYPE_TO_TOKENS[type(node)][0])
-
-  @spaced
-  def visit_Is(self, node):
-    self.token(ast_constants.NODE_TYPE_TO_TOKENS[type(node)][0])
-
-  @spaced
-  def visit_IsNot(self, node):
-    self.attr(node, 'content', ['is', self.ws, 'not'], default='is not')
-
-  @spaced
-  def visit_In(self, node):
-    self.token(ast_constants.NODE_TYPE_TO_TOKENS[type(node)][0])
-
-  @spaced
-  def visit_NotIn(self, node):
-    self.attr(node, 'content', ['not', self.ws, 'in'], default='not in')
+    yield node.left
+    for i, (op, comparator) in enumerate(zip(node.ops, node.comparators)):
+      self.operator(node, 'op%d' % i, op, spaced=True)
+      yield comparator
 
   @spaced
   def visit_alias(self, node):
     self.token(node.name)
     if node.asname is not None:
-      self.attr(node, 'asname', [self.ws, 'as', self.ws], default=' as ')
+      self.attr(node, 'asname', _AS, default=' as ')
       self.token(node.asname)
 
   @spaced
   def visit_If(self, node):
     self.token('elif' if ast_utils.prop(node, 'is_elif') else 'if')
-    self.visit(node.test)
-    self.attr(node, 'testsuffix', [self.ws, ':', self.ws], default=':')
+    yield node.test
+    self.attr(node, 'testsuffix', _COLON, default=':')
     for stmt in node.body:
-      self.visit(stmt)
+      yield stmt
 
     if node.orelse:
       if (len(node.orelse) == 1 and isinstance(node.orelse[0], ast.If) and
           self.check_is_elif(node.orelse[0])):
-        ast_utils.setprop(node.orelse[0], 'is_elif', True)
-        self.visit(node.orelse[0])
+        yield node.orelse[0]
       else:
-        self.attr(node, 'elseprefix', [self.ws])
+        self.attr(node, 'elseprefix', _WS)
         self.token('else')
-        self.attr(node, 'elsesuffix', [self.ws, ':', self.ws], default=':')
+        self.attr(node, 'elsesuffix', _COLON, default=':')
         for stmt in node.orelse:
-          self.visit(stmt)
+          yield stmt
 
   @abc.abstractmethod
   def check_is_elif(self):
@@ -346,48 +466,48 @@ class BaseVisitor(ast.NodeVisitor):
 
   @parenthesizable
   def visit_IfExp(self, node):
-    self.visit(node.body)
+    yield node.body
     self.suffix(node.body)
     self.token('if')
-    self.visit(node.test)
+    yield node.test
     self.suffix(node.test)
     self.token('else')
-    self.visit(node.orelse)
+    yield node.orelse
 
   @spaced
   def visit_While(self, node):
     self.token('while')
-    self.visit(node.test)
-    self.attr(node, 'testsuffix', [self.ws, ':', self.ws], default=':')
+    yield node.test
+    self.attr(node, 'testsuffix', _COLON, default=':')
     for stmt in node.body:
-      self.visit(stmt)
+      yield stmt
 
     if node.orelse:
-      self.attr(node, 'elseprefix', [self.ws])
+      self.attr(node, 'elseprefix', _WS)
       self.token('else')
-      self.attr(node, 'elsesuffix', [self.ws, ':', self.ws], default=':')
+      self.attr(node, 'elsesuffix', _COLON, default=':')
       for stmt in node.orelse:
-        self.visit(stmt)
+        yield stmt
 
   @spaced
   def visit_For(self, node):
     self.token('for')
-    self.visit(node.target)
+    yield node.target
     self.suffix(node.target)
     self.token('in')
-    self.visit(node.iter)
+    yield node.iter
     self.suffix(node.iter)
     self.token(':')
     for stmt in node.body:
-      self.visit(stmt)
+      yield stmt
 
     if node.orelse:
-      self.attr(node, 'orelseprefix', [self.ws])
+      self.attr(node, 'orelseprefix', _WS)
       self.token('else')
       self.token(':')
 
       for stmt in node.orelse:
-        self.visit(stmt)
+        yield stmt
 
   @spaced
   def visit_Repr(self, node):
@@ -396,24 +516,25 @@ class BaseVisitor(ast.NodeVisitor):
   @spaced
   def visit_With(self, node):
     if hasattr(node, 'items'):
-      return self.visit_With_3(node)
-    if not getattr(node, 'is_continued', False):
+      for child in self.visit_With_3(node):
+        yield child
+      return
+    if not ast_utils.prop(node, 'is_continued'):
       self.token('with')
-    self.visit(node.context_expr)
+    yield node.context_expr
     self.suffix(node.context_expr)
     if node.optional_vars:
       self.token('as')
-      self.visit(node.optional_vars)
+      yield node.optional_vars
       self.suffix(node.optional_vars)
 
     if self.check_is_continued_with(node.body[0]):
-      node.body[0].is_continued = True
       self.token(',')
     else:
       self.token(':')
 
     for stmt in node.body:
-      self.visit(stmt)
+      yield stmt
 
   @abc.abstractmethod
   def check_is_continued_with(self, node):
@@ -439,30 +560,30 @@ class BaseVisitor(ast.NodeVisitor):
     self.token('with')
 
     for i, withitem in enumerate(node.items):
-      self.visit(withitem)
+      yield withitem
       if i != len(node.items) - 1:
         self.token(',')
 
     self.token(':')
     for stmt in node.body:
-      self.visit(stmt)
+      yield stmt
 
   @spaced
   def visit_withitem(self, node):
-    self.visit(node.context_expr)
+    yield node.context_expr
     self.suffix(node.context_expr)
     if node.optional_vars:
       self.token('as')
-      self.visit(node.optional_vars)
+      yield node.optional_vars
       self.suffix(node.optional_vars)
 
   @spaced
   def visit_Assert(self, node):
     self.token('assert')
-    self.visit(node.test)
+    yield node.test
     if node.msg:
       self.token(',')
-      self.visit(node.msg)
+      yield node.msg
 
   @spaced
   def visit_Exec(self, node):
@@ -482,19 +603,19 @@ class BaseVisitor(ast.NodeVisitor):
 
   @parenthesizable
   def visit_Attribute(self, node):
-    self.visit(node.value)
-    self.attr(node, 'dot', [self.ws, '.', self.ws], default='.')
+    yield node.value
+    self.attr(node, 'dot', _DOT, default='.')
     self.token(node.attr)
 
   @parenthesizable
   def visit_Subscript(self, node):
-    self.visit(node.value)
-    self.visit(node.slice)
+    yield node.value
+    yield node.slice
 
   @spaced
   def visit_Index(self, node):
     self.token('[')
-    self.visit(node.value)
+    yield node.value
     self.suffix(node.value)
     self.token(']')
 
@@ -503,26 +624,26 @@ class BaseVisitor(ast.NodeVisitor):
     self.token('[')
 
     if node.lower:
-      self.visit(node.lower)
+      yield node.lower
       self.suffix(node.lower)
     else:
-      self.attr(node, 'lowerspace', [self.ws])
+      self.attr(node, 'lowerspace', _WS)
 
     if node.lower or node.upper:
       self.token(':')
 
     if node.upper:
-      self.visit(node.upper)
+      yield node.upper
       self.suffix(node.upper)
     else:
-      self.attr(node, 'upperspace', [self.ws])
+      self.attr(node, 'upperspace', _WS)
 
     if node.step:
       self.token(':')
-      self.visit(node.step)
+      yield node.step
       self.suffix(node.step)
     else:
-      self.attr(node, 'stepspace', [self.ws])
+      self.attr(node, 'stepspace', _WS)
 
     self.token(']')
 
@@ -531,14 +652,14 @@ class BaseVisitor(ast.NodeVisitor):
     self.token('[')
 
     for elt in node.elts:
-      self.visit(elt)
+      yield elt
       self.suffix(elt)
       if elt != node.elts[-1]:
         self.token(',')
     if node.elts:
       self.optional_suffix(node, 'extracomma', ',')
 
-    self.attr(node, 'close_prefix', [self.ws])
+    self.attr(node, 'close_prefix', _WS)
     self.token(']')
 
   @parenthesizable
@@ -546,7 +667,7 @@ class BaseVisitor(ast.NodeVisitor):
     self.token('{')
 
     for elt in node.elts:
-      self.visit(elt)
+      yield elt
       self.suffix(elt)
       if elt != node.elts[-1]:
         self.token(',')
@@ -560,73 +681,75 @@ class BaseVisitor(ast.NodeVisitor):
     self.token('{')
 
     for key, value in zip(node.keys, node.values):
-      self.visit(key)
+      yield key
       self.suffix(key)
       self.token(':')
-      self.visit(value)
+      yield value
       if value != node.values[-1]:
         self.suffix(value)
         self.token(',')
     self.optional_suffix(node, 'extracomma', ',')
-    self.attr(node, 'close_prefix', [self.ws])
+    self.attr(node, 'close_prefix', _WS)
     self.token('}')
 
   @parenthesizable
   def visit_GeneratorExp(self, node):
-    self.visit(node.elt)
+    yield node.elt
     self.suffix(node.elt)
     for comp in node.generators:
       self.token('for')
-      self.visit(comp)
+      yield comp
 
   @parenthesizable
   def visit_ListComp(self, node):
-    self._comp_exp(node, open_brace='[', close_brace=']')
+    for child in self._comp_exp(node, open_brace='[', close_brace=']'):
+      yield child
 
   @parenthesizable
   def visit_SetComp(self, node):
-    self._comp_exp(node, open_brace='{', close_brace='}')
+    for child in self._comp_exp(node, open_brace='{', close_brace='}'):
+      yield child
 
   def _comp_exp(self, node, open_brace=None, close_brace=None):
     if open_brace:
       self.token(open_brace)
-    self.visit(node.elt)
+    yield node.elt
     self.suffix(node.elt)
     for comp in node.generators:
       self.token('for')
-      self.visit(comp)
+      yield comp
     if close_brace:
       self.token(close_brace)
 
   @parenthesizable
   def visit_DictComp(self, node):
     self.token('{')
-    self.visit(node.key)
+    yield node.key
     self.suffix(node.key)
     self.token(':')
-    self.visit(node.value)
+    yield node.value
     self.suffix(node.value)
     for comp in node.generators:
       self.token('for')
-      self.visit(comp)
+      yield comp
     self.token('}')
 
   @spaced
   def visit_comprehension(self, node):
-    self.visit(node.target)
+    yield node.target
     self.suffix(node.target)
     self.token('in')
-    self.visit(node.iter)
+    yield node.iter
     self.suffix(node.iter)
     for if_expr in node.ifs:
       self.token('if')
-      self.visit(if_expr)
+      yield if_expr
       if if_expr != node.ifs[-1]:
         self.suffix(if_expr)
 
   @parenthesizable
   def visit_Call(self, node):
-    self.visit(node.func)
+    yield node.func
     self.suffix(node.func)
     self.token('(')
     num_items = (len(node.args) + len(node.keywords) +
@@ -634,7 +757,7 @@ class BaseVisitor(ast.NodeVisitor):
 
     i = 0
     for arg in node.args:
-      self.visit(arg)
+      yield arg
       self.suffix(arg)
       if i < num_items - 1:
         self.token(',')
@@ -645,11 +768,11 @@ class BaseVisitor(ast.NodeVisitor):
     kw_idx = 0
     while i < kw_end:
       if i == starargs_idx:
-        self.attr(node, 'starargs_prefix', [self.ws, '*'], default='*')
-        self.visit(node.starargs)
+        self.attr(node, 'starargs_prefix', _STAR, default='*')
+        yield node.starargs
         self.suffix(node.starargs)
       else:
-        self.visit(node.keywords[kw_idx])
+        yield node.keywords[kw_idx]
         self.suffix(node.keywords[kw_idx])
         kw_idx += 1
       if i < num_items - 1:
@@ -657,8 +780,8 @@ class BaseVisitor(ast.NodeVisitor):
       i += 1
 
     if node.kwargs:
-      self.attr(node, 'kwargs_prefix', [self.ws, '**'], default='**')
-      self.visit(node.kwargs)
+      self.attr(node, 'kwargs_prefix', _DOUBLE_STAR, default='**')
+      yield node.kwargs
       self.suffix(node.kwargs)
 
     if num_items > 0:
@@ -677,40 +800,40 @@ class BaseVisitor(ast.NodeVisitor):
     keyword = node.args[-len(node.defaults):] if node.defaults else node.args
 
     for arg in positional:
-      self.visit(arg)
+      yield arg
       self.suffix(arg)
       arg_i += 1
       if arg_i < total_args:
         self.token(',')
 
     for arg, default in zip(keyword, node.defaults):
-      self.visit(arg)
+      yield arg
       self.suffix(arg)
       self.token('=')
-      self.visit(default)
+      yield default
       self.suffix(default)
       arg_i += 1
       if arg_i < total_args:
         self.token(',')
 
     if node.vararg:
-      self.attr(node, 'vararg_prefix', [self.ws, '*', self.ws], default='*')
+      self.attr(node, 'vararg_prefix', _STAR_WS, default='*')
       if isinstance(node.vararg, ast.AST):
-        self.visit(node.vararg)
+        yield node.vararg
       else:
         self.token(node.vararg)
-        self.attr(node, 'vararg_suffix', [self.ws])
+        self.attr(node, 'vararg_suffix', _WS)
       arg_i += 1
       if arg_i < total_args:
         self.token(',')
 
     if node.kwarg:
-      self.attr(node, 'kwarg_prefix', [self.ws, '**', self.ws], default='**')
+      self.attr(node, 'kwarg_prefix', _DOUBLE_STAR_WS, default='**')
       if isinstance(node.kwarg, ast.AST):
-        self.visit(node.kwarg)
+        yield node.kwarg
       else:
         self.token(node.kwarg)
-        self.attr(node, 'kwarg_suffix', [self.ws])
+        self.attr(node, 'kwarg_suffix', _WS)
 
   @spaced
   def visit_arg(self, node):
@@ -718,55 +841,55 @@ class BaseVisitor(ast.NodeVisitor):
     self.suffix(node)
     if node.annotation is not None:
       self.token(':')
-      self.visit(node.annotation)
+      yield node.annotation
 
   @spaced
   def visit_FunctionDef(self, node):
     for decorator in node.decorator_list:
       self.token('@')
-      self.visit(decorator)
+      yield decorator
       self.suffix(decorator)
     self.token('def')
-    self.attr(node, 'name_prefix', [self.ws])
+    self.attr(node, 'name_prefix', _WS)
     self.token(node.name)
-    self.attr(node, 'name_suffix', [self.ws])
+    self.attr(node, 'name_suffix', _WS)
     self.token('(')
-    self.visit(node.args)
+    yield node.args
     self.token(')')
 
     if getattr(node, 'returns', None):
-      self.attr(node, 'returns_prefix', [self.ws, '->', self.ws],
+      self.attr(node, 'returns_prefix', _ARROW,
                 deps=('returns',), default=' -> ')
-      self.visit(node.returns)
+      yield node.returns
 
     self.token(':')
 
     for expr in node.body:
-      self.visit(expr)
+      yield expr
 
   @spaced
   def visit_keyword(self, node):
     self.token(node.arg)
-    self.attr(node, 'eq', [self.ws, '='], default='=')
-    self.visit(node.value)
+    self.attr(node, 'eq', _EQUALS, default='=')
+    yield node.value
 
   @spaced
   def visit_Return(self, node):
     self.token('return')
     if node.value:
-      self.visit(node.value)
+      yield node.value
 
   @spaced
   def visit_Yield(self, node):
     self.token('yield')
     if node.value:
-      self.visit(node.value)
+      yield node.value
 
   @spaced
   def visit_Delete(self, node):
     self.token('del')
     for target in node.targets:
-      self.visit(target)
+      yield target
       self.suffix(target)
       if target != node.targets[-1]:
         self.token(',')
@@ -774,16 +897,16 @@ class BaseVisitor(ast.NodeVisitor):
   @spaced
   def visit_Print(self, node):
     self.token('print')
-    self.attr(node, 'print_suffix', [self.ws], default=' ')
+    self.attr(node, 'print_suffix', _WS, default=' ')
     if node.dest:
       self.token('>>')
-      self.visit(node.dest)
+      yield node.dest
       if node.values or not node.nl:
         self.suffix(node.dest)
         self.token(',')
 
     for value in node.values:
-      self.visit(value)
+      yield value
       if value != node.values[-1] or not node.nl:
         self.suffix(value)
         self.token(',')
@@ -792,15 +915,15 @@ class BaseVisitor(ast.NodeVisitor):
   def visit_ClassDef(self, node):
     for decorator in node.decorator_list:
       self.token('@')
-      self.visit(decorator)
+      yield decorator
       self.suffix(decorator)
     self.token('class')
-    self.attr(node, 'name_prefix', [self.ws], default=' ')
+    self.attr(node, 'name_prefix', _WS, default=' ')
     self.token(node.name)
-    self.attr(node, 'name_suffix', [self.ws])
+    self.attr(node, 'name_suffix', _WS)
     self.token('(')
     for base in node.bases:
-      self.visit(base)
+      yield base
       self.suffix(base)
       if base != node.bases[-1]:
         self.token(',')
@@ -808,7 +931,7 @@ class BaseVisitor(ast.NodeVisitor):
     self.token(':')
 
     for expr in node.body:
-      self.visit(expr)
+      yield expr
 
   @spaced
   def visit_Pass(self, node):
@@ -827,114 +950,150 @@ class BaseVisitor(ast.NodeVisitor):
     # Try with except and finally is a TryFinally with the first statement as a
     # TryExcept in Python2
     if not isinstance(node.body[0], ast.TryExcept):
-      self.attr(node, 'open_try', ['try', self.ws, ':'], default='try:')
+      self.attr(node, 'open_try', _OPEN_TRY, default='try:')
     for stmt in node.body:
-      self.visit(stmt)
-    self.attr(node, 'open_finally', ['finally', self.ws, ':'],
-              default='finally:')
+      yield stmt
+    self.attr(node, 'open_finally', _OPEN_FINALLY, default='finally:')
     for stmt in node.finalbody:
-      self.visit(stmt)
+      yield stmt
 
   @spaced
   def visit_TryExcept(self, node):
-    self.attr(node, 'open_try', ['try', self.ws, ':'], default='try:')
+    self.attr(node, 'open_try', _OPEN_TRY, default='try:')
     for stmt in node.body:
-      self.visit(stmt)
+      yield stmt
     for handler in node.handlers:
-      self.visit(handler)
+      yield handler
     if node.orelse:
-      self.attr(node, 'open_else', ['else', self.ws, ':'], default='else:')
+      self.attr(node, 'open_else', _OPEN_ELSE, default='else:')
       for stmt in node.orelse:
-        self.visit(stmt)
+        yield stmt
 
   @spaced
   def visit_Try(self, node):
     # Python 3
-    self.attr(node, 'open_try', ['try', self.ws, ':'], default='try:')
+    self.attr(node, 'open_try', _OPEN_TRY, default='try:')
     for stmt in node.body:
-      self.visit(stmt)
+      yield stmt
     for handler in node.handlers:
-      self.visit(handler)
+      yield handler
     if node.orelse:
-      self.attr(node, 'open_else', ['else', self.ws, ':'], default='else:')
+      self.attr(node, 'open_else', _OPEN_ELSE, default='else:')
       for stmt in node.orelse:
-        self.visit(stmt)
+        yield stmt
     if node.finalbody:
-      self.attr(node, 'open_finally', ['finally', self.ws, ':'],
-                default='finally:')
+      self.attr(node, 'open_finally', _OPEN_FINALLY, default='finally:')
       for stmt in node.finalbody:
-        self.visit(stmt)
+        yield stmt
 
   @spaced
   def visit_ExceptHandler(self, node):
     self.token('except')
     if node.type:
-      self.visit(node.type)
+      yield node.type
       self.suffix(node.type)
     if node.type and node.name:
-      self.attr(node, 'as', [self.ws, 'as', self.ws], default=' as ')
+      self.attr(node, 'as', _AS, default=' as ')
     if node.name:
       if isinstance(node.name, ast.AST):
-        self.visit(node.name)
+        yield node.name
       else:
         self.token(node.name)
-        self.attr(node, 'name_suffix', [self.ws])
+        self.attr(node, 'name_suffix', _WS)
     self.token(':')
     for stmt in node.body:
-      self.visit(stmt)
+      yield stmt
 
   @spaced
   def visit_Raise(self, node):
     self.token('raise')
     if node.type:
-      self.visit(node.type)
+      yield node.type
     if node.inst:
       self.suffix(node.type)
       self.token(',')
-      self.visit(node.inst)
+      yield node.inst
     if node.tback:
       self.suffix(node.inst)
       self.token(',')
-      self.visit(node.tback)
-
-  @contextlib.contextmanager
-  def scope(self, node):
-    """Context manager to handle a parenthesized scope."""
-    yield
+      yield node.tback
 
 
 class AstAnnotator(BaseVisitor):
+  """Annotates a syntax tree with the formatting of the source it came from.
+
+  The formatting of every node reached is stored in a single table, available
+  as the `formatting` attribute of the annotator. If a scope visitor is given,
+  it is notified of every node reached so that scope analysis happens in the
+  same traversal.
+  """
 
-  def __init__(self, source):
+  def __init__(self, source, scope_visitor=None):
     self.tokens = token_generator.TokenGenerator(source)
+    self.formatting = formatting.FormattingTable()
+    self._scope_visitor = scope_visitor
+
+  def enter_node(self, node):
+    ast_utils.setup_props(node, self.formatting)
+    if self._scope_visitor is not None:
+      self._scope_visitor.enter_node(node)
+
+  def leave_node(self, node):
+    if self._scope_visitor is not None:
+      self._scope_visitor.leave_node(node)
 
   @parenthesizable
   def visit_Num(self, node):
     """Annotate a Num node with the exact number format."""
-    token_number_type = token_generator.TOKENS.NUMBER
-    contentargs = [lambda: self.tokens.next_of_type(token_number_type)[1]]
+    ast_utils.setprop(node, 'n__src', node.n)
     if node.n < 0:
-      contentargs.insert(0, '-')
-    self.attr(node, 'content', contentargs, deps=('n',), default=str(node.n))
+      ast_utils.appendprop(node, 'content', self.token('-'))
+    token = self.tokens.next_of_type(token_generator.TOKENS.NUMBER)
+    ast_utils.appendprop(node, 'content', token[1])
 
   @parenthesizable
   def visit_Str(self, node):
     """Annotate a Str node with the exact string format."""
-    self.attr(node, 'content', [self.tokens.str], deps=('s',), default=node.s)
+    ast_utils.setprop(node, 's__src', node.s)
+    ast_utils.appendprop(node, 'content', self.tokens.str())
 
   def check_is_elif(self, node):
-    """Return True iff the If node is an `elif` in the source."""
+    """Return True iff the If node is an `elif` in the source.
+
+    This is recorded in the node's formatting for the printer.
+    """
     next_tok = self.tokens.next_name()
-    return isinstance(node, ast.If) and next_tok[1] == 'elif'
+    is_elif = isinstance(node, ast.If) and next_tok[1] == 'elif'
+    if is_elif:
+      ast_utils.setup_props(node, self.formatting)
+      ast_utils.setprop(node, 'is_elif', True)
+    return is_elif
 
   def check_is_continued_with(self, node):
-    """Return True iff the With node is a continued `with` in the source."""
-    return isinstance(node, ast.With) and self.tokens.peek()[1] == ','
+    """Return True iff the With node is a continued `with` in the source.
+
+    This is recorded in the node's formatting for the printer.
+    """
+    is_continued = (isinstance(node, ast.With) and
+                    self.tokens.peek()[1] == ',')
+    if is_continued:
+      ast_utils.setup_props(node, self.formatting)
+      ast_utils.setprop(node, 'is_continued', True)
+    return is_continued
 
   def ws(self, oneline=False):
     """Parse some whitespace from the source tokens and return it."""
     return self.tokens.whitespace(oneline=oneline)
 
+  def prefix(self, node):
+    """Parse whitespace from the source and add it to the node's prefix."""
+    ast_utils.appendprop(node, 'prefix', self.tokens.whitespace())
+
+  def suffix(self, node, oneline=False):
+    """Parse whitespace from the source and add it to the node's suffix."""
+    ast_utils.appendprop(node, 'suffix',
+                         self.tokens.whitespace(oneline=oneline))
+
   def token(self, token_val):
     """Parse a single token with exactly the given value."""
     token = self.tokens.next()
@@ -957,6 +1116,15 @@ class AstAnnotator(BaseVisitor):
       self.tokens.next()
       ast_utils.appendprop(node, attr_name, token[1] + self.ws())
 
+  def operator(self, node, attr_name, op, spaced=False):
+    """Parse an operator, storing its formatting on the node if it has any."""
+    pattern = _OPERATOR_PATTERNS[type(op), spaced]
+    if len(pattern) == 1:
+      self.token(pattern[0])
+    else:
+      ast_utils.setprop(node, attr_name + '__src', type(op))
+      self.attr(node, attr_name, pattern)
+
   def attr(self, node, attr_name, attr_vals, deps=None, default=None):
     """Parses some source and sets an attribute on the given node.
 
@@ -966,7 +1134,7 @@ class AstAnnotator(BaseVisitor):
     are a shorthand to look for an exactly matching token.
 
     For example:
-      self.attr(node, 'foo', ['(', self.ws, 'Hello, world!', self.ws, ')'],
+      self.attr(node, 'foo', ['(', WS, 'Hello, world!', WS, ')'],
                 deps=('s',), default=node.s)
 
     is a rudimentary way to parse a parenthesized string. After running this,
@@ -982,9 +1150,9 @@ class AstAnnotator(BaseVisitor):
     Arguments:
       node: (ast.AST) An AST node to attach formatting information to.
       attr_name: (string) Name to store the formatting information under.
-      attr_vals: (list of functions/strings) Each item is either a function
-        that parses some source and return a string OR a string to match
-        exactly (as a token).
+      attr_vals: (sequence of functions/strings) Each item is either a function
+        that parses some source and return a string, a string to match exactly
+        (as a token), or one of the whitespace markers WS and WS_ONELINE.
       deps: (optional, set of strings) Attributes of the node which attr_vals
         depends on.
       default: (string) Unused here.
@@ -996,12 +1164,21 @@ class AstAnnotator(BaseVisitor):
     for attr_val in attr_vals:
       if isinstance(attr_val, six.string_types):
         ast_utils.appendprop(node, attr_name, self.token(attr_val))
+      elif attr_val is WS:
+        ast_utils.appendprop(node, attr_name, self.tokens.whitespace())
+      elif attr_val is WS_ONELINE:
+        ast_utils.appendprop(node, attr_name,
+                             self.tokens.whitespace(oneline=True))
       else:
         ast_utils.appendprop(node, attr_name, attr_val())
 
-  def scope(self, node):
-    """Return a context manager to handle a parenthesized scope."""
-    return self.tokens.scope(node)
+  def open_scope(self, node):
+    """Parse any parentheses opening a scope before the node."""
+    self.tokens.open_scope(node)
+
+  def close_scope(self, node):
+    """Parse any parentheses closing a scope after the node."""
+    self.tokens.close_scope(node)
 
   def _optional_suffix(self, token_type, token_val):
     token = self.tokens.peek()
@@ -37,6 +37,38 @@ class SymmetricTest(test_utils.TestCase):
   pass
 
 
+class AnnotatorTest(test_utils.TestCase):
+
+  def test_operator_formatting_on_parent(self):
+    src = 'a is  not b <c\n'
+    t = pasta.parse(src)
+    node = t.body[0].value
+    self.assertEqual('is  not ', ast_utils.prop(node, 'op0'))
+    self.assertEqual('<', ast_utils.prop(node, 'op1'))
+    self.assertFalse(hasattr(node.ops[0], 'a'))
+
+    node.ops[0] = ast.NotIn()
+    self.assertEqual('a not in b <c\n', codegen.to_str(t))
+
+  def test_replaced_operator_keeps_comment(self):
+    t = pasta.parse('x = (a <  # c\n     b)\n')
+    t.body[0].value.ops[0] = ast.Gt()
+    self.assertEqual('x = (a >  # c\n     b)\n', codegen.to_str(t))
+
+
+class DeepTreeTest(test_utils.TestCase):
+
+  def test_long_binop_chain(self):
+    src = 'x = ' + ' + '.join(['a'] * 2500) + '\n'
+    t = pasta.parse(src)
+    self.assertMultiLineEqual(src, codegen.to_str(t))
+
+  def test_long_attribute_chain(self):
+    src = 'x = (a' + '.b' * 2500 + ')\n'
+    t = pasta.parse(src)
+    self.assertMultiLineEqual(src, codegen.to_str(t))
+
+
 def symmetric_test_generator(filepath):
   def test(self):
     with open(filepath, 'r') as handle:
@@ -80,6 +112,8 @@ for dirpath, dirs, files in os.walk(data_dir):
 def suite():
   result = unittest.TestSuite()
   result.addTests(unittest.makeSuite(SymmetricTest))
+  result.addTests(unittest.makeSuite(AnnotatorTest))
+  result.addTests(unittest.makeSuite(DeepTreeTest))
   return result
 
 
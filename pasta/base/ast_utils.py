@@ -19,9 +19,10 @@ from __future__ import division
 from __future__ import print_function
 
 import ast
-import collections
 import itertools
 
+from pasta.base import formatting
+
 
 def find_starargs(call_node):
   """Finds the index of starargs in a call's arguments, if present.
@@ -44,30 +45,8 @@ def find_starargs(call_node):
   return len(call_node.args) + sorted(locs).index(starargs_loc)
 
 
-_AST_OP_NODES = (
-    ast.And, ast.Or, ast.Eq, ast.NotEq, ast.Is, ast.IsNot, ast.In, ast.NotIn,
-    ast.Lt, ast.LtE, ast.Gt, ast.GtE, ast.Add, ast.Sub, ast.Mult, ast.Div,
-    ast.Mod, ast.Pow, ast.LShift, ast.RShift, ast.BitAnd, ast.BitOr, ast.BitXor,
-    ast.FloorDiv, ast.Invert, ast.Not, ast.UAdd, ast.USub
-) 
-
-
-class _TreeNormalizer(ast.NodeTransformer):
-  """Replaces all op nodes with unique instances."""
-
-  def visit(self, node):
-    if isinstance(node, _AST_OP_NODES):
-      return node.__class__()
-    return super(_TreeNormalizer, self).visit(node)
-
-
-def normalize(tree):
-  _TreeNormalizer().visit(tree)
-  return tree
-
-
 def parse(src):
-  return normalize(ast.parse(src))
+  return ast.parse(src)
 
 
 def space_between(from_loc, to_loc, line, lines):
@@ -94,10 +73,23 @@ def space_between(from_loc, to_loc, line, lines):
   return result
 
 
-def setup_props(node):
-  if not hasattr(node, 'a'):
+def setup_props(node, table=None):
+  """Give a node somewhere to store formatting, if it has none yet.
+
+  Nodes with no fields or attributes, such as ast.Load and ast.Add, are left
+  alone: ast.parse shares a single instance of each between all trees.
+
+  Arguments:
+    node: (ast.AST) Node to set up.
+    table: (formatting.FormattingTable) Table to store the formatting in,
+      usually shared by every node of a tree. If not given, the node gets a
+      table of its own.
+  """
+  if not hasattr(node, 'a') and (node._fields or node._attributes):
+    if table is None:
+      table = formatting.FormattingTable()
     try:
-      node.a = collections.defaultdict(lambda: '')
+      node.a = table.new_node()
     except AttributeError:
       pass
 
@@ -121,6 +113,219 @@ def prependprop(node, name, value):
   node.a[name] = value + node.a[name]
 
 
+def mark_changed(node):
+  """Note that the fields of a node have been changed.
+
+  This must be called after changing a node of a tree whose spans have been
+  recorded (see codegen.record_spans), so that neither the node nor any of its
+  ancestors is copied from the source it was parsed from.
+  """
+  if hasattr(node, 'a'):
+    node.a.drop_span()
+
+
+def set_field(node, name, value):
+  """Set a field of a node, as part of any transaction on its tree.
+
+  The node is also marked as changed (see mark_changed).
+  """
+  transaction = _transaction(node)
+  if transaction is not None:
+    if hasattr(node, name):
+      transaction.record(setattr, node, name, getattr(node, name))
+    else:
+      transaction.record(delattr, node, name)
+  setattr(node, name, value)
+  mark_changed(node)
+
+
+def insert_child(node, name, index, child):
+  """Insert a child into a list field of a node, as part of any transaction.
+
+  Arguments:
+    node: (ast.AST) Node to change.
+    name: (string) Name of the list field, e.g. 'body'.
+    index: (int) Index to insert the child at.
+    child: (ast.AST) Child to insert.
+  """
+  children = getattr(node, name)
+  if index < 0:
+    index = max(0, len(children) + index)
+  index = min(index, len(children))
+  transaction = _transaction(node)
+  if transaction is not None:
+    transaction.attach(child)
+    transaction.record(children.pop, index)
+  children.insert(index, child)
+  mark_changed(node)
+
+
+def remove_child(node, name, child):
+  """Remove a child from a list field of a node, as part of any transaction.
+
+  Arguments:
+    node: (ast.AST) Node to change.
+    name: (string) Name of the list field, e.g. 'names'.
+    child: (ast.AST) Child to remove; it is found by identity.
+  """
+  children = getattr(node, name)
+  for index, c in enumerate(children):
+    if c is child:
+      break
+  else:
+    raise ValueError('%r is not in the %s of %r' % (child, name, node))
+  transaction = _transaction(node)
+  if transaction is not None:
+    transaction.record(children.insert, index, child)
+  del children[index]
+  mark_changed(node)
+
+
+def _transaction(node):
+  if hasattr(node, 'a'):
+    return node.a._table.transaction
+  return None
+
+
+class Transaction(object):
+  """Record of the changes made to a syntax tree, which can be undone.
+
+  While a transaction is open, all changes to the formatting of the tree are
+  recorded, as are changes to its fields made with set_field, insert_child and
+  remove_child (which augmentations such as rename.rename_external use). Both
+  rollback and commit take time proportional to the number of changes.
+
+  Changes are recorded through the formatting table the tree's nodes share, and
+  the tables of any nodes inserted into it while the transaction is open. Nodes
+  with formatting in other tables are not covered.
+
+  Transactions can be used as context managers, which commit if the block
+  succeeds and roll back if it raises an exception.
+  """
+
+  def __init__(self, tree):
+    """Open a transaction on a tree.
+
+    Arguments:
+      tree: (ast.AST) Annotated syntax tree.
+    Raises:
+      ValueError: if a transaction is already open on the tree.
+    """
+    self._log = []
+    self._tables = []
+    self.attach(tree)
+
+  def attach(self, node):
+    """Record changes to the formatting table of a node, if not already."""
+    if not hasattr(node, 'a'):
+      return
+    table = node.a._table
+    if table.transaction is self:
+      return
+    if table.transaction is not None:
+      raise ValueError('A transaction is already open on %r' % node)
+    table.transaction = self
+    self._tables.append(table)
+
+  def record(self, undo, *args):
+    """Record a change, given a function and arguments which undo it."""
+    self._log.append((undo, args))
+
+  def commit(self):
+    """Keep all of the changes made, and stop recording."""
+    self._close()
+
+  def rollback(self):
+    """Undo all of the changes made, in reverse order, and stop recording."""
+    for undo, args in reversed(self._log):
+      undo(*args)
+    self._close()
+
+  def _close(self):
+    for table in self._tables:
+      table.transaction = None
+    self._tables = []
+    self._log = []
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    if exc_type is None:
+      self.commit()
+    else:
+      self.rollback()
+
+
+def clone(node):
+  """Copy an annotated node and all of its descendants.
+
+  This gives the same result as copy.deepcopy, much more quickly: fields which
+  are not nodes are shared rather than copied, as are nodes with no fields or
+  attributes (see setup_props), and formatting strings are shared with the
+  original. Spans are not copied, since copies are usually placed elsewhere in a
+  tree.
+
+  When the copy covers most of the nodes of a formatting table, as when a whole
+  tree is cloned, the copy's table is a fork of the original, which shares all
+  of its values until either of them is changed.
+
+  Cloning a large tree allocates many objects, which can set off the garbage
+  collector several times; callers cloning many trees may find it faster to
+  disable it around their work.
+
+  Arguments:
+    node: (ast.AST) Node to copy.
+  Returns:
+    The copy of the node.
+  """
+  copies = []
+  result = _clone_node(node, copies)
+  stack = [result]
+  while stack:
+    copy = stack.pop()
+    fields = copy.__dict__
+    for name, value in fields.items():
+      if isinstance(value, ast.AST):
+        if value._fields or value._attributes:
+          fields[name] = value = _clone_node(value, copies)
+          stack.append(value)
+      elif isinstance(value, list):
+        fields[name] = value = list(value)
+        for i, child in enumerate(value):
+          if isinstance(child, ast.AST) and (child._fields or
+                                             child._attributes):
+            value[i] = child = _clone_node(child, copies)
+            stack.append(child)
+
+  # Give the copies formatting in a table for each of the original tables.
+  by_table = {}
+  for copy, original in copies:
+    by_table.setdefault(id(original._table), []).append((copy, original))
+  for pairs in by_table.values():
+    table = pairs[0][1]._table
+    if 2 * len(pairs) >= len(table):
+      forked = table.fork()
+      for copy, original in pairs:
+        copy.a = formatting.NodeFormatting(forked, original._index)
+    else:
+      copied = table.copy_nodes([original._index for _, original in pairs])
+      for i, (copy, _) in enumerate(pairs):
+        copy.a = formatting.NodeFormatting(copied, i)
+  return result
+
+
+def _clone_node(node, copies):
+  """Copy a node without its children, noting its formatting in copies."""
+  result = node.__class__.__new__(node.__class__)
+  fields = dict(node.__dict__)
+  original = fields.pop('a', None)
+  result.__dict__.update(fields)
+  if original is not None:
+    copies.append((result, original))
+  return result
+
+
 def find_nodes_by_type(node, accept_types):
   visitor = FindNodeVisitor(lambda n: isinstance(n, accept_types))
   visitor.visit(node)
@@ -134,6 +339,9 @@ class FindNodeVisitor(ast.NodeVisitor):
     self.results = []
 
   def visit(self, node):
-    if self._condition(node):
-      self.results.append(node)
-    super(FindNodeVisitor, self).visit(node)
+    stack = [node]
+    while stack:
+      node = stack.pop()
+      if self._condition(node):
+        self.results.append(node)
+      stack.extend(reversed(list(ast.iter_child_nodes(node))))
@@ -0,0 +1,129 @@
+# coding=utf-8
+"""Tests for ast_utils."""
+# Copyright 2017 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import ast
+import unittest
+
+import pasta
+from pasta.augment import rename
+from pasta.base import ast_utils
+from pasta.base import formatting
+from pasta.base import test_utils
+
+
+def _state(tree):
+  return [(type(node).__name__,
+           [(name, value) for name, value in ast.iter_fields(node)
+            if not isinstance(value, (ast.AST, list))],
+           sorted(node.a.items()) if hasattr(node, 'a') else None)
+          for node in ast.walk(tree)]
+
+
+class TransactionTest(test_utils.TestCase):
+
+  def test_rollback_rename(self):
+    src = 'from aaa.bbb import ccc, ddd\n\ndef f():\n  return ccc + ddd\n'
+    t = pasta.parse(src, record_spans=True)
+    before = _state(t)
+    transaction = ast_utils.Transaction(t)
+    rename.rename_external(t, 'aaa.bbb.ccc', 'xxx.yyy')
+    self.assertEqual(3, len(t.body))
+    transaction.rollback()
+    self.assertEqual(before, _state(t))
+    self.assertMultiLineEqual(src, pasta.dump(t))
+    self.assertTrue(ast_utils.prop(t, formatting.SPAN))
+
+  def test_commit(self):
+    src = 'from aaa import bbb\nx = bbb\n'
+    t = pasta.parse(src)
+    with ast_utils.Transaction(t) as transaction:
+      rename.rename_external(t, 'aaa.bbb', 'aaa.ccc')
+    self.assertMultiLineEqual('from aaa import ccc\nx = bbb\n', pasta.dump(t))
+    transaction.rollback()
+    self.assertMultiLineEqual('from aaa import ccc\nx = bbb\n', pasta.dump(t))
+    self.assertIsNone(t.a._table.transaction)
+
+  def test_rollback_on_error(self):
+    src = 'a = [1, 2]\n'
+    t = pasta.parse(src)
+    with self.assertRaises(RuntimeError):
+      with ast_utils.Transaction(t):
+        ast_utils.set_field(t.body[0].targets[0], 'id', 'b')
+        ast_utils.remove_child(t.body[0].value, 'elts', t.body[0].value.elts[0])
+        ast_utils.setprop(t.body[0], 'prefix', '  ')
+        ast_utils.insert_child(t, 'body', 0, pasta.parse('c = 3\n').body[0])
+        raise RuntimeError()
+    self.assertMultiLineEqual(src, pasta.dump(t))
+    ast_utils.set_field(t.body[0].targets[0], 'id', 'b')
+    self.assertMultiLineEqual('b = [1, 2]\n', pasta.dump(t))
+
+  def test_nested_transaction(self):
+    t = pasta.parse('a = 1\n')
+    with ast_utils.Transaction(t):
+      with self.assertRaises(ValueError):
+        ast_utils.Transaction(t)
+
+
+class CloneTest(test_utils.TestCase):
+
+  def test_clone_tree(self):
+    src = 'def f(a, b=1):\n  # Comment\n  return [a + b, -a]  # Sum\n'
+    t = pasta.parse(src, record_spans=True)
+    clone = ast_utils.clone(t)
+    self.assertEqual(ast.dump(t), ast.dump(clone))
+    self.assertMultiLineEqual(src, pasta.dump(clone))
+    originals = list(ast.walk(t))
+    for node in ast.walk(clone):
+      if node._fields or node._attributes:
+        self.assertNotIn(node, originals)
+    self.assertFalse(ast_utils.prop(clone, formatting.SPAN))
+
+    ast_utils.appendprop(clone.body[0].body[0], 'prefix', '  ')
+    clone.body[0].name = 'g'
+    self.assertMultiLineEqual(src, pasta.dump(t))
+    self.assertTrue(ast_utils.prop(t, formatting.SPAN))
+    self.assertMultiLineEqual(
+        'def g(a, b=1):\n  # Comment\n    return [a + b, -a]  # Sum\n',
+        pasta.dump(clone))
+
+  def test_clone_subtree(self):
+    src = 'a = 1\nif b:\n  c = (d)\n'
+    t = pasta.parse(src)
+    clone = ast_utils.clone(t.body[1].body[0])
+    self.assertMultiLineEqual('c = (d)\n', pasta.dump(clone))
+    self.assertEqual(3, len(clone.a._table))
+    self.assertIs(clone.a._table, clone.value.a._table)
+
+  def test_clone_lists(self):
+    t = pasta.parse('global a, b\n')
+    clone = ast_utils.clone(t)
+    clone.body[0].names.append('c')
+    self.assertEqual(['a', 'b'], t.body[0].names)
+
+
+def suite():
+  result = unittest.TestSuite()
+  result.addTests(unittest.makeSuite(TransactionTest))
+  result.addTests(unittest.makeSuite(CloneTest))
+  return result
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,272 @@
+# coding=utf-8
+"""Split python source into independently annotated top-level chunks.
+
+Top-level statements always begin at column 0 of a new line, so the source of a
+module can be cut at the first line of any top-level statement and each piece
+can be tokenized and annotated on its own. The formatting of the pieces can then
+be stitched back together into a single annotated module.
+"""
+# Copyright 2017 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import __future__
+import ast
+import bisect
+
+from pasta.base import annotate
+from pasta.base import ast_utils
+from pasta.base import formatting
+
+_IMPORT_TYPES = (ast.Import, ast.ImportFrom)
+
+
+def statement_start(stmt):
+  """Get the first line of a top-level statement, including its decorators."""
+  return min([stmt.lineno] +
+             [d.lineno for d in getattr(stmt, 'decorator_list', ())])
+
+
+def split_points(tree, lines):
+  """Find the lines where the source of a module can be split.
+
+  A statement is a split point if it starts a line of its own; statements that
+  share a line with the previous statement (e.g. `a = 1; b = 2`) stay attached
+  to it.
+
+  Arguments:
+    tree: (ast.Module) Syntax tree parsed from the source.
+    lines: (list of string) Lines of the source, including line endings.
+  Returns:
+    A list of (lineno, index) pairs, where index is the index in tree.body of
+    the statement beginning at lineno. The first statement is always included.
+  """
+  result = []
+  for i, stmt in enumerate(tree.body):
+    lineno = statement_start(stmt)
+    line = lines[lineno - 1] if lineno <= len(lines) else ''
+    if not result or (line[:1] not in ('', ' ', '\t', '\x0c') and
+                      lineno > result[-1][0]):
+      result.append((lineno, i))
+  return result
+
+
+def group(points, lines, max_chunks):
+  """Group split points into at most max_chunks line ranges of similar size.
+
+  Arguments:
+    points: (list of (int, int)) Split points, as returned by split_points.
+    lines: (list of string) Lines of the source, including line endings.
+    max_chunks: (int) Maximum number of ranges to return.
+  Returns:
+    A list of (start, end) line ranges, where start is 1-based and inclusive and
+    end is exclusive. The first range starts at line 1 and the last range covers
+    the rest of the source.
+  """
+  if not points:
+    return [(1, len(lines) + 1)]
+  offsets = [0]
+  for line in lines:
+    offsets.append(offsets[-1] + len(line))
+  target = offsets[-1] / max(1, max_chunks)
+
+  starts = [1]
+  for lineno, _ in points[1:]:
+    if offsets[lineno - 1] - offsets[starts[-1] - 1] >= target:
+      starts.append(lineno)
+  return list(zip(starts, starts[1:] + [len(lines) + 1]))
+
+
+def annotate_source(src, lineno=1, flags=0):
+  """Parse and annotate a chunk of source that begins at the given line.
+
+  Arguments:
+    src: (string) Source of one or more complete top-level statements.
+    lineno: (int) Line number in the full source that the chunk begins at.
+    flags: (int) Compiler flags of any __future__ imports earlier in the full
+      source.
+  Returns:
+    The annotated ast.Module for the chunk, with line numbers relative to the
+    full source.
+  """
+  tree = compile(src, '<unknown>', 'exec', ast.PyCF_ONLY_AST | flags, True)
+  annotate.AstAnnotator(src).visit(tree)
+  if lineno > 1:
+    for stmt in tree.body:
+      ast.increment_lineno(stmt, lineno - 1)
+  return tree
+
+
+def future_flags(tree):
+  """Get the compiler flags of the __future__ imports of a module."""
+  flags = 0
+  for stmt in tree.body:
+    if isinstance(stmt, ast.ImportFrom) and stmt.module == '__future__':
+      for alias in stmt.names:
+        feature = getattr(__future__, alias.name, None)
+        if feature is not None:
+          flags |= feature.compiler_flag
+  return flags
+
+
+def join(trees):
+  """Stitch annotated chunks back together into a single module.
+
+  Whitespace and comments which ended one chunk, and any which started the next
+  one, belong to the prefix of the next chunk's first statement (as they would
+  if the whole source had been annotated at once).
+
+  Arguments:
+    trees: (list of ast.Module) Annotated chunks, in source order.
+  Returns:
+    The first module in trees, with the statements of the others appended.
+  """
+  result = trees[0]
+  for tree in trees[1:]:
+    between = (ast_utils.prop(result, 'suffix') +
+               ast_utils.prop(tree, 'prefix'))
+    if tree.body:
+      ast_utils.prependprop(tree.body[0], 'prefix', between)
+      ast_utils.setprop(result, 'suffix', ast_utils.prop(tree, 'suffix'))
+    else:
+      ast_utils.setprop(result, 'suffix',
+                        between + ast_utils.prop(tree, 'suffix'))
+    result.body.extend(tree.body)
+  return result
+
+
+def annotate_imports(src):
+  """Parse source, annotating only its top-level import statements.
+
+  Every other top-level statement keeps the exact source it was parsed from as
+  its 'verbatim' formatting, which is printed in place of the statement; such
+  statements can be analyzed but must not be modified. If the source has any
+  imports which are not top-level statements, or top-level statements which
+  share a line, it is fully annotated instead.
+
+  Arguments:
+    src: (string) Python source code to parse.
+  Returns:
+    The annotated ast.Module.
+  """
+  tree = ast.parse(src)
+  if any(isinstance(node, _IMPORT_TYPES)
+         for stmt in tree.body if not isinstance(stmt, _IMPORT_TYPES)
+         for node in ast.walk(stmt)):
+    return annotate_source(src)
+  return _annotate_selected(
+      src, tree, lambda stmt, start, end: isinstance(stmt, _IMPORT_TYPES))
+
+
+def annotate_lines(src, line_ranges):
+  """Parse source, annotating only the top-level statements in some lines.
+
+  A top-level statement is annotated if any of its lines, or of the comments and
+  blank lines after it, is in one of the ranges. Every other top-level
+  statement keeps its source verbatim, as for annotate_imports, and must not be
+  modified. If the source has top-level statements which share a line, it is
+  fully annotated instead.
+
+  Arguments:
+    src: (string) Python source code to parse.
+    line_ranges: (list of (int, int)) Ranges of lines, each given as the first
+      and last line in it (1-based and inclusive).
+  Returns:
+    The annotated ast.Module.
+  """
+  line_ranges = sorted(line_ranges)
+  firsts = [first for first, _ in line_ranges]
+  # The furthest line reached by any of the ranges up to each one.
+  reach = []
+  for _, last in line_ranges:
+    reach.append(max(last, reach[-1]) if reach else last)
+
+  def selected(stmt, start, end):
+    # Whether any range starting before the statement's end reaches its start.
+    del stmt
+    i = bisect.bisect_left(firsts, end)
+    return i > 0 and reach[i - 1] >= start
+
+  return _annotate_selected(src, ast.parse(src), selected)
+
+
+def is_verbatim(stmt):
+  """Whether a statement was left unannotated, keeping its source verbatim."""
+  return bool(ast_utils.prop(stmt, 'verbatim'))
+
+
+def annotated_statements(tree):
+  """Get the top-level statements of a module which were annotated.
+
+  Transforms of a module parsed by annotate_imports or annotate_lines should
+  only change these statements.
+  """
+  return [stmt for stmt in tree.body if not is_verbatim(stmt)]
+
+
+def _annotate_selected(src, tree, selected):
+  """Annotate some top-level statements, keeping the others verbatim.
+
+  Arguments:
+    src: (string) Python source code.
+    tree: (ast.Module) Syntax tree parsed from src.
+    selected: (function) Called with each top-level statement, the first line
+      of its source and the line after it, to decide whether to annotate it.
+  Returns:
+    The annotated ast.Module.
+  """
+  lines = src.splitlines(True)
+  points = split_points(tree, lines)
+  if not tree.body or len(points) != len(tree.body):
+    return annotate_source(src)
+
+  flags = future_flags(tree)
+  table = formatting.FormattingTable()
+  ast_utils.setup_props(tree, table)
+  body = tree.body
+  tree.body = []
+  starts = [1] + [lineno for lineno, _ in points[1:]] + [len(lines) + 1]
+  between = ''
+  i = 0
+  while i < len(body):
+    if not selected(body[i], starts[i], starts[i + 1]):
+      stmt = body[i]
+      ast_utils.setup_props(stmt, table)
+      ast_utils.setprop(stmt, 'prefix', between)
+      ast_utils.setprop(stmt, 'verbatim',
+                        ''.join(lines[starts[i] - 1:starts[i + 1] - 1]))
+      tree.body.append(stmt)
+      between = ''
+      i += 1
+      continue
+
+    # Annotate each run of consecutive selected statements together.
+    j = i + 1
+    while j < len(body) and selected(body[j], starts[j], starts[j + 1]):
+      j += 1
+    chunk = annotate_source(''.join(lines[starts[i] - 1:starts[j] - 1]),
+                            starts[i], flags)
+    if i == 0:
+      ast_utils.setprop(tree, 'prefix', ast_utils.prop(chunk, 'prefix'))
+    else:
+      between += ast_utils.prop(chunk, 'prefix')
+    ast_utils.prependprop(chunk.body[0], 'prefix', between)
+    between = ast_utils.prop(chunk, 'suffix')
+    tree.body.extend(chunk.body)
+    i = j
+  ast_utils.setprop(tree, 'suffix', between)
+  return tree
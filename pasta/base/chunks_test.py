@@ -0,0 +1,177 @@
+# coding=utf-8
+"""Tests for chunks."""
+# Copyright 2017 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import ast
+import textwrap
+import unittest
+
+import six
+
+from pasta.base import ast_utils
+from pasta.base import chunks
+from pasta.base import codegen
+from pasta.base import test_utils
+
+
+class ChunksTest(test_utils.TestCase):
+
+  def test_split_points(self):
+    src = textwrap.dedent("""\
+        # A comment
+        import a
+        b = 1; c = 2
+
+        @decorator
+        def d():
+          pass
+        if e: pass
+        """)
+    points = chunks.split_points(ast.parse(src), src.splitlines(True))
+    self.assertEqual([(2, 0), (3, 1), (5, 3), (8, 4)], points)
+
+  def test_group(self):
+    src = 'a = 1\nb = 2\nc = 3\nd = 4\n'
+    lines = src.splitlines(True)
+    points = chunks.split_points(ast.parse(src), lines)
+    self.assertEqual([(1, 5)], chunks.group(points, lines, 1))
+    self.assertEqual([(1, 3), (3, 5)], chunks.group(points, lines, 2))
+    self.assertEqual([(1, 2), (2, 3), (3, 4), (4, 5)],
+                     chunks.group(points, lines, 10))
+
+  def test_annotate_and_join(self):
+    src = textwrap.dedent("""\
+        # Leading comment
+        def foo():
+          return 1
+          # Trailing comment
+
+        # Comment before bar
+        bar = foo  # Comment after bar
+
+
+        baz = bar
+        # Comment at the end
+        """)
+    lines = src.splitlines(True)
+    points = chunks.split_points(ast.parse(src), lines)
+    trees = [chunks.annotate_source(''.join(lines[start - 1:end - 1]), start)
+             for start, end in chunks.group(points, lines, 10)]
+    self.assertEqual(3, len(trees))
+
+    tree = chunks.join(trees)
+    self.assertEqual(3, len(tree.body))
+    self.assertEqual([2, 7, 10], [stmt.lineno for stmt in tree.body])
+    self.assertEqual(7, tree.body[1].value.lineno)
+    self.assertMultiLineEqual(src, codegen.to_str(tree))
+
+  def test_annotate_imports(self):
+    src = textwrap.dedent("""\
+        # A comment
+        \"\"\"Docstring.\"\"\"
+
+        from a import b  # Comment
+        from c import d,  e
+        # Comment
+        def f():
+          return b
+
+        x = [1,
+             2]
+        from g import h
+
+        # Comment at the end
+        """)
+    tree = chunks.annotate_imports(src)
+    self.assertEqual(ast.dump(ast.parse(src), include_attributes=True),
+                     ast.dump(tree, include_attributes=True))
+    self.assertMultiLineEqual(src, codegen.to_str(tree))
+    self.assertTrue(
+        codegen.to_str(tree.body[2]).startswith('from c import d,  e\n'))
+    self.assertTrue(ast_utils.prop(tree.body[3], 'verbatim'))
+    self.assertFalse(hasattr(tree.body[3].body[0], 'a'))
+
+  def test_annotate_imports_nested(self):
+    src = 'def f():\n  from a import b\n  return b\nx = 1\n'
+    tree = chunks.annotate_imports(src)
+    self.assertFalse(ast_utils.prop(tree.body[0], 'verbatim'))
+    self.assertTrue(hasattr(tree.body[0].body[0], 'a'))
+    self.assertMultiLineEqual(src, codegen.to_str(tree))
+
+  def test_annotate_lines(self):
+    src = textwrap.dedent("""\
+        import a
+
+        def f():
+          return a
+        # Comment after f
+
+        x = [1,
+             2]
+        y = 3
+        z = 4
+        """)
+    tree = chunks.annotate_lines(src, [(8, 8), (5, 5)])
+    self.assertEqual(ast.dump(ast.parse(src), include_attributes=True),
+                     ast.dump(tree, include_attributes=True))
+    self.assertMultiLineEqual(src, codegen.to_str(tree))
+    self.assertEqual([False, True, True, False, False],
+                     [not chunks.is_verbatim(stmt) for stmt in tree.body])
+    self.assertEqual(tree.body[1:3], chunks.annotated_statements(tree))
+    self.assertTrue(hasattr(tree.body[1].body[0], 'a'))
+    self.assertFalse(hasattr(tree.body[3].value, 'a'))
+
+    for stmt in chunks.annotated_statements(tree):
+      for node in ast.walk(stmt):
+        if isinstance(node, ast.Name):
+          node.id = node.id.upper()
+    self.assertMultiLineEqual(src.replace('return a', 'return A').replace(
+        'x = [', 'X = ['), codegen.to_str(tree))
+
+  def test_annotate_lines_none(self):
+    src = 'a = 1\nb = 2\n'
+    tree = chunks.annotate_lines(src, [])
+    self.assertEqual([], chunks.annotated_statements(tree))
+    self.assertMultiLineEqual(src, codegen.to_str(tree))
+
+  @unittest.skipIf(six.PY3, 'Only changes the parse of python 2 code.')
+  def test_annotate_lines_future_imports(self):
+    src = textwrap.dedent("""\
+        from __future__ import print_function
+        from __future__ import unicode_literals
+        import sys
+
+        print('a', file=sys.stderr)
+        x = 'b'
+        """)
+    tree = chunks.annotate_lines(src, [(5, 6)])
+    self.assertEqual(ast.dump(ast.parse(src), include_attributes=True),
+                     ast.dump(tree, include_attributes=True))
+    self.assertIsInstance(tree.body[-1].value.s, six.text_type)
+    self.assertMultiLineEqual(src, codegen.to_str(tree))
+
+
+def suite():
+  result = unittest.TestSuite()
+  result.addTests(unittest.makeSuite(ChunksTest))
+  return result
+
+
+if __name__ == '__main__':
+  unittest.main()
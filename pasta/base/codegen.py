@@ -18,13 +18,21 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
-import collections
+import ast
+import bisect
+
+import six
 
 from pasta.base import annotate
+from pasta.base import ast_constants
 from pasta.base import ast_utils
+from pasta.base import formatting
 
 # TODO: Handle indentation correctly on inserted nodes
 
+# Number of characters to buffer before writing to a Printer's output file.
+FLUSH_SIZE = 1 << 16
+
 
 class Printer(annotate.BaseVisitor):
   """Traverses an AST and generates formatted python source code.
@@ -34,34 +42,167 @@ class Printer(annotate.BaseVisitor):
   the node, this is output exactly as it was read in unless one or more of the
   dependency attributes used to generate it has changed, in which case its
   default formatting is used.
+
+  If spans have been recorded for the tree (see record_spans), subtrees which
+  have not been changed since are copied from the source in one piece.
+
+  If a source map is requested, the printer also records which position of the
+  original source each piece of the code it generates came from; see SourceMap.
   """
 
-  def __init__(self):
-    self.code = ''
+  # Whether to copy unchanged subtrees from the source they were parsed from.
+  _use_spans = True
+
+  def __init__(self, out=None, source_map=False):
+    """Create a printer.
+
+    Arguments:
+      out: (file-like object) If given, code is written to out in chunks of
+        about FLUSH_SIZE characters as it is generated, and the rest is written
+        by flush(). Otherwise, all of the code is kept in memory as `code`.
+      source_map: (bool) Whether to record a SourceMap of the generated code,
+        as `source_map`.
+    """
+    self._out = out
+    self._chunks = []
+    self._size = 0
+    # Total number of characters generated so far.
+    self._offset = 0
+    self.source_map = SourceMap() if source_map else None
+    # Origins in the source of the nodes being visited, if mapping, starting
+    # with that of code outside of any node.
+    self._origins = [None] if source_map else None
+    # Nodes being visited, and bitmasks of the ids of attributes printed so far
+    # for each. The printer keeps all of its state here rather than on the
+    # nodes, so that a tree can be printed by many printers at once.
+    self._nodes = []
+    self._printed = []
 
-  def visit(self, node):
-    node._printer_info = collections.defaultdict(lambda: False)
-    super(Printer, self).visit(node)
-    del node._printer_info
+  @property
+  def code(self):
+    """All of the code generated so far which has not been written out."""
+    if len(self._chunks) > 1:
+      self._chunks[:] = [''.join(self._chunks)]
+    return self._chunks[0] if self._chunks else ''
+
+  def write(self, value):
+    """Add some code to the output."""
+    if not value:
+      return
+    self._chunks.append(value)
+    self._offset += len(value)
+    if self._out is not None:
+      self._size += len(value)
+      if self._size >= FLUSH_SIZE:
+        self.flush()
+
+  def flush(self):
+    """Write all of the buffered code to the output file, if there is one."""
+    if self._out is not None and self._chunks:
+      self._out.write(''.join(self._chunks))
+      del self._chunks[:]
+      self._size = 0
+
+  def enter_node(self, node):
+    origins = self._origins
+    if self._use_spans:
+      span = ast_utils.prop(node, formatting.SPAN)
+      if span:
+        source, start, end, _ = span
+        if origins is not None:
+          self.source_map.add(self._offset, (source, start))
+          self.write(source[start:end])
+          self.source_map.add(self._offset, origins[-1])
+        else:
+          self.write(source[start:end])
+        return True
+    self._nodes.append(node)
+    self._printed.append(0)
+    if origins is not None:
+      origins.append(self._origin(node))
+      self.source_map.add(self._offset, origins[-1])
+
+  def leave_node(self, node):
+    self._nodes.pop()
+    self._printed.pop()
+    if self._origins is not None:
+      self._origins.pop()
+      if len(self._origins) > 1:
+        self.source_map.add(self._offset, self._origins[-1])
+
+  def _origin(self, node):
+    """Get the origin of the code printed for a node, for the source map.
+
+    Code belongs to the innermost node with a position in the source. Nodes
+    which were not annotated from source have been synthesized, as has all the
+    code printed within them.
+    """
+    if not hasattr(node, 'a'):
+      return None
+    if hasattr(node, 'col_offset'):
+      return node.lineno, node.col_offset
+    if isinstance(node, ast.Module):
+      return 1, 0
+    return self._origins[-1]
+
+  @annotate.spaced
+  def visit_Module(self, node):
+    for stmt in node.body:
+      verbatim = ast_utils.prop(stmt, 'verbatim')
+      if verbatim:
+        # Statements left unannotated by chunks.annotate_imports
+        if self._origins is not None:
+          self.source_map.add(self._offset, self._origin(stmt))
+          self.write(ast_utils.prop(stmt, 'prefix') + verbatim)
+          self.source_map.add(self._offset, self._origins[-1])
+        else:
+          self.write(ast_utils.prop(stmt, 'prefix') + verbatim)
+      else:
+        yield stmt
+    self.attr(node, 'suffix', ())
 
   def visit_Num(self, node):
     self.prefix(node)
-    self.code += node.a.get('content', repr(node.n))
+    self.write(ast_utils.prop(node, 'content') or repr(node.n))
     self.suffix(node)
 
   def visit_Str(self, node):
     self.prefix(node)
-    self.code += node.a.get('content', repr(node.s))
+    self.write(ast_utils.prop(node, 'content') or repr(node.s))
     self.suffix(node)
 
   def token(self, value):
-    self.code += value
+    self.write(value)
 
   def optional_suffix(self, node, attr_name, token_val):
     del token_val
     if not hasattr(node, 'a'):
       return
-    self.code += ast_utils.prop(node, attr_name)
+    self.write(ast_utils.prop(node, attr_name))
+
+  def operator(self, node, attr_name, op, spaced=False):
+    """Add the formatted data stored for an operator belonging to this node.
+
+    If the operator has been replaced with one of a different type since the
+    node was annotated, the new operator is printed in place of the tokens of
+    the old one, keeping the whitespace and any comment around them.
+    """
+    formatted = ast_utils.prop(node, attr_name)
+    src_type = ast_utils.prop(node, attr_name + '__src')
+    if src_type is type(op):
+      self.write(formatted)
+      return
+    tokens = ' '.join(ast_constants.NODE_TYPE_TO_TOKENS[type(op)])
+    if not spaced:
+      self.write(tokens)
+    elif formatted:
+      start = len(formatted) - len(formatted.lstrip())
+      end = start
+      for old_token in ast_constants.NODE_TYPE_TO_TOKENS.get(src_type, ()):
+        end = formatted.index(old_token, end) + len(old_token)
+      self.write(formatted[:start] + tokens + formatted[end:])
+    else:
+      self.write(' %s ' % tokens)
 
   def attr(self, node, attr_name, attr_vals, deps=None, default=None):
     """Add the formatted data stored for a given attribute on this node.
@@ -79,30 +220,203 @@ class Printer(annotate.BaseVisitor):
       default: (string) Default formatted data for this attribute.
     """
     del attr_vals
-    if not hasattr(node, '_printer_info') or node._printer_info[attr_name]:
+    # Only print each attribute of the node being visited once
+    if not self._nodes or self._nodes[-1] is not node:
+      return
+    bit = 1 << formatting.attr_id(attr_name)
+    if self._printed[-1] & bit:
       return
-    node._printer_info[attr_name] = True
+    self._printed[-1] |= bit
     if (deps and
         any(getattr(node, dep, None) != ast_utils.prop(node, dep + '__src')
             for dep in deps)):
-      self.code += default or ''
+      self.write(default or '')
     else:
       val = ast_utils.prop(node, attr_name)
-      self.code += val if val is not None else (default or '')
+      self.write(val if val is not None else (default or ''))
 
   def check_is_elif(self, node):
-    try:
-      return ast_utils.prop(node, 'is_elif')
-    except AttributeError:
-      return False
+    return bool(ast_utils.prop(node, 'is_elif'))
 
   def check_is_continued_with(self, node):
-    # TODO: Don't set extra attributes on nodes
-    return getattr(node, 'is_continued', False)
+    return bool(ast_utils.prop(node, 'is_continued'))
+
+
+class _SpanRecorder(Printer):
+  """Printer which records the span of code printed for each node."""
+
+  _use_spans = False
+
+  def __init__(self):
+    super(_SpanRecorder, self).__init__()
+    self.spans = []
+    self._stack = []
+
+  def enter_node(self, node):
+    parent = self._stack[-1][0] if self._stack else None
+    self._stack.append((node, self._offset, parent))
+    return super(_SpanRecorder, self).enter_node(node)
+
+  def leave_node(self, node):
+    super(_SpanRecorder, self).leave_node(node)
+    node, start, parent = self._stack.pop()
+    self.spans.append((node, start, self._offset, parent))
+
+
+def record_spans(tree, source=None):
+  """Record the span of source that each node of an annotated tree came from.
 
+  Once recorded, the printer copies any subtree which has not been changed since
+  straight from the source, instead of printing it piece by piece. Setting any
+  formatting of a node marks it as changed; changes to the fields of a node must
+  be reported with ast_utils.mark_changed.
 
-def to_str(tree):
-  """Convenient function to get the python source for an AST."""
-  p = Printer()
+  Arguments:
+    tree: (ast.AST) Syntax tree annotated from source.
+    source: (string) The source code the tree was annotated from. If not given,
+      spans are recorded in the code generated for the tree.
+  Returns:
+    True if spans were recorded, or False if printing the tree does not give
+    back the source, in which case no spans are recorded.
+  """
+  code, spans = collect_spans(tree)
+  if source is None:
+    source = code
+  elif code != source:
+    return False
+  for node, (_, start, end, parent) in six.iteritems(spans):
+    ast_utils.setprop(node, formatting.SPAN, (source, start, end, parent))
+  return True
+
+
+def collect_spans(tree):
+  """Get the span of code printed for each node of a tree.
+
+  Unlike record_spans, this leaves the tree unchanged.
+
+  Arguments:
+    tree: (ast.AST) Annotated syntax tree.
+  Returns:
+    A tuple (code, spans) of the code printed for the tree and a dict mapping
+    each node printed to a tuple (code, start, end, parent), in the same form
+    as the spans stored by record_spans.
+  """
+  recorder = _SpanRecorder()
+  recorder.visit(tree)
+  code = recorder.code
+  return code, {node: (code, start, end, parent)
+                for node, start, end, parent in recorder.spans}
+
+
+class SourceMap(object):
+  """Map from offsets in generated code to positions in the original source.
+
+  The map is a sorted list of segments, each covering the generated code from
+  its start offset up to the start of the next one. The code of a segment was
+  either printed for a node at a known (line, col) position of the source,
+  copied from a known offset of the source, or synthesized.
+
+  Lines are 1-based and columns are 0-based, as in the positions of ast nodes.
+  """
+
+  def __init__(self):
+    self._starts = []
+    # For each segment, None if synthesized, (line, col) if printed for the node
+    # at that position, or (source, offset) if copied from that offset.
+    self._origins = []
+    # Offsets of the start of each line of each source copied from, by id of the
+    # source (which the segments copied from it keep alive).
+    self._line_starts = {}
+
+  def add(self, start, origin):
+    """Start a new segment at an offset, replacing any empty segment there."""
+    starts = self._starts
+    origins = self._origins
+    if starts and starts[-1] == start:
+      starts.pop()
+      origins.pop()
+    if not origins or origins[-1] != origin:
+      starts.append(start)
+      origins.append(origin)
+
+  def lookup(self, offset):
+    """Get the position of the source that an offset of the code came from.
+
+    Arguments:
+      offset: (int) Offset in the generated code.
+    Returns:
+      A tuple (line, col), or None if the code at offset was synthesized.
+    """
+    i = bisect.bisect_right(self._starts, offset) - 1
+    if i < 0:
+      return None
+    return self._position(self._origins[i], offset - self._starts[i])
+
+  def __iter__(self):
+    """Iterate over segments as (start, line, col) tuples.
+
+    Line and col are the position of the start of the segment in the source, or
+    None if the segment was synthesized.
+    """
+    for start, origin in zip(self._starts, self._origins):
+      yield (start,) + (self._position(origin, 0) or (None, None))
+
+  def __len__(self):
+    return len(self._starts)
+
+  def _position(self, origin, delta):
+    """Get the (line, col) position for an offset into a segment's code."""
+    if origin is None or not isinstance(origin[0], six.string_types):
+      return origin
+    source, offset = origin
+    offset += delta
+    try:
+      line_starts = self._line_starts[id(source)]
+    except KeyError:
+      line_starts = self._line_starts[id(source)] = _line_starts(source)
+    line = bisect.bisect_right(line_starts, offset)
+    col = source[line_starts[line - 1]:offset]
+    if isinstance(col, six.text_type):
+      # Column offsets of ast nodes count bytes of utf-8.
+      col = col.encode('utf-8')
+    return line, len(col)
+
+
+def _line_starts(source):
+  """Get the offset of the start of each line of a source."""
+  starts = [0]
+  newline = source.find('\n')
+  while newline >= 0:
+    starts.append(newline + 1)
+    newline = source.find('\n', newline + 1)
+  return starts
+
+
+def to_str(tree, source_map=False):
+  """Convenient function to get the python source for an AST.
+
+  Arguments:
+    tree: (ast.AST) Syntax tree to generate source code for.
+    source_map: (bool) Whether to also return a SourceMap of the code.
+  Returns:
+    The source code or, if source_map is True, a tuple of the source code and
+    its SourceMap.
+  """
+  p = Printer(source_map=source_map)
   p.visit(tree)
+  if source_map:
+    return p.code, p.source_map
   return p.code
+
+
+def to_file(tree, out):
+  """Write the python source for an AST to a file as it is generated.
+
+  Arguments:
+    tree: (ast.AST) Syntax tree to generate source code for.
+    out: (file-like object) Object to write the source to; only its `write`
+      method is used.
+  """
+  p = Printer(out)
+  p.visit(tree)
+  p.flush()
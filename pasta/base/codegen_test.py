@@ -0,0 +1,197 @@
+# coding=utf-8
+"""Tests for codegen."""
+# Copyright 2017 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import ast
+import copy
+import threading
+import unittest
+
+import pasta
+from pasta.augment import rename
+from pasta.base import ast_utils
+from pasta.base import codegen
+from pasta.base import formatting
+from pasta.base import test_utils
+
+
+class DumpToTest(test_utils.TestCase):
+
+  def setUp(self):
+    self._flush_size = codegen.FLUSH_SIZE
+
+  def tearDown(self):
+    codegen.FLUSH_SIZE = self._flush_size
+
+  def test_dump_to(self):
+    src = 'a = 1\n# Comment\nif b:\n  c = (d + e)\n'
+    out = test_utils.RecordingFile()
+    pasta.dump_to(pasta.parse(src), out)
+    self.assertMultiLineEqual(src, ''.join(out.writes))
+    self.assertEqual(1, len(out.writes))
+
+  def test_dump_to_in_chunks(self):
+    codegen.FLUSH_SIZE = 16
+    src = ''.join('x%d = y + %d\n' % (i, i) for i in range(50))
+    out = test_utils.RecordingFile()
+    pasta.dump_to(pasta.parse(src), out)
+    self.assertMultiLineEqual(src, ''.join(out.writes))
+    self.assertGreater(len(out.writes), len(src) // 32)
+    self.assertTrue(all(len(chunk) < 32 for chunk in out.writes))
+
+
+def _tree_state(tree):
+  return [(node, sorted(vars(node)),
+           sorted(node.a.items()) if hasattr(node, 'a') else None)
+          for node in ast.walk(tree)]
+
+
+class PrinterTest(test_utils.TestCase):
+
+  def test_does_not_modify_tree(self):
+    src = 'if a:\n  b = 1\nelif c:\n  d = -2\nelse:\n  e = f + g\n'
+    t = pasta.parse(src)
+    t.body.append(ast.Expr(ast.Name('h', ast.Load())))
+    before = _tree_state(t)
+    self.assertMultiLineEqual(src + 'h', pasta.dump(t))
+    self.assertEqual(before, _tree_state(t))
+
+  def test_concurrent_dumps(self):
+    src = ''.join('if a%d:\n  b = [1, 2]\nelif c:\n  d = (e + f)\n' % i
+                  for i in range(50))
+    t = pasta.parse(src)
+    results = []
+
+    def dump():
+      for _ in range(5):
+        results.append(pasta.dump(t))
+
+    threads = [threading.Thread(target=dump) for _ in range(4)]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+    self.assertEqual([src] * 20, results)
+
+
+class SpansTest(test_utils.TestCase):
+
+  def test_record_spans(self):
+    src = 'a = 1\nif b:\n  c = (d + e)  # Comment\n'
+    t = pasta.parse(src, record_spans=True)
+    self.assertEqual((src, 0, len(src), None),
+                     ast_utils.prop(t, formatting.SPAN))
+    stmt = t.body[1].body[0]
+    source, start, end, parent = ast_utils.prop(stmt, formatting.SPAN)
+    self.assertEqual('c = (d + e)  # Comment\n', source[start:end])
+    self.assertIs(t.body[1], parent)
+    self.assertMultiLineEqual(src, pasta.dump(t))
+
+  def test_mark_changed(self):
+    src = 'a = 1\nif b:\n  c = (d + e)\n'
+    t = pasta.parse(src, record_spans=True)
+    name = t.body[1].body[0].value.left
+    name.id = 'x'
+    ast_utils.mark_changed(name)
+    self.assertMultiLineEqual('a = 1\nif b:\n  c = (x + e)\n', pasta.dump(t))
+    self.assertFalse(ast_utils.prop(t, formatting.SPAN))
+    self.assertFalse(ast_utils.prop(t.body[1], formatting.SPAN))
+    self.assertTrue(ast_utils.prop(t.body[0], formatting.SPAN))
+    self.assertTrue(ast_utils.prop(t.body[1].test, formatting.SPAN))
+
+  def test_set_formatting(self):
+    src = 'a = 1\nif b:\n  c = d\n'
+    t = pasta.parse(src, record_spans=True)
+    ast_utils.setprop(t.body[1].body[0], 'prefix', '  ')
+    self.assertMultiLineEqual('a = 1\nif b:\n    c = d\n', pasta.dump(t))
+    self.assertTrue(ast_utils.prop(t.body[0], formatting.SPAN))
+
+  def test_copy(self):
+    src = 'a = 1\nb = 2\n'
+    t = pasta.parse(src, record_spans=True)
+    stmt = copy.deepcopy(t.body[0])
+    self.assertFalse(ast_utils.prop(stmt, formatting.SPAN))
+    self.assertMultiLineEqual('a = 1\n', pasta.dump(stmt))
+
+  def test_rename(self):
+    src = 'from aaa.bbb import ccc, ddd\n\ndef f():\n  return ccc + ddd\n'
+    expected = pasta.parse(src)
+    rename.rename_external(expected, 'aaa.bbb.ccc', 'xxx.yyy')
+    t = pasta.parse(src, record_spans=True)
+    rename.rename_external(t, 'aaa.bbb.ccc', 'xxx.yyy')
+    self.assertMultiLineEqual(pasta.dump(expected), pasta.dump(t))
+    self.assertTrue(ast_utils.prop(t.body[-1], formatting.SPAN))
+
+
+class SourceMapTest(test_utils.TestCase):
+
+  def test_source_map(self):
+    src = 'a = 1\nif b:\n  c = d  # Comment\n'
+    t = pasta.parse(src)
+    t.body[1].body[0].targets[0] = ast.Name('xyz', ast.Store())
+    code, source_map = pasta.dump(t, source_map=True)
+    self.assertMultiLineEqual('a = 1\nif b:\n  xyz= d  # Comment\n', code)
+    self.assertEqual((1, 0), source_map.lookup(0))
+    self.assertEqual((1, 0), source_map.lookup(code.index('a')))
+    self.assertEqual((1, 4), source_map.lookup(code.index('1')))
+    self.assertEqual((2, 3), source_map.lookup(code.index('b')))
+    self.assertEqual((3, 2), source_map.lookup(code.index('=', 8)))
+    self.assertEqual((3, 6), source_map.lookup(code.index('d')))
+    self.assertIsNone(source_map.lookup(code.index('xyz')))
+    self.assertIsNone(source_map.lookup(code.index('z')))
+    self.assertEqual((3, 6), source_map.lookup(code.index('#')))
+
+    starts = [start for start, _, _ in source_map]
+    self.assertEqual(sorted(set(starts)), starts)
+    self.assertIn((code.index('xyz'), None, None), list(source_map))
+
+  def test_source_map_of_spans(self):
+    src = 'a = 1\nif b:\n  c = (d + e)\n'
+    t = pasta.parse(src, record_spans=True)
+    t.body[0].targets[0] = ast.Name('x', ast.Store())
+    ast_utils.mark_changed(t.body[0])
+    code, source_map = pasta.dump(t, source_map=True)
+    self.assertMultiLineEqual('x= 1\nif b:\n  c = (d + e)\n', code)
+    self.assertIsNone(source_map.lookup(code.index('x')))
+    for char in 'bcde+)':
+      offset = code.index(char)
+      line, col = source_map.lookup(offset)
+      self.assertEqual(char, src.splitlines()[line - 1][col])
+
+  def test_source_map_matches_nodes(self):
+    src = 'def f(a, b):\n  return [a + 1, -b]\n'
+    t = pasta.parse(src)
+    code, source_map = pasta.dump(t, source_map=True)
+    lines = src.splitlines()
+    for start, line, col in source_map:
+      self.assertIsNotNone(line)
+      self.assertLess(col, len(lines[line - 1]))
+
+
+def suite():
+  result = unittest.TestSuite()
+  result.addTests(unittest.makeSuite(DumpToTest))
+  result.addTests(unittest.makeSuite(PrinterTest))
+  result.addTests(unittest.makeSuite(SpansTest))
+  result.addTests(unittest.makeSuite(SourceMapTest))
+  return result
+
+
+if __name__ == '__main__':
+  unittest.main()
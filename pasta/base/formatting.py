@@ -0,0 +1,321 @@
+# coding=utf-8
+"""Compact storage for the formatting of the nodes of a syntax tree.
+
+Rather than giving every node its own dict, the formatting of a whole tree is
+kept in a single table keyed by node index and attribute id, and each node only
+holds a small handle into that table. Formatting values are mostly repeats of
+the same few strings of whitespace, so strings are deduplicated per table.
+"""
+# Copyright 2017 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import copy
+import threading
+
+import six
+
+# Number of bits of a table key which hold the attribute id.
+_ATTR_BITS = 20
+_ATTR_MASK = (1 << _ATTR_BITS) - 1
+
+# Ids of attribute names, shared by all tables.
+_attr_ids = {}
+_attr_names = []
+_attr_lock = threading.Lock()
+
+# Attribute holding the span of source a node was printed from, as a tuple
+# (source, start, end, parent); see codegen.record_spans. A span is only valid
+# while nothing in its node changes, so it is dropped, along with the spans of
+# the node's ancestors, whenever any other formatting of the node is set.
+SPAN = 'span'
+
+# Previous value of an attribute which was not set.
+_MISSING = object()
+
+
+def attr_id(name):
+  """Get the id of an attribute name, assigning a new one if needed."""
+  try:
+    return _attr_ids[name]
+  except KeyError:
+    pass
+  with _attr_lock:
+    if name not in _attr_ids:
+      if len(_attr_names) > _ATTR_MASK:
+        raise ValueError('Too many distinct formatting attribute names')
+      _attr_names.append(name)
+      _attr_ids[name] = len(_attr_names) - 1
+    return _attr_ids[name]
+
+
+_SPAN_ID = attr_id(SPAN)
+
+
+class FormattingTable(object):
+  """Formatting of a set of nodes, usually all the nodes of one tree."""
+
+  def __init__(self):
+    self._values = {}
+    # Bit masks of the ids of the attributes which may be set for each node,
+    # by index, so that a node's attributes can be found without checking every
+    # id. Bits are never cleared; a value must also be in _values to be set.
+    # Nodes which never had an attribute set may be past the end.
+    self._masks = []
+    self._strings = {}
+    self._size = 0
+    self.has_spans = False
+    # Whether _values is shared with a fork of the table, and must be copied
+    # before it is changed.
+    self._shared = False
+    # Whether _values may hold spans of the table this one was forked from,
+    # which do not apply to its nodes.
+    self._spans_hidden = False
+    # Transaction recording changes to the table, if any; see
+    # ast_utils.Transaction.
+    self.transaction = None
+
+  def new_node(self):
+    """Allocate an index in the table and return a handle to it."""
+    self._size += 1
+    return NodeFormatting(self, self._size - 1)
+
+  def get(self, index, name, default=None):
+    if self._spans_hidden and name == SPAN:
+      return default
+    return self._values.get((index << _ATTR_BITS) | attr_id(name), default)
+
+  def set(self, index, name, value, keep_span=False):
+    """Set an attribute of the node at an index.
+
+    Arguments:
+      index: (int) Index of the node.
+      name: (string) Name of the attribute.
+      value: (object) Formatting to store.
+      keep_span: (bool) Whether to keep the span of the node, if it has one,
+        rather than invalidating it.
+    """
+    if name == SPAN:
+      self.has_spans = True
+    elif self.has_spans and not keep_span:
+      self.drop_span(index)
+    key = (index << _ATTR_BITS) | attr_id(name)
+    if self._shared:
+      self._unshare()
+    if self.transaction is not None:
+      self._record(key)
+    if isinstance(value, six.string_types):
+      if not value:
+        # Most nodes have no whitespace around them, and a missing attribute
+        # reads as an empty string anyway.
+        self._values.pop(key, None)
+        return
+      value = self._strings.setdefault(value, value)
+    self._values[key] = value
+    self._add_to_mask(key)
+
+  def _add_to_mask(self, key):
+    index = key >> _ATTR_BITS
+    masks = self._masks
+    if index >= len(masks):
+      masks.extend([0] * (index + 1 - len(masks)))
+    masks[index] |= 1 << (key & _ATTR_MASK)
+
+  def delete(self, index, name):
+    if self.has_spans and name != SPAN:
+      self.drop_span(index)
+    key = (index << _ATTR_BITS) | attr_id(name)
+    if self._shared:
+      self._unshare()
+    if self.transaction is not None:
+      self._record(key)
+    del self._values[key]
+
+  def drop_span(self, index):
+    """Drop the span of the node at an index and those of its ancestors."""
+    table = self
+    while table.has_spans:
+      key = (index << _ATTR_BITS) | _SPAN_ID
+      if table._shared:
+        table._unshare()
+      if table.transaction is not None and key in table._values:
+        table._record(key)
+      span = table._values.pop(key, None)
+      # If a node has no span, neither do any of its ancestors.
+      if span is None or not hasattr(span[3], 'a'):
+        return
+      table, index = span[3].a._table, span[3].a._index
+
+  def _record(self, key):
+    """Record the value of a key in the transaction, before it is changed."""
+    self.transaction.record(
+        self._restore, key, self._values.get(key, _MISSING))
+
+  def _restore(self, key, value):
+    if self._shared:
+      self._unshare()
+    if value is _MISSING:
+      self._values.pop(key, None)
+    else:
+      self._values[key] = value
+      self._add_to_mask(key)
+
+  def names(self, index):
+    """Get the names of all attributes set for the node at an index."""
+    base = index << _ATTR_BITS
+    return [_attr_names[i] for i in self._ids(index)
+            if base | i in self._values
+            and not (self._spans_hidden and i == _SPAN_ID)]
+
+  def _ids(self, index):
+    """Get the ids of the attributes which may be set for a node, in order."""
+    mask = self._masks[index] if index < len(self._masks) else 0
+    i = 0
+    while mask:
+      if mask & 1:
+        yield i
+      mask >>= 1
+      i += 1
+
+  def fork(self):
+    """Get a copy of the table, without spans.
+
+    The copy shares its values with this table until either of them is changed,
+    so forking is cheap however large the table is. The nodes of the copy have
+    the same indexes as those of this table.
+    """
+    result = FormattingTable()
+    result._values = self._values
+    result._masks = self._masks
+    result._strings = self._strings
+    result._size = self._size
+    result._shared = self._shared = True
+    result._spans_hidden = self.has_spans or self._spans_hidden
+    return result
+
+  def copy_nodes(self, indexes):
+    """Get a new table with copies of the nodes at some indexes, without spans.
+
+    Arguments:
+      indexes: (list of int) Indexes of the nodes to copy.
+    Returns:
+      The new table, in which the copy of the node at indexes[i] is at index i.
+    """
+    result = FormattingTable()
+    values = self._values
+    for new_index, index in enumerate(indexes):
+      base = index << _ATTR_BITS
+      new_base = new_index << _ATTR_BITS
+      for i in self._ids(index):
+        value = values.get(base | i, _MISSING)
+        if value is not _MISSING and i != _SPAN_ID:
+          result._values[new_base | i] = value
+          result._add_to_mask(new_base | i)
+    result._strings = self._strings
+    result._size = len(indexes)
+    return result
+
+  def _unshare(self):
+    """Take a copy of values shared with a fork, before changing them."""
+    if self._spans_hidden:
+      self._values = {key: value for key, value in six.iteritems(self._values)
+                      if key & _ATTR_MASK != _SPAN_ID}
+      self._spans_hidden = False
+    else:
+      self._values = dict(self._values)
+    self._masks = list(self._masks)
+    self._shared = False
+
+  def __len__(self):
+    return self._size
+
+  def __deepcopy__(self, memo):
+    # Copying a table gives an empty table; the formatting of each node is
+    # copied along with the handle that refers to it, so that copying a
+    # subtree does not copy the formatting of the rest of its tree.
+    return FormattingTable()
+
+  def __getstate__(self):
+    # Attribute ids are only meaningful within a process, so store names.
+    values = {}
+    for key, value in six.iteritems(self._values):
+      if self._spans_hidden and key & _ATTR_MASK == _SPAN_ID:
+        continue
+      values[key >> _ATTR_BITS, _attr_names[key & _ATTR_MASK]] = value
+    return self._size, values
+
+  def __setstate__(self, state):
+    self.__init__()
+    self._size, values = state
+    for (index, name), value in six.iteritems(values):
+      self.set(index, name, value, keep_span=True)
+
+
+class NodeFormatting(object):
+  """Handle to the formatting of a single node, stored as `node.a`.
+
+  Behaves like a dict mapping attribute names to formatting, except that
+  indexing a missing attribute gives an empty string, and attributes set to an
+  empty string are not stored.
+  """
+
+  __slots__ = ('_table', '_index')
+
+  def __init__(self, table, index):
+    self._table = table
+    self._index = index
+
+  def __getitem__(self, name):
+    return self._table.get(self._index, name, '')
+
+  def __setitem__(self, name, value):
+    self._table.set(self._index, name, value)
+
+  def __delitem__(self, name):
+    self._table.delete(self._index, name)
+
+  def __contains__(self, name):
+    return self._table.get(self._index, name, self) is not self
+
+  def __iter__(self):
+    return iter(self.keys())
+
+  def get(self, name, default=None):
+    return self._table.get(self._index, name, default)
+
+  def drop_span(self):
+    self._table.drop_span(self._index)
+
+  def keys(self):
+    return self._table.names(self._index)
+
+  def items(self):
+    return [(name, self[name]) for name in self.keys()]
+
+  def __deepcopy__(self, memo):
+    # Spans are not copied, since copies are usually placed elsewhere in a tree.
+    result = copy.deepcopy(self._table, memo).new_node()
+    for name, value in self.items():
+      if name != SPAN:
+        result[name] = copy.deepcopy(value, memo)
+    return result
+
+  def __getstate__(self):
+    return self._table, self._index
+
+  def __setstate__(self, state):
+    self._table, self._index = state
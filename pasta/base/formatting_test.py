@@ -0,0 +1,159 @@
+# coding=utf-8
+"""Tests for formatting."""
+# Copyright 2017 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import ast
+import copy
+import pickle
+import threading
+import unittest
+
+import pasta
+from pasta.base import ast_utils
+from pasta.base import codegen
+from pasta.base import formatting
+from pasta.base import test_utils
+
+
+class FormattingTest(test_utils.TestCase):
+
+  def test_get_and_set(self):
+    table = formatting.FormattingTable()
+    a = table.new_node()
+    b = table.new_node()
+    a['prefix'] = '  '
+    a['suffix'] += '\n'
+    self.assertEqual('  ', a['prefix'])
+    self.assertEqual('\n', a['suffix'])
+    self.assertEqual('', b['prefix'])
+    self.assertIsNone(b.get('prefix'))
+    self.assertIn('prefix', a)
+    self.assertNotIn('prefix', b)
+    self.assertItemsEqual(['prefix', 'suffix'], a.keys())
+
+    a['prefix'] = ''
+    self.assertNotIn('prefix', a)
+    self.assertEqual('', a['prefix'])
+
+  def test_keys(self):
+    table = formatting.FormattingTable()
+    a = table.new_node()
+    b = table.new_node()
+    a['prefix'] = ' '
+    a['suffix'] = '\n'
+    b['suffix'] = '\n'
+    del a['suffix']
+    self.assertEqual(['prefix'], a.keys())
+    self.assertEqual(['suffix'], b.keys())
+
+    forked = formatting.NodeFormatting(table.fork(), a._index)
+    forked['comment'] = '# Comment'
+    self.assertEqual(['prefix'], a.keys())
+    self.assertItemsEqual(['prefix', 'comment'], forked.keys())
+
+  def test_strings_are_shared(self):
+    table = formatting.FormattingTable()
+    a = table.new_node()
+    b = table.new_node()
+    a['prefix'] = ''.join(['  ', '\n'])
+    b['suffix'] = ''.join(['  ', '\n'])
+    self.assertIs(a['prefix'], b['suffix'])
+
+  def test_nodes_share_table(self):
+    t = pasta.parse('a = 1\nb = 2\n')
+    tables = set(id(node.a._table) for node in ast.walk(t)
+                 if hasattr(node, 'a'))
+    self.assertEqual(1, len(tables))
+
+  def test_deepcopy(self):
+    src = 'a = (1)\nb = 2\n'
+    t = pasta.parse(src)
+    stmt = copy.deepcopy(t.body[0])
+    self.assertEqual(ast_utils.prop(t.body[0].value, 'prefix'),
+                     ast_utils.prop(stmt.value, 'prefix'))
+    self.assertIs(stmt.a._table, stmt.value.a._table)
+    self.assertIsNot(t.a._table, stmt.a._table)
+    self.assertEqual(3, len(stmt.a._table))
+
+    ast_utils.setprop(stmt.value, 'prefix', '   ')
+    self.assertMultiLineEqual(src, codegen.to_str(t))
+
+  def test_fork(self):
+    table = formatting.FormattingTable()
+    a = table.new_node()
+    a['prefix'] = '  '
+    a[formatting.SPAN] = ('  ', 0, 2, None)
+    forked = table.fork()
+    b = formatting.NodeFormatting(forked, a._index)
+    self.assertIs(table._values, forked._values)
+    self.assertEqual([('prefix', '  ')], b.items())
+    self.assertIsNone(b.get(formatting.SPAN))
+
+    b['suffix'] = '\n'
+    self.assertIsNot(table._values, forked._values)
+    self.assertNotIn('suffix', a)
+    self.assertEqual([('prefix', '  '), ('suffix', '\n')], sorted(b.items()))
+    a['prefix'] = ' '
+    self.assertEqual('  ', b['prefix'])
+    self.assertTrue(a.get(formatting.SPAN) is None)
+
+  def test_copy_nodes(self):
+    table = formatting.FormattingTable()
+    nodes = [table.new_node() for _ in range(3)]
+    nodes[1]['prefix'] = '  '
+    nodes[2]['suffix'] = '\n'
+    nodes[2][formatting.SPAN] = ('', 0, 0, None)
+    copied = table.copy_nodes([2, 1])
+    self.assertEqual(2, len(copied))
+    self.assertEqual([('suffix', '\n')],
+                     formatting.NodeFormatting(copied, 0).items())
+    self.assertEqual([('prefix', '  ')],
+                     formatting.NodeFormatting(copied, 1).items())
+
+  def test_pickle(self):
+    src = 'a = (1)\nif b:\n  c = 2\n'
+    t = pickle.loads(pickle.dumps(pasta.parse(src), pickle.HIGHEST_PROTOCOL))
+    self.assertMultiLineEqual(src, codegen.to_str(t))
+
+  def test_attr_ids_from_threads(self):
+    names = ['attr_ids_from_threads_%d' % i for i in range(100)]
+    results = []
+
+    def assign():
+      results.append([formatting.attr_id(name) for name in names])
+
+    threads = [threading.Thread(target=assign) for _ in range(4)]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+    self.assertEqual(4, len(results))
+    for ids in results:
+      self.assertEqual(results[0], ids)
+    self.assertEqual(len(names), len(set(results[0])))
+
+
+def suite():
+  result = unittest.TestSuite()
+  result.addTests(unittest.makeSuite(FormattingTest))
+  return result
+
+
+if __name__ == '__main__':
+  unittest.main()
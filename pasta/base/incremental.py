@@ -0,0 +1,231 @@
+# coding=utf-8
+"""Update an annotated module after an edit to its source.
+
+Only the top-level statements touched by the edit are parsed and annotated
+again; the rest of the module keeps its nodes, shifted to their new lines.
+"""
+# Copyright 2017 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import ast
+import bisect
+
+from pasta.base import ast_utils
+from pasta.base import chunks
+from pasta.base import codegen
+
+# Number of characters compared at a time when looking for the edit.
+_BLOCK_SIZE = 4096
+
+
+def _common_prefix(a, b):
+  """Get the length of the longest common prefix of two strings."""
+  n = min(len(a), len(b))
+  i = 0
+  while i < n and a[i:i + _BLOCK_SIZE] == b[i:i + _BLOCK_SIZE]:
+    i += _BLOCK_SIZE
+  n = min(n, i + _BLOCK_SIZE)
+  while i < n and a[i] == b[i]:
+    i += 1
+  return min(i, len(a), len(b))
+
+
+def _common_suffix(a, b, limit):
+  """Get the length of the longest common suffix of two strings, up to limit."""
+  n = min(len(a), len(b), limit)
+  i = 0
+  while (i + _BLOCK_SIZE <= n and
+         a[len(a) - i - _BLOCK_SIZE:len(a) - i] ==
+         b[len(b) - i - _BLOCK_SIZE:len(b) - i]):
+    i += _BLOCK_SIZE
+  while i < n and a[len(a) - i - 1] == b[len(b) - i - 1]:
+    i += 1
+  return i
+
+
+def _line_start(src, offset, lines_back):
+  """Get the start of the line some number of lines before an offset's line.
+
+  If lines_back is negative, the line is after the offset's line instead.
+  """
+  start = src.rfind('\n', 0, offset) + 1
+  for _ in range(lines_back):
+    start = src.rfind('\n', 0, start - 1) + 1
+  for _ in range(-lines_back):
+    start = src.find('\n', start) + 1
+  return start
+
+
+def _code_start(code):
+  """Get the length of the formatting printed before a statement's code.
+
+  The code starts on the first line which is not blank or a comment.
+  """
+  pos = 0
+  while pos < len(code):
+    end = code.find('\n', pos)
+    end = len(code) if end < 0 else end + 1
+    line = code[pos:end].strip()
+    if line and not line.startswith('#'):
+      return pos
+    pos = end
+  return len(code)
+
+
+def reparse(tree, old_src, new_src):
+  """Update an annotated module after its source has been edited.
+
+  The edit is found by comparing the sources. The top-level statements it
+  touches are parsed and annotated again, from the new source, and replace the
+  old ones in tree.body. All other statements keep their nodes and formatting;
+  those after the edit have their line numbers updated.
+
+  If the new source of the edited statements cannot be parsed on its own, for
+  example because the edit added an `else:` to the statement before them, more
+  statements are parsed, up to the whole module. The whole module is also
+  parsed again if the edit added or removed a `from __future__` import, which
+  changes how the rest of the module parses.
+
+  Arguments:
+    tree: (ast.Module) Module annotated from old_src (e.g. by pasta.parse),
+      which has not been changed since.
+    old_src: (string) Source the tree was parsed from.
+    new_src: (string) Edited source.
+  Returns:
+    The tree, changed in place to match new_src.
+  Raises:
+    SyntaxError: if new_src cannot be parsed.
+  """
+  if old_src == new_src:
+    return tree
+  prefix = _common_prefix(old_src, new_src)
+  suffix = _common_suffix(old_src, new_src,
+                          min(len(old_src), len(new_src)) - prefix)
+  # The edit replaced old_src[prefix:edit_end] with new text.
+  edit_end = len(old_src) - suffix
+  delta = len(new_src) - len(old_src)
+
+  body = tree.body
+  starts = [chunks.statement_start(stmt) for stmt in body]
+  # Text inserted at the start of a line goes with the statement before it,
+  # if it ends a line of its own.
+  edit_line = old_src.count(
+      '\n', 0, max(0, prefix - 1) if prefix == edit_end else prefix) + 1
+  first = max(0, bisect.bisect_right(starts, edit_line) - 1)
+  last = None
+  flags = chunks.future_flags(tree)
+  while True:
+    start, end, last = _region(tree, old_src, new_src, starts, prefix,
+                               edit_end, first, last)
+    src = new_src[start:end + delta]
+    whole = first == 0 and last == len(body)
+    try:
+      chunk = chunks.annotate_source(src, new_src.count('\n', 0, start) + 1,
+                                     0 if whole else flags)
+    except SyntaxError:
+      if whole:
+        raise
+      # The edit may have joined the statements to those around them.
+      first = max(0, first - 1)
+      last = min(len(body), last + 1)
+      continue
+    if whole or (_future_imports(chunk.body) ==
+                 _future_imports(body[first:last])):
+      break
+    first, last = 0, len(body)
+
+  line_delta = src.count('\n') - old_src.count('\n', start, end)
+  if line_delta:
+    for stmt in body[last:]:
+      ast.increment_lineno(stmt, line_delta)
+  _splice(tree, first, last, chunk)
+  return tree
+
+
+def _future_imports(statements):
+  """Get the names imported from __future__ by some statements."""
+  return set(alias.name for stmt in statements
+             if isinstance(stmt, ast.ImportFrom) and stmt.module == '__future__'
+             for alias in stmt.names)
+
+
+def _region(tree, old_src, new_src, starts, prefix, edit_end, first, last):
+  """Find the source of some statements, enough to cover an edit.
+
+  Arguments:
+    tree: (ast.Module) Annotated module.
+    old_src: (string) Source the tree was parsed from.
+    new_src: (string) Edited source.
+    starts: (list of int) First line of each statement of the module.
+    prefix: (int) Offset where the edit starts, within the first statement.
+    edit_end: (int) Offset where the edit ends.
+    first: (int) Index of the first statement to cover.
+    last: (int) Index after the last statement to cover at least, or None.
+  Returns:
+    A tuple (start, end, last) of the offsets in old_src where the source of the
+    statements from first up to last starts and ends, and the index after the
+    last statement. Any source before the first statement of the module, or
+    after its last statement, is included with them.
+  """
+  body = tree.body
+  if not body:
+    return 0, len(old_src), 0
+  # The first statement's code starts at the beginning of its first line, after
+  # the formatting printed before it.
+  offset = min(prefix, len(old_src) - 1)
+  lines_back = old_src.count('\n', 0, offset) + 1 - starts[first]
+  end = (_line_start(old_src, offset, lines_back) -
+         _code_start(codegen.to_str(body[first])))
+  start = 0 if first == 0 else end
+  delta = len(new_src) - len(old_src)
+  i = first
+  # The statements after the edit must start a line of their own, as they did
+  # before it.
+  while i < len(body) and (
+      i == first or end < edit_end or (last is not None and i < last) or
+      (end == edit_end and new_src[end + delta - 1:end + delta] != '\n')):
+    end += len(codegen.to_str(body[i]))
+    i += 1
+  if i == len(body):
+    end = len(old_src)
+  return start, end, i
+
+
+def _splice(tree, first, last, chunk):
+  """Replace some statements of a module with those of an annotated chunk.
+
+  Formatting before the chunk's statements goes in the prefix of the first of
+  them, and formatting after them in the prefix of the statement after them (or
+  the suffix of the module), since every statement prints its prefix.
+  """
+  body = tree.body
+  new_body = chunk.body
+  before = ast_utils.prop(chunk, 'prefix')
+  after = ast_utils.prop(chunk, 'suffix')
+  if first == 0:
+    ast_utils.setprop(tree, 'prefix', before)
+  elif new_body:
+    ast_utils.prependprop(new_body[0], 'prefix', before)
+  else:
+    after = before + after
+  if last == len(body):
+    ast_utils.setprop(tree, 'suffix', after)
+  else:
+    ast_utils.prependprop(body[last], 'prefix', after)
+  body[first:last] = new_body
+  ast_utils.mark_changed(tree)
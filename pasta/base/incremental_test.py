@@ -0,0 +1,118 @@
+# coding=utf-8
+"""Tests for incremental."""
+# Copyright 2017 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import ast
+import unittest
+
+import six
+
+import pasta
+from pasta.base import test_utils
+
+_SRC = '''\
+"""Docstring."""
+import os  # Comment
+
+# Leading comment
+if a:
+  b = 1
+
+
+# Middle comment
+x = 3
+@decorator
+def f(y):
+  return [y,
+          2]
+# Trailing comment
+'''
+
+
+class ReparseTest(test_utils.TestCase):
+
+  def assertReparses(self, old_src, new_src):
+    """Reparse a tree, check it against a fresh parse and return it."""
+    t = pasta.parse(old_src)
+    before = list(t.body)
+    self.assertIs(t, pasta.reparse(t, old_src, new_src))
+    self.assertMultiLineEqual(new_src, pasta.dump(t))
+    self.assertEqual(ast.dump(pasta.parse(new_src), include_attributes=True),
+                     ast.dump(t, include_attributes=True))
+    return t, before
+
+  def test_change_line(self):
+    t, before = self.assertReparses(_SRC, _SRC.replace('b = 1', 'b = 12'))
+    self.assertIsNot(before[2], t.body[2])
+    for i in (0, 1, 3, 4):
+      self.assertIs(before[i], t.body[i])
+
+  def test_add_lines(self):
+    t, before = self.assertReparses(
+        _SRC, _SRC.replace('x = 3\n', 'x = 3\ny = 4\nz = 5\n'))
+    self.assertEqual(7, len(t.body))
+    self.assertIs(before[4], t.body[6])
+    self.assertEqual(15, t.body[6].body[0].lineno)
+
+  def test_remove_statement(self):
+    t, before = self.assertReparses(_SRC, _SRC.replace('x = 3\n', ''))
+    self.assertEqual(before[:3] + before[4:], t.body)
+
+  def test_change_comments(self):
+    self.assertReparses(_SRC, _SRC.replace('# Middle', '# A\n\n# Middle'))
+    self.assertReparses(_SRC, _SRC.replace('# Trailing comment\n', ''))
+    self.assertReparses(_SRC, _SRC.replace('"""Docstring."""\n', ''))
+
+  def test_join_statements(self):
+    # The new `else` cannot be parsed without the `if` before it.
+    t, before = self.assertReparses(
+        _SRC, _SRC.replace('\n\n# Middle', 'else:\n  b = 2\n\n\n# Middle'))
+    self.assertEqual(before[:2], t.body[:2])
+    self.assertIs(before[-1], t.body[-1])
+
+  def test_syntax_error(self):
+    t = pasta.parse(_SRC)
+    with self.assertRaises(SyntaxError):
+      pasta.reparse(t, _SRC, _SRC.replace('x = 3', 'x = (3'))
+
+  @unittest.skipIf(six.PY3, 'Only changes the parse of python 2 code.')
+  def test_add_future_import(self):
+    src = 'import sys\n\nx = "a"\n'
+    t, _ = self.assertReparses(
+        src, 'from __future__ import unicode_literals\n' + src)
+    self.assertIsInstance(t.body[-1].value.s, six.text_type)
+
+  @unittest.skipIf(six.PY3, 'Only changes the parse of python 2 code.')
+  def test_remove_future_import(self):
+    src = ('from __future__ import print_function\nimport sys\n'
+           'print("a", file=sys.stderr)\n')
+    t = pasta.parse(src)
+    with self.assertRaises(SyntaxError):
+      pasta.reparse(t, src, src.replace(
+          'from __future__ import print_function\n', ''))
+
+
+def suite():
+  result = unittest.TestSuite()
+  result.addTests(unittest.makeSuite(ReparseTest))
+  return result
+
+
+if __name__ == '__main__':
+  unittest.main()
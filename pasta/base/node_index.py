@@ -0,0 +1,217 @@
+# coding=utf-8
+"""Index the structure of a syntax tree for fast ancestry queries.
+
+Each node of the tree gets an id, its position in a preorder traversal. Since
+the descendants of a node come right after it in preorder, they have the ids
+from the node's own id up to (but not including) the end of its subtree, so
+whether one node is inside another is a comparison of ids. The id of each node's
+parent and the end of each node's subtree are kept in compact arrays.
+
+Each subtree can also be summarized by a bitmask of the types of the nodes in
+it, so that searches for nodes of certain types can skip whole subtrees.
+"""
+# Copyright 2017 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import array
+import ast
+import threading
+
+# Bits standing for node types in type masks, shared by all indexes.
+_type_bits = {}
+_type_lock = threading.Lock()
+
+
+def _indexed(node):
+  # Nodes with no fields or attributes, such as ast.Load and ast.Add, are shared
+  # between trees by ast.parse, so they have no single position in a tree.
+  return bool(node._fields or node._attributes)
+
+
+def type_bit(node_type):
+  """Get the bit standing for a node type in type masks."""
+  try:
+    return _type_bits[node_type]
+  except KeyError:
+    pass
+  with _type_lock:
+    return _type_bits.setdefault(node_type, 1 << len(_type_bits))
+
+
+def types_mask(node_types):
+  """Get the type mask of some node types and all of their subclasses."""
+  mask = 0
+  stack = list(node_types)
+  while stack:
+    node_type = stack.pop()
+    mask |= type_bit(node_type)
+    stack.extend(node_type.__subclasses__())
+  return mask
+
+
+class NodeIndex(object):
+  """Preorder ids, parents and subtree ranges of the nodes of a tree.
+
+  The index can be built from a tree all at once, or while another traversal of
+  it calls enter and leave for each node in preorder. It describes the tree as
+  it was when indexed; it is not updated when the tree is changed.
+  """
+
+  def __init__(self, tree=None):
+    """Create an index, of the given tree if any.
+
+    Arguments:
+      tree: (ast.AST) Syntax tree to index. If not given, the index is built by
+        calling enter and leave.
+    """
+    self._nodes = []
+    self._ids = {}
+    self._parents = array.array('l')
+    self._ends = array.array('l')
+    # Type bits of each node, and type masks of each subtree, once computed.
+    self._bits = None
+    self._masks = None
+    # Ids of the nodes being indexed, while building.
+    self._stack = []
+    if tree is not None:
+      self._build(tree)
+
+  def _build(self, tree):
+    self.enter(tree)
+    iterators = [ast.iter_child_nodes(tree)]
+    while iterators:
+      child = next(iterators[-1], None)
+      if child is None:
+        iterators.pop()
+        self._ends[self._stack.pop()] = len(self._nodes)
+      elif _indexed(child):
+        self.enter(child)
+        iterators.append(ast.iter_child_nodes(child))
+
+  def enter(self, node):
+    """Add a node, which must be a child of the last node entered and not left.
+
+    Returns:
+      The id of the node.
+    """
+    if not _indexed(node):
+      return None
+    node_id = len(self._nodes)
+    self._nodes.append(node)
+    self._ids[node] = node_id
+    self._parents.append(self._stack[-1] if self._stack else -1)
+    self._ends.append(node_id + 1)
+    self._stack.append(node_id)
+    return node_id
+
+  def leave(self, node):
+    """Finish a node, once all of its descendants have been entered."""
+    if _indexed(node):
+      self._ends[self._stack.pop()] = len(self._nodes)
+
+  def node_id(self, node):
+    """Get the id of a node, raising KeyError if it is not in the index."""
+    return self._ids[node]
+
+  def node(self, node_id):
+    """Get the node with an id."""
+    return self._nodes[node_id]
+
+  def parent_id(self, node_id):
+    """Get the id of the parent of the node with an id, or -1 for the root."""
+    return self._parents[node_id]
+
+  def subtree_end(self, node_id):
+    """Get the id after the last descendant of the node with an id."""
+    return self._ends[node_id]
+
+  def parent(self, node):
+    """Get the parent of a node, or None for the root."""
+    parent_id = self._parents[self._ids[node]]
+    return self._nodes[parent_id] if parent_id >= 0 else None
+
+  def ancestors(self, node):
+    """Iterate over the ancestors of a node, from its parent up to the root."""
+    parent_id = self._parents[self._ids[node]]
+    while parent_id >= 0:
+      yield self._nodes[parent_id]
+      parent_id = self._parents[parent_id]
+
+  def enclosing_statement(self, node):
+    """Get the innermost statement which contains a node, or None if none does.
+
+    A statement does not enclose itself; the enclosing statement of a statement
+    is the compound statement it is part of, if any.
+    """
+    for ancestor in self.ancestors(node):
+      if isinstance(ancestor, ast.stmt):
+        return ancestor
+    return None
+
+  def is_descendant(self, node, ancestor):
+    """Whether a node is inside another node (and not the same node)."""
+    node_id = self._ids[node]
+    ancestor_id = self._ids[ancestor]
+    return ancestor_id < node_id < self._ends[ancestor_id]
+
+  def subtree(self, node):
+    """Get a node and all of its descendants, in preorder."""
+    node_id = self._ids[node]
+    return self._nodes[node_id:self._ends[node_id]]
+
+  def type_mask(self, node):
+    """Get the mask of the types of all the nodes in a node's subtree."""
+    return self._type_masks()[self._ids[node]]
+
+  def find(self, mask):
+    """Iterate over the nodes whose types are in a mask, in preorder.
+
+    Subtrees whose type mask does not overlap the given mask are skipped.
+
+    Arguments:
+      mask: (int) Type mask, usually from types_mask.
+    """
+    masks = self._type_masks()
+    bits = self._bits
+    ends = self._ends
+    nodes = self._nodes
+    i = 0
+    while i < len(nodes):
+      if masks[i] & mask:
+        if bits[i] & mask:
+          yield nodes[i]
+        i += 1
+      else:
+        i = ends[i]
+
+  def _type_masks(self):
+    if self._masks is None:
+      bits = [type_bit(type(node)) for node in self._nodes]
+      masks = list(bits)
+      parents = self._parents
+      for i in range(len(masks) - 1, 0, -1):
+        masks[parents[i]] |= masks[i]
+      self._bits = bits
+      self._masks = masks
+    return self._masks
+
+  def __contains__(self, node):
+    return node in self._ids
+
+  def __len__(self):
+    return len(self._nodes)
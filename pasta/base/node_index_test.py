@@ -0,0 +1,112 @@
+# coding=utf-8
+"""Tests for node_index."""
+# Copyright 2017 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import ast
+import textwrap
+import unittest
+
+import pasta
+from pasta.base import node_index
+from pasta.base import test_utils
+
+
+class NodeIndexTest(test_utils.TestCase):
+
+  def setUp(self):
+    self.tree = ast.parse(textwrap.dedent("""\
+        a = 1
+        def f(b):
+          if b:
+            return b + a
+        """))
+    self.index = node_index.NodeIndex(self.tree)
+    self.func = self.tree.body[1]
+    self.if_stmt = self.func.body[0]
+    self.ret = self.if_stmt.body[0]
+    self.name_a = self.ret.value.right
+
+  def test_preorder_ids(self):
+    nodes = [self.index.node(i) for i in range(len(self.index))]
+    self.assertIs(self.tree, nodes[0])
+    self.assertEqual(list(range(len(nodes))),
+                     [self.index.node_id(node) for node in nodes])
+    for node in nodes:
+      for child in ast.iter_child_nodes(node):
+        if child in self.index:
+          self.assertLess(self.index.node_id(node), self.index.node_id(child))
+
+  def test_shared_nodes_not_indexed(self):
+    self.assertNotIn(self.name_a.ctx, self.index)
+    shared = (ast.expr_context, ast.operator)
+    self.assertEqual(
+        len([n for n in ast.walk(self.tree) if not isinstance(n, shared)]),
+        len(self.index))
+
+  def test_parent(self):
+    self.assertIsNone(self.index.parent(self.tree))
+    self.assertIs(self.tree, self.index.parent(self.func))
+    self.assertIs(self.ret.value, self.index.parent(self.name_a))
+
+  def test_ancestors(self):
+    self.assertEqual(
+        [self.ret.value, self.ret, self.if_stmt, self.func, self.tree],
+        list(self.index.ancestors(self.name_a)))
+    self.assertEqual([], list(self.index.ancestors(self.tree)))
+
+  def test_enclosing_statement(self):
+    self.assertIs(self.ret, self.index.enclosing_statement(self.name_a))
+    self.assertIs(self.if_stmt, self.index.enclosing_statement(self.ret))
+    self.assertIs(self.func, self.index.enclosing_statement(self.func.args))
+    self.assertIsNone(self.index.enclosing_statement(self.func))
+
+  def test_is_descendant(self):
+    self.assertTrue(self.index.is_descendant(self.name_a, self.func))
+    self.assertTrue(self.index.is_descendant(self.name_a, self.tree))
+    self.assertFalse(self.index.is_descendant(self.name_a, self.name_a))
+    self.assertFalse(self.index.is_descendant(self.func, self.name_a))
+    self.assertFalse(self.index.is_descendant(self.name_a,
+                                              self.tree.body[0]))
+
+  def test_subtree(self):
+    self.assertEqual([self.ret, self.ret.value, self.ret.value.left,
+                      self.name_a], self.index.subtree(self.ret))
+    self.assertEqual(len(self.index), len(self.index.subtree(self.tree)))
+
+  def test_index_while_analyzing(self):
+    src = 'import a\ndef f(b):\n  if b:\n    return b + a\n'
+    tree, sc = pasta.parse(src, analyze=True)
+    index = sc.index
+    func = tree.body[1]
+    name_a = func.body[0].body[0].value.right
+    self.assertIs(func.body[0].body[0].value, sc.parent(name_a))
+    self.assertTrue(index.is_descendant(name_a, func))
+    self.assertIs(func.body[0].body[0], index.enclosing_statement(name_a))
+    self.assertEqual([index.node(i) for i in range(len(index))],
+                     node_index.NodeIndex(tree).subtree(tree))
+
+
+def suite():
+  result = unittest.TestSuite()
+  result.addTests(unittest.makeSuite(NodeIndexTest))
+  return result
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,75 @@
+# coding=utf-8
+"""Annotate very large modules using multiple worker processes."""
+# Copyright 2017 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import ast
+import multiprocessing
+import multiprocessing.pool
+
+from pasta.base import chunks
+
+# Number of chunks to create per worker process, so that workers which finish
+# early can pick up more work.
+CHUNKS_PER_PROCESS = 4
+
+
+def parse(src, processes=None, threads=False):
+  """Parse and annotate source code, splitting the work across processes.
+
+  The source is cut at top-level statement boundaries into chunks which are
+  tokenized and annotated independently, and the results are joined into a
+  single tree. The resulting tree is the same as that of pasta.parse(src).
+
+  Arguments:
+    src: (string) Python source code to parse.
+    processes: (int) Number of worker processes to use. Defaults to the number
+      of CPUs.
+    threads: (bool) Whether to use worker threads rather than processes. This
+      avoids starting processes and pickling the results, but only runs in
+      parallel on builds of python without a global interpreter lock.
+  Returns:
+    The annotated ast.Module.
+  """
+  processes = processes or multiprocessing.cpu_count()
+  lines = src.splitlines(True)
+  tree = ast.parse(src)
+  points = chunks.split_points(tree, lines)
+  ranges = chunks.group(points, lines, processes * CHUNKS_PER_PROCESS)
+  if len(ranges) < 2:
+    return chunks.annotate_source(src)
+
+  flags = chunks.future_flags(tree)
+  work = [(''.join(lines[start - 1:end - 1]), start, flags)
+          for start, end in ranges]
+  if threads:
+    pool = multiprocessing.pool.ThreadPool(min(processes, len(work)))
+  else:
+    pool = multiprocessing.Pool(min(processes, len(work)))
+  try:
+    results = pool.map(_annotate_chunk, work, chunksize=1)
+  finally:
+    pool.close()
+    pool.join()
+  return chunks.join(results)
+
+
+def _annotate_chunk(args):
+  """Annotate a chunk of source in a worker."""
+  src, lineno, flags = args
+  return chunks.annotate_source(src, lineno, flags)
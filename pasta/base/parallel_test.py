@@ -0,0 +1,182 @@
+# coding=utf-8
+"""Tests for parallel."""
+# Copyright 2017 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import ast
+import os.path
+import textwrap
+import threading
+import unittest
+
+import six
+
+import pasta
+from pasta.base import annotate
+from pasta.base import ast_utils
+from pasta.base import codegen
+from pasta.base import parallel
+from pasta.base import test_utils
+
+TESTDATA_DIR = os.path.realpath(
+    os.path.join(os.path.dirname(pasta.__file__), '../testdata'))
+
+
+class ParallelTest(test_utils.TestCase):
+
+  def test_parse_matches_sequential_parse(self):
+    src = textwrap.dedent("""\
+        import aaa
+
+        def foo(a, b):
+          # Comment
+          return (a +
+                  b)
+
+
+        class Bar(object):
+          x = [1, 2]
+
+        # Comment at the end
+        """) * 5
+    tree = parallel.parse(src, processes=2)
+    expected = pasta.parse(src)
+
+    self.assertEqual(ast.dump(expected, include_attributes=True),
+                     ast.dump(tree, include_attributes=True))
+    self.assertMultiLineEqual(src, codegen.to_str(tree))
+    for node in ast.walk(tree.body[2]):
+      if hasattr(node, 'a'):
+        self.assertEqual('', node.a['not_set'])
+
+  def test_parse_threshold(self):
+    src = 'a = 1\nb = 2\n'
+    tree = pasta.parse(src, parallel_threshold=len(src))
+    self.assertMultiLineEqual(src, pasta.dump(tree))
+
+  def test_parse_with_threads(self):
+    src = ''.join('def f%d(a):\n  return [a,  %d]\n\n' % (i, i)
+                  for i in range(20))
+    tree = parallel.parse(src, processes=2, threads=True)
+    self.assertEqual(ast.dump(pasta.parse(src), include_attributes=True),
+                     ast.dump(tree, include_attributes=True))
+    self.assertMultiLineEqual(src, codegen.to_str(tree))
+
+  @unittest.skipIf(six.PY3, 'Only changes the parse of python 2 code.')
+  def test_parse_future_imports(self):
+    src = textwrap.dedent("""\
+        from __future__ import print_function
+        from __future__ import unicode_literals
+        import sys
+
+        """) + ''.join('print(%d, file=sys.stderr)\nx = "a%d"\n\n' % (i, i)
+                       for i in range(20))
+    tree = parallel.parse(src, processes=2, threads=True)
+    self.assertEqual(ast.dump(pasta.parse(src), include_attributes=True),
+                     ast.dump(tree, include_attributes=True))
+    self.assertIsInstance(tree.body[-1].value.s, six.text_type)
+    self.assertMultiLineEqual(src, codegen.to_str(tree))
+
+
+def _source(i):
+  return textwrap.dedent("""\
+      from aaa import bbb%d
+      import ccc
+
+      def foo%d(a, b=ccc):
+        # Comment
+        if a <  %d:
+          return (a +
+                  bbb%d)
+        elif b:
+          return -b
+        with a as c:
+          pass
+      """) % (i, i, i, i)
+
+
+class ReentrancyTest(test_utils.TestCase):
+
+  def test_parse_all(self):
+    sources = [_source(i) for i in range(40)]
+    results = pasta.parse_all(sources, threads=4, analyze=True)
+    self.assertEqual(len(sources), len(results))
+    for src, (tree, sc) in zip(sources, results):
+      expected, expected_sc = pasta.parse(src, analyze=True)
+      self.assertEqual(ast.dump(expected, include_attributes=True),
+                       ast.dump(tree, include_attributes=True))
+      self.assertMultiLineEqual(src, pasta.dump(tree))
+      self.assertItemsEqual(expected_sc.names, sc.names)
+      self.assertItemsEqual(expected_sc.external_references,
+                            sc.external_references)
+
+  def test_new_visitor_class_from_threads(self):
+
+    class Annotator(annotate.AstAnnotator):
+      pass
+
+    sources = [_source(i) for i in range(8)]
+    results = [None] * len(sources)
+    start = threading.Event()
+
+    def annotate_source(i):
+      tree = ast.parse(sources[i])
+      start.wait()
+      Annotator(sources[i]).visit(tree)
+      results[i] = codegen.to_str(tree)
+
+    threads = [threading.Thread(target=annotate_source, args=(i,))
+               for i in range(len(sources))]
+    for thread in threads:
+      thread.start()
+    start.set()
+    for thread in threads:
+      thread.join()
+    self.assertEqual(sources, results)
+    self.assertIn('_visitors', Annotator.__dict__)
+
+  def test_shared_nodes_are_not_annotated(self):
+    tree = pasta.parse('a = b + c\n')
+    self.assertFalse(hasattr(tree.body[0].targets[0].ctx, 'a'))
+    ast_utils.setup_props(tree.body[0].value.op)
+    self.assertFalse(hasattr(tree.body[0].value.op, 'a'))
+
+
+def symmetric_test_generator(filepath):
+  def test(self):
+    with open(filepath, 'r') as handle:
+      src = handle.read()
+    self.assertMultiLineEqual(src, codegen.to_str(parallel.parse(src, 2)))
+  return test
+
+
+for filename in ('for.in', 'if.in', 'import.in', 'try.in', 'while.in'):
+  full_path = os.path.join(TESTDATA_DIR, 'ast', filename)
+  setattr(ParallelTest, 'test_symmetric_' + filename[:-3],
+          symmetric_test_generator(full_path))
+
+
+def suite():
+  result = unittest.TestSuite()
+  result.addTests(unittest.makeSuite(ParallelTest))
+  result.addTests(unittest.makeSuite(ReentrancyTest))
+  return result
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,329 @@
+# coding=utf-8
+"""Find the nodes of an annotated module at positions in its code.
+
+The index is built from the spans of source recorded for each node (see
+codegen.record_spans), trimmed of each node's prefix and suffix formatting. The
+code covered by each top-level statement is cut into segments, each belonging to
+the innermost node covering it, so finding the node at a position is a binary
+search for the statement and then one for the segment.
+
+Segments are kept separately for each top-level statement, relative to its
+start. After the tree is changed, update only rebuilds the segments of the
+statements which changed; the others only move.
+"""
+# Copyright 2017 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import ast
+import bisect
+
+import six
+
+from pasta.base import ast_utils
+from pasta.base import codegen
+from pasta.base import formatting
+
+
+class _Block(object):
+  """Segments of the code of one top-level statement."""
+
+  def __init__(self, text, nodes=(), starts=(), ends=()):
+    self.text = text
+    self.newlines = []
+    i = text.find('\n')
+    while i >= 0:
+      self.newlines.append(i)
+      i = text.find('\n', i + 1)
+
+    order = sorted(range(len(nodes)), key=lambda k: (starts[k], -ends[k]))
+    self.nodes = [nodes[k] for k in order]
+    self.starts = [starts[k] for k in order]
+    self.ends = [ends[k] for k in order]
+
+    # Each segment runs from its start up to the next one, and belongs to the
+    # innermost node covering it and that node's innermost statement, or to
+    # neither if no node of the block covers it.
+    self.segment_starts = []
+    self.segment_nodes = []
+    self.segment_statements = []
+    statements = []
+    stack = []
+    for k, node in enumerate(self.nodes):
+      while stack and self.ends[stack[-1]] <= self.starts[k]:
+        self._add_segment(self.ends[stack.pop()], stack, statements)
+      statements.append(
+          node if isinstance(node, ast.stmt) else
+          statements[stack[-1]] if stack else None)
+      stack.append(k)
+      self._add_segment(self.starts[k], stack, statements)
+    while stack:
+      self._add_segment(self.ends[stack.pop()], stack, statements)
+
+  def _add_segment(self, start, stack, statements):
+    node = self.nodes[stack[-1]] if stack else None
+    statement = statements[stack[-1]] if stack else None
+    if self.segment_starts and self.segment_starts[-1] == start:
+      self.segment_starts.pop()
+      self.segment_nodes.pop()
+      self.segment_statements.pop()
+    if not self.segment_nodes or self.segment_nodes[-1] is not node:
+      self.segment_starts.append(start)
+      self.segment_nodes.append(node)
+      self.segment_statements.append(statement)
+
+  def segment(self, offset):
+    """Get the innermost node and statement at an offset in the block."""
+    k = bisect.bisect_right(self.segment_starts, offset) - 1
+    if k < 0:
+      return None, None
+    return self.segment_nodes[k], self.segment_statements[k]
+
+
+def _statement_block(stmt):
+  """Index the code of a top-level statement from the spans of its nodes."""
+  verbatim = ast_utils.prop(stmt, 'verbatim')
+  if verbatim:
+    # Statements left unannotated by chunks.annotate_imports
+    prefix = ast_utils.prop(stmt, 'prefix')
+    return _Block(prefix + verbatim, [stmt], [len(prefix)],
+                  [len(prefix) + len(verbatim)])
+
+  span = ast_utils.prop(stmt, formatting.SPAN)
+  if span:
+    result = _block_from_spans(stmt, span, _tree_span)
+    if result is not None:
+      return result
+  # The statement has changed since its spans were recorded (or they never
+  # were), so find them again in its own code. They are kept in the index only:
+  # recording them in the tree would make the printer copy its nodes from their
+  # spans, hiding any change to their fields not reported with mark_changed.
+  _, spans = codegen.collect_spans(stmt)
+  return _block_from_spans(stmt, spans[stmt], spans.get)
+
+
+def _tree_span(node):
+  return ast_utils.prop(node, formatting.SPAN)
+
+
+def _block_from_spans(stmt, span, get_span):
+  """Index a statement, or return None if its nodes' spans are inconsistent.
+
+  Arguments:
+    stmt: (ast.stmt) Top-level statement to index.
+    span: (tuple) Span of the statement.
+    get_span: (callable) Called with a node to get its span, or None.
+  """
+  source, base, _, _ = span
+  text = source[base:span[2]]
+  nodes = []
+  starts = []
+  ends = []
+  parents = []
+  stack = [(stmt, -1)]
+  while stack:
+    node, parent = stack.pop()
+    span = get_span(node)
+    if not span:
+      continue
+    if span[0] is not source:
+      return None
+    parents.append(parent)
+    nodes.append(node)
+    starts.append(span[1] - base)
+    ends.append(span[2] - base)
+    stack.extend((child, len(nodes) - 1)
+                 for child in ast.iter_child_nodes(node))
+
+  # Trim the formatting before and after each node's own code. This is its own
+  # prefix and suffix, along with that of any descendant which was printed
+  # first or last; e.g. the comment ending a statement is usually the suffix of
+  # its last name or number.
+  children = [[] for _ in nodes]
+  for k in range(1, len(nodes)):
+    children[parents[k]].append(k)
+  lead = [0] * len(nodes)
+  trail = [0] * len(nodes)
+  for k in range(len(nodes) - 1, -1, -1):
+    start, end = starts[k], ends[k]
+    prefix = ast_utils.prop(nodes[k], 'prefix')
+    if prefix and text.startswith(prefix, start, end):
+      lead[k] = len(prefix)
+    suffix = ast_utils.prop(nodes[k], 'suffix')
+    if suffix and end - len(suffix) >= start + lead[k] and text.endswith(
+        suffix, start, end):
+      trail[k] = len(suffix)
+    for child in children[k]:
+      if starts[child] == start + lead[k]:
+        lead[k] += lead[child]
+      if ends[child] == end - trail[k]:
+        trail[k] += trail[child]
+  for k in range(len(nodes)):
+    starts[k] += lead[k]
+    ends[k] = max(starts[k], ends[k] - trail[k])
+  return _Block(text, nodes, starts, ends)
+
+
+class PositionIndex(object):
+  """Index of the positions of the nodes of an annotated module.
+
+  Positions are (line, col) tuples, where lines are 1-based and columns are
+  0-based, counted in the same units as the positions of ast nodes (bytes of
+  utf-8 for unicode source). Positions refer to the code of the tree as it would
+  be printed, which is the source it was parsed from until it is changed.
+  """
+
+  def __init__(self, tree):
+    """Index a module.
+
+    Arguments:
+      tree: (ast.Module) Annotated module, ideally with spans recorded (see
+        pasta.parse), which are used to find the positions of its nodes without
+        printing it.
+    """
+    self._tree = tree
+    self._statement_blocks = {}
+    self.update()
+
+  def update(self):
+    """Update the index after the tree has been changed.
+
+    Only the top-level statements which have changed are indexed again. As for
+    spans, changes to the fields of a node must be reported with
+    ast_utils.mark_changed to be noticed. Statements without recorded spans are
+    always indexed again, since there is no way to tell whether they changed.
+    """
+    tree = self._tree
+    statement_blocks = {}
+    blocks = [_Block(ast_utils.prop(tree, 'prefix'))]
+    for stmt in tree.body:
+      block = self._statement_blocks.get(stmt)
+      if block is None or not ast_utils.prop(stmt, formatting.SPAN):
+        block = _statement_block(stmt)
+      statement_blocks[stmt] = block
+      blocks.append(block)
+    blocks.append(_Block(ast_utils.prop(tree, 'suffix')))
+
+    # Offset and number of lines before the start of each block.
+    self._starts = []
+    self._lines = []
+    offset = lines = 0
+    for block in blocks:
+      self._starts.append(offset)
+      self._lines.append(lines)
+      offset += len(block.text)
+      lines += len(block.newlines)
+    self._blocks = blocks
+    self._statement_blocks = statement_blocks
+    self._unicode = any(isinstance(block.text, six.text_type)
+                        for block in blocks)
+
+  def node_at(self, line, col):
+    """Get the innermost node at a position."""
+    node, _ = self._segment(self.offset(line, col))
+    return self._tree if node is None else node
+
+  def statement_at(self, line, col):
+    """Get the innermost statement at a position, or None if none is there."""
+    _, statement = self._segment(self.offset(line, col))
+    return statement
+
+  def nodes_in_range(self, start, end):
+    """Get the nodes whose code lies entirely between two positions.
+
+    Arguments:
+      start: ((int, int)) Position where the range starts.
+      end: ((int, int)) Position where the range ends, exclusive.
+    Returns:
+      A list of the nodes in the range, in order of their start.
+    """
+    start = self.offset(*start)
+    end = self.offset(*end)
+    result = []
+    i = max(0, bisect.bisect_right(self._starts, start) - 1)
+    while i < len(self._blocks) and self._starts[i] < end:
+      block = self._blocks[i]
+      base = self._starts[i]
+      k = bisect.bisect_left(block.starts, start - base)
+      while k < len(block.nodes) and block.starts[k] < end - base:
+        if block.ends[k] <= end - base:
+          result.append(block.nodes[k])
+        k += 1
+      i += 1
+    return result
+
+  def offset(self, line, col):
+    """Get the offset in the code of a position."""
+    line_start = self._line_start(line)
+    if col and self._unicode:
+      text = self._text(line_start, line_start + col)
+      if len(text.encode('utf-8')) != col:
+        # Count the characters in the first col bytes of the line.
+        line_text = self._line_text(line_start).encode('utf-8')
+        return line_start + len(line_text[:col].decode('utf-8', 'ignore'))
+    return line_start + col
+
+  def position(self, offset):
+    """Get the position of an offset in the code."""
+    i = max(0, bisect.bisect_right(self._starts, offset) - 1)
+    line = 1 + self._lines[i] + bisect.bisect_left(
+        self._blocks[i].newlines, offset - self._starts[i])
+    line_start = self._line_start(line)
+    text = self._text(line_start, offset)
+    if isinstance(text, six.text_type):
+      return line, len(text.encode('utf-8'))
+    return line, len(text)
+
+  def _segment(self, offset):
+    i = max(0, bisect.bisect_right(self._starts, offset) - 1)
+    return self._blocks[i].segment(offset - self._starts[i])
+
+  def _line_start(self, line):
+    """Get the offset of the start of a line."""
+    if line <= 1:
+      return 0
+    # The line starts after the (line - 1)th newline.
+    newline = line - 2
+    i = bisect.bisect_right(self._lines, newline) - 1
+    newlines = self._blocks[i].newlines
+    if newline - self._lines[i] >= len(newlines):
+      raise ValueError('Line %d is past the end of the code' % line)
+    return self._starts[i] + newlines[newline - self._lines[i]] + 1
+
+  def _text(self, start, end):
+    """Get the code between two offsets."""
+    parts = []
+    i = max(0, bisect.bisect_right(self._starts, start) - 1)
+    while i < len(self._blocks) and self._starts[i] < end:
+      base = self._starts[i]
+      parts.append(self._blocks[i].text[max(0, start - base):end - base])
+      i += 1
+    return ''.join(parts)
+
+  def _line_text(self, line_start):
+    """Get the code of the line starting at an offset."""
+    parts = []
+    i = max(0, bisect.bisect_right(self._starts, line_start) - 1)
+    while i < len(self._blocks):
+      text = self._blocks[i].text[max(0, line_start - self._starts[i]):]
+      newline = text.find('\n')
+      if newline >= 0:
+        parts.append(text[:newline])
+        break
+      parts.append(text)
+      i += 1
+    return ''.join(parts)
@@ -0,0 +1,143 @@
+# coding=utf-8
+"""Tests for position_index."""
+# Copyright 2017 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import ast
+import unittest
+
+import pasta
+from pasta.base import ast_utils
+from pasta.base import formatting
+from pasta.base import position_index
+from pasta.base import test_utils
+
+_SRC = ('# Comment\n'
+        '\n'
+        'def f(a):\n'
+        '  # Comment\n'
+        '  return a + 1  # Comment\n'
+        '\n'
+        'x = [f, 2, b]\n')
+
+
+class PositionIndexTest(test_utils.TestCase):
+
+  def setUp(self):
+    self.tree = pasta.parse(_SRC, record_spans=True)
+    self.index = position_index.PositionIndex(self.tree)
+    self.func = self.tree.body[0]
+    self.ret = self.func.body[0]
+
+  def test_node_at(self):
+    self.assertIs(self.func, self.index.node_at(3, 0))
+    self.assertIs(self.func.args.args[0], self.index.node_at(3, 6))
+    self.assertIs(self.ret, self.index.node_at(5, 2))
+    self.assertIs(self.ret.value.left, self.index.node_at(5, 9))
+    self.assertIs(self.ret.value, self.index.node_at(5, 11))
+    self.assertIs(self.ret.value.right, self.index.node_at(5, 13))
+    self.assertIs(self.tree.body[1].targets[0], self.index.node_at(7, 0))
+
+  def test_formatting_belongs_to_parent(self):
+    self.assertIs(self.tree, self.index.node_at(1, 3))
+    self.assertIs(self.func, self.index.node_at(4, 4))
+    self.assertIs(self.tree, self.index.node_at(5, 18))
+    self.assertIs(self.tree, self.index.node_at(6, 0))
+
+  def test_matches_node_positions(self):
+    for node in ast.walk(self.tree):
+      if isinstance(node, (ast.expr, ast.stmt)):
+        # The innermost node there may be the node's first child.
+        found = self.index.node_at(node.lineno, node.col_offset)
+        self.assertIn(found, list(ast.walk(node)))
+        self.assertEqual((node.lineno, node.col_offset),
+                         (found.lineno, found.col_offset))
+
+  def test_statement_at(self):
+    self.assertIs(self.ret, self.index.statement_at(5, 13))
+    self.assertIs(self.func, self.index.statement_at(3, 6))
+    self.assertIsNone(self.index.statement_at(1, 3))
+
+  def test_nodes_in_range(self):
+    self.assertEqual([self.ret.value, self.ret.value.left,
+                      self.ret.value.right],
+                     self.index.nodes_in_range((5, 9), (5, 14)))
+    self.assertEqual([self.ret.value.left],
+                     self.index.nodes_in_range((5, 8), (5, 11)))
+
+  def test_positions(self):
+    for offset in range(len(_SRC)):
+      self.assertEqual(offset, self.index.offset(*self.index.position(offset)))
+    self.assertEqual((5, 2), self.index.position(_SRC.index('return')))
+
+  def test_unicode_columns(self):
+    src = u'x = "éé" + b\n'
+    tree = pasta.parse(src, record_spans=True)
+    index = position_index.PositionIndex(tree)
+    name = tree.body[0].value.right
+    self.assertEqual(13, name.col_offset)
+    self.assertIs(name, index.node_at(1, 13))
+    self.assertEqual((1, 13), index.position(src.index('b')))
+
+  def test_update(self):
+    name = self.ret.value.left
+    name.id = 'abc'
+    ast_utils.mark_changed(name)
+    other = self.tree.body[1]
+    self.index.update()
+    self.assertIs(name, self.index.node_at(5, 11))
+    self.assertIs(self.ret.value, self.index.node_at(5, 13))
+    self.assertIs(other.targets[0], self.index.node_at(7, 0))
+    self.assertIs(self.ret, self.index.statement_at(5, 11))
+    # Spans found again for the changed statement stay in the index
+    self.assertFalse(ast_utils.prop(self.ret, formatting.SPAN))
+
+    self.tree.body.insert(0, pasta.parse('import os\n').body[0])
+    ast_utils.mark_changed(self.tree)
+    self.index.update()
+    self.assertTrue(pasta.dump(self.tree).startswith('# Comment\n\nimport os'))
+    self.assertIs(self.tree.body[0], self.index.node_at(3, 0))
+    self.assertIs(other.targets[0], self.index.node_at(8, 0))
+
+  def test_without_spans(self):
+    tree = pasta.parse(_SRC)
+    index = position_index.PositionIndex(tree)
+    self.assertIs(tree.body[0].body[0].value.right, index.node_at(5, 13))
+
+  def test_does_not_record_spans(self):
+    tree = pasta.parse('x = 1\ny = 2\n')
+    index = position_index.PositionIndex(tree)
+    self.assertIs(tree.body[1].targets[0], index.node_at(2, 0))
+    for node in ast.walk(tree):
+      self.assertFalse(ast_utils.prop(node, formatting.SPAN))
+
+    # Changes to fields are printed without being reported
+    tree.body[1].targets[0].id = 'w'
+    self.assertEqual('x = 1\nw = 2\n', pasta.dump(tree))
+    index.update()
+    self.assertIs(tree.body[1].targets[0], index.node_at(2, 0))
+
+
+def suite():
+  result = unittest.TestSuite()
+  result.addTests(unittest.makeSuite(PositionIndexTest))
+  return result
+
+
+if __name__ == '__main__':
+  unittest.main()
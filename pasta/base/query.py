@@ -0,0 +1,178 @@
+# coding=utf-8
+"""Find the nodes of a syntax tree matching many structural patterns at once.
+
+All of the patterns of a query are matched in a single pass over a
+node_index.NodeIndex of the tree. Only nodes whose type is the type of some
+pattern are checked, and subtrees which contain no such nodes are skipped
+entirely using the type masks of the index.
+"""
+# Copyright 2017 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import ast
+
+import six
+
+from pasta.base import node_index
+
+# Types of the nodes which ast.parse shares between trees, such as ast.Load and
+# ast.Add. They have no single place in a tree, so they are not indexed.
+_SHARED_TYPES = (ast.expr_context, ast.boolop, ast.operator, ast.unaryop,
+                 ast.cmpop)
+
+
+class Pattern(object):
+  """A pattern which nodes of a syntax tree can match.
+
+  For example, calls to a function named `open` with one argument:
+
+    Pattern(ast.Call, func=Pattern(ast.Name, id='open'),
+            args=lambda args: len(args) == 1)
+
+  Operators and expression contexts (such as ast.Add and ast.Load) are shared
+  between trees rather than indexed, so they can only be matched through the
+  field of their parent, e.g. Pattern(ast.BinOp, op=Pattern(ast.Add)), and
+  patterns for them cannot constrain their parent.
+  """
+
+  def __init__(self, types, parent=None, child=None, **fields):
+    """Create a pattern.
+
+    Arguments:
+      types: (type or tuple of types) Types of node which match; subclasses of
+        these types also match.
+      parent: (Pattern) If given, the parent of a matching node must match it.
+      child: (Pattern) If given, one of the children of a matching node must
+        match it.
+      **fields: Constraints on the fields of a matching node. Each constraint is
+        a Pattern which the node in the field (or, for a field which holds a
+        list, one of the nodes in it) must match, a function which must return
+        True for the value of the field, or a value which the field must equal.
+    Raises:
+      ValueError: if a parent is given for operators or expression contexts.
+    """
+    self.types = types if isinstance(types, tuple) else (types,)
+    if parent is not None and _is_shared(self):
+      raise ValueError('Operators and expression contexts have no parent')
+    self.parent = parent
+    self.child = child
+    self.fields = sorted(six.iteritems(fields))
+
+  def matches(self, node, index):
+    """Whether a node matches this pattern.
+
+    Arguments:
+      node: (ast.AST) Node to check.
+      index: (node_index.NodeIndex) Index of the tree containing the node, used
+        to find its parent.
+    """
+    if not isinstance(node, self.types):
+      return False
+    for name, expected in self.fields:
+      value = getattr(node, name, None)
+      if isinstance(expected, Pattern):
+        values = value if isinstance(value, list) else [value]
+        if not any(isinstance(v, ast.AST) and expected.matches(v, index)
+                   for v in values):
+          return False
+      elif callable(expected) and not isinstance(expected, type):
+        if not expected(value):
+          return False
+      elif value != expected:
+        return False
+    if self.parent is not None:
+      parent = index.parent(node) if node in index else None
+      if parent is None or not self.parent.matches(parent, index):
+        return False
+    if self.child is not None:
+      if not any(self.child.matches(child, index)
+                 for child in ast.iter_child_nodes(node)):
+        return False
+    return True
+
+
+def _is_shared(pattern):
+  """Whether a pattern matches operators or expression contexts."""
+  return any(issubclass(t, _SHARED_TYPES) for t in pattern.types)
+
+
+class Query(object):
+  """A set of patterns to find in syntax trees in a single pass."""
+
+  def __init__(self, patterns):
+    """Compile a query.
+
+    Arguments:
+      patterns: (list of Pattern) Patterns to find.
+    Raises:
+      ValueError: if a pattern matches operators or expression contexts, which
+        are not indexed; match them through a field of their parent instead.
+    """
+    self.patterns = list(patterns)
+    for pattern in self.patterns:
+      if _is_shared(pattern):
+        raise ValueError(
+            'Operators and expression contexts can only be found through a '
+            'field of their parent, as in Pattern(ast.Name, '
+            'ctx=Pattern(ast.Load))')
+    self._mask = node_index.types_mask(
+        t for pattern in self.patterns for t in pattern.types)
+    # Indexes of the patterns which nodes of each type could match.
+    self._candidates = {}
+
+  def run(self, tree):
+    """Find the nodes of a tree which match each pattern.
+
+    Arguments:
+      tree: (ast.AST|node_index.NodeIndex) Syntax tree to search, or an index
+        of it. An index can be reused for many queries, as long as the tree is
+        not changed in between.
+    Returns:
+      A list with, for each pattern, a list of the nodes matching it in
+      preorder.
+    """
+    index = (tree if isinstance(tree, node_index.NodeIndex)
+             else node_index.NodeIndex(tree))
+    results = [[] for _ in self.patterns]
+    for node in index.find(self._mask):
+      try:
+        candidates = self._candidates[node.__class__]
+      except KeyError:
+        candidates = self._candidates[node.__class__] = [
+            i for i, pattern in enumerate(self.patterns)
+            if issubclass(node.__class__, pattern.types)]
+      for i in candidates:
+        if self.patterns[i].matches(node, index):
+          results[i].append(node)
+    return results
+
+
+def find(tree, patterns):
+  """Find the nodes of a tree which match each of some patterns.
+
+  Arguments:
+    tree: (ast.AST|node_index.NodeIndex) Syntax tree to search, or an index of
+      it.
+    patterns: (list of Pattern) Patterns to find.
+  Returns:
+    A list with, for each pattern, a list of the nodes matching it in preorder.
+  Raises:
+    ValueError: if a pattern matches operators or expression contexts; see
+      Query.
+  """
+  return Query(patterns).run(tree)
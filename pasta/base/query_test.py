@@ -0,0 +1,103 @@
+# coding=utf-8
+"""Tests for query."""
+# Copyright 2017 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import ast
+import textwrap
+import unittest
+
+from pasta.base import ast_utils
+from pasta.base import node_index
+from pasta.base import query
+from pasta.base import test_utils
+from pasta.base.query import Pattern
+
+
+class QueryTest(test_utils.TestCase):
+
+  def setUp(self):
+    self.tree = ast.parse(textwrap.dedent("""\
+        import os
+        def f(a, b):
+          x = a.b
+          while x:
+            return os.path.join(a, b)
+        class C(object):
+          y = os.sep
+        """))
+
+  def test_types(self):
+    names, stmts = query.find(self.tree, [Pattern(ast.Name), Pattern(ast.stmt)])
+    self.assertEqual(ast_utils.find_nodes_by_type(self.tree, ast.Name), names)
+    self.assertEqual(ast_utils.find_nodes_by_type(self.tree, ast.stmt), stmts)
+
+  def test_fields(self):
+    os_attr = Pattern(ast.Attribute, value=Pattern(ast.Name, id='os'))
+    two_args = Pattern(ast.arguments, args=lambda args: len(args) == 2)
+    os_attrs, args = query.find(self.tree, [os_attr, two_args])
+    self.assertEqual(['path', 'sep'], [node.attr for node in os_attrs])
+    self.assertEqual([self.tree.body[1].args], args)
+
+  def test_list_fields(self):
+    has_return = Pattern(ast.stmt, body=Pattern(ast.Return))
+    self.assertEqual([[self.tree.body[1].body[1]]],
+                     query.find(self.tree, [has_return]))
+
+  def test_parent_and_child(self):
+    in_class = Pattern(ast.Assign, parent=Pattern(ast.ClassDef))
+    with_call = Pattern(ast.stmt, child=Pattern(ast.Call))
+    assigns, stmts = query.find(self.tree, [in_class, with_call])
+    self.assertEqual([self.tree.body[2].body[0]], assigns)
+    self.assertEqual([self.tree.body[1].body[1].body[0]], stmts)
+
+  def test_shared_nodes(self):
+    stores = Pattern(ast.Name, ctx=Pattern(ast.Store))
+    self.assertEqual([['x', 'y']],
+                     [[node.id for node in nodes]
+                      for nodes in query.find(self.tree, [stores])])
+    with self.assertRaises(ValueError):
+      query.find(self.tree, [Pattern(ast.Load)])
+    with self.assertRaises(ValueError):
+      query.Query([Pattern((ast.Name, ast.Add))])
+    with self.assertRaises(ValueError):
+      Pattern(ast.Add, parent=Pattern(ast.BinOp))
+
+  def test_reuse_index(self):
+    index = node_index.NodeIndex(self.tree)
+    q = query.Query([Pattern(ast.ClassDef), Pattern(ast.Import)])
+    self.assertEqual([[self.tree.body[2]], [self.tree.body[0]]], q.run(index))
+    self.assertEqual(q.run(self.tree), q.run(index))
+
+  def test_skips_subtrees(self):
+    index = node_index.NodeIndex(self.tree)
+    mask = node_index.types_mask([ast.While])
+    func, cls = self.tree.body[1], self.tree.body[2]
+    self.assertTrue(index.type_mask(func) & mask)
+    self.assertFalse(index.type_mask(cls) & mask)
+    self.assertEqual([func.body[1]], list(index.find(mask)))
+
+
+def suite():
+  result = unittest.TestSuite()
+  result.addTests(unittest.makeSuite(QueryTest))
+  return result
+
+
+if __name__ == '__main__':
+  unittest.main()
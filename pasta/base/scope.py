@@ -18,40 +18,142 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import array
 import ast
+import fnmatch
+import itertools
+
+import six
+
+from pasta.base import node_index
 
 # TODO: Support relative imports
 
+# Number of bits of a symbol table key which hold the scope or symbol id.
+_OWNER_BITS = 32
+
+
+def _group(owner, name, size):
+  """Group the indexes of an array of ids by their value.
+
+  Groupings are kept in the owner's `_groups` dict, and made again only once
+  the array has grown; the arrays grouped are only ever appended to.
+
+  Arguments:
+    owner: (object) Object the array is an attribute of.
+    name: (string) Name of the array.
+    size: (int) Number of possible ids. Entries of -1 are left out.
+  Returns:
+    A tuple (order, starts) of arrays, where order[starts[k]:starts[k + 1]] are
+    the indexes of the entries equal to k, in increasing order.
+  """
+  keys = getattr(owner, name)
+  stamp = (len(keys), size)
+  try:
+    group_stamp, order, starts = owner._groups[name]
+    if group_stamp == stamp:
+      return order, starts
+  except KeyError:
+    pass
+  starts = array.array('i', [0]) * (size + 1)
+  for key in keys:
+    if key >= 0:
+      starts[key + 1] += 1
+  for key in range(size):
+    starts[key + 1] += starts[key]
+  order = array.array('i', [0]) * starts[size]
+  ends = array.array('i', starts)
+  for i, key in enumerate(keys):
+    if key >= 0:
+      order[ends[key]] = i
+      ends[key] += 1
+  owner._groups[name] = stamp, order, starts
+  return order, starts
+
 
 class ScopeVisitor(ast.NodeVisitor):
+  """Walks a syntax tree to find the names defined and referenced in it.
+
+  The analysis is driven by enter_node and leave_node, which must be called for
+  each node in the tree in any depth-first order; `visit` walks the tree with an
+  explicit stack to do this, but the same hooks can also be called from another
+  traversal such as the one used for annotation (see pasta.parse).
+
+  Each node is analyzed in the scope it is evaluated in. By default this is the
+  scope of its parent, or for the children of a function or class definition the
+  scope the definition creates; parts of definitions which are evaluated in the
+  enclosing scope (like decorators and default values) are registered when the
+  definition is entered.
+  """
 
   def __init__(self):
     super(ScopeVisitor, self).__init__()
     self.root_scope = self.scope = RootScope()
-    self._parent = None
+    # Stack of the nodes being visited, and the scope of each one's children
+    self._nodes = []
+    self._scopes = []
+    # Scopes of nodes not evaluated in the same scope as their siblings
+    self._child_scopes = {}
+    self._enter_visitors = {}
+    self._leave_visitors = {}
 
   def visit(self, node):
-    if node is None:
-      return
-    self.root_scope.set_parent(node, self._parent)
-    tmp = self._parent
-    self._parent = node
-    super(ScopeVisitor, self).visit(node)
-    self._parent = tmp
-
-  def visit_in_order(self, node, *attrs):
-    for attr in attrs:
-      try:
-        val = getattr(node, attr)
-        if isinstance(val, list):
-          for item in val:
-            self.visit(item)
-        else:
-          self.visit(val)
-      except AttributeError:
-        pass
+    """Visit a node and all of its children."""
+    self.enter_node(node)
+    iterators = [ast.iter_child_nodes(node)]
+    while iterators:
+      child = next(iterators[-1], None)
+      if child is None:
+        iterators.pop()
+        self.leave_node(self._nodes[-1])
+      else:
+        self.enter_node(child)
+        iterators.append(ast.iter_child_nodes(child))
+
+  def enter_node(self, node):
+    """Called when a node is reached, before any of its children."""
+    if self._nodes:
+      scope = self._child_scopes.pop(node, self._scopes[-1])
+    else:
+      scope = self.scope
+    self.root_scope.index.enter(node)
+    self._nodes.append(node)
+    self._scopes.append(scope)
+    self.scope = scope
+
+    try:
+      visitor = self._enter_visitors[node.__class__]
+    except KeyError:
+      visitor = self._enter_visitors[node.__class__] = getattr(
+          self, 'visit_' + node.__class__.__name__, None)
+    if visitor is not None:
+      visitor(node)
+
+  def leave_node(self, node):
+    """Called once a node and all of its children have been visited."""
+    try:
+      visitor = self._leave_visitors[node.__class__]
+    except KeyError:
+      visitor = self._leave_visitors[node.__class__] = getattr(
+          self, 'leave_' + node.__class__.__name__, None)
+    if visitor is not None:
+      visitor(node)
+
+    self.root_scope.index.leave(node)
+    self._nodes.pop()
+    self._scopes.pop()
+    self.scope = self._scopes[-1] if self._scopes else self.root_scope
+
+  def enter_scope(self, node, outer_nodes):
+    """Evaluate children of a node in a new scope, except for outer_nodes."""
+    outer_scope = self.scope
+    for outer_node in outer_nodes:
+      if outer_node is not None:
+        self._child_scopes[outer_node] = outer_scope
+    self._scopes[-1] = Scope(outer_scope)
 
   def visit_Import(self, node):
+    symbols = self.root_scope.symbols
     for alias in node.names:
       name_parts = alias.name.split('.')
 
@@ -60,97 +162,337 @@ class ScopeVisitor(ast.NodeVisitor):
 
       if not alias.asname:
         # If not aliased, define the top-level module of the import
-        cur_name = self.scope.define_name(name_parts[0], alias)
+        symbol = symbols.bind(self.scope.scope_id, name_parts[0])
+        symbols.define(symbol, alias, name_parts[0])
 
         # Define names of sub-modules imported
         for part in name_parts[1:]:
-          cur_name = cur_name.lookup_name(part)
-          cur_name.define(alias)
+          symbol = symbols.attribute(symbol, part)
+          symbols.define(symbol, alias)
 
       else:
         # If the imported name is aliased, define that name only
-        self.scope.define_name(alias.asname, alias)
-    self.generic_visit(node)
+        self._define(alias.asname, alias, alias.name)
 
   def visit_ImportFrom(self, node):
     if node.module:
       self.scope.add_external_reference(node.module, node)
     for alias in node.names:
-      self.scope.define_name(alias.asname or alias.name, alias)
+      self._define(alias.asname or alias.name, alias,
+                   node.module and node.module + '.' + alias.name)
       if node.module:
         self.scope.add_external_reference(node.module + '.' + alias.name, alias,
                                           packages=False)
       # TODO: else? relative imports
-    self.generic_visit(node)
 
   def visit_Name(self, node):
     if isinstance(node.ctx, (ast.Store, ast.Param)):
-      self.scope.define_name(node.id, node)
+      self._define(node.id, node)
     elif isinstance(node.ctx, ast.Load):
-      self.scope.lookup_name(node.id).add_reference(node)
-      self.root_scope.set_name_for_node(node, self.scope.lookup_name(node.id))
-    self.generic_visit(node)
+      symbols = self.root_scope.symbols
+      symbols.add_read(symbols.lookup(self.scope.scope_id, node.id), node)
 
   def visit_FunctionDef(self, node):
-    try:
-      self.scope.define_name(node.name, node)
-      self.scope = Scope(self.scope)
-      # Visit decorator list first to avoid declarations in args
-      self.visit_in_order(node, 'decorator_list', 'args', 'returns', 'body')
-    finally:
-      self.scope = self.scope.parent_scope
-
-  def visit_arguments(self, node):
-    # Visit defaults first to avoid declarations in args
-    self.visit_in_order(node, 'defaults', 'args', 'vararg', 'kwarg')
+    self._define(node.name, node)
+    # Decorators, defaults and annotations are evaluated outside the function
+    args = node.args
+    arg_nodes = (list(args.args) + list(getattr(args, 'kwonlyargs', ())) +
+                 [args.vararg, args.kwarg])
+    self.enter_scope(node, itertools.chain(
+        node.decorator_list, args.defaults, getattr(args, 'kw_defaults', ()),
+        (getattr(node, 'returns', None),),
+        (getattr(arg, 'annotation', None) for arg in arg_nodes
+         if isinstance(arg, ast.AST))))
 
   def visit_arg(self, node):
-    self.scope.define_name(node.arg, node)
-    self.generic_visit(node)
+    self._define(node.arg, node)
 
   def visit_ClassDef(self, node):
+    self._define(node.name, node)
+    # Decorators and bases are evaluated outside the class
+    self.enter_scope(node, itertools.chain(
+        node.decorator_list, node.bases, getattr(node, 'keywords', ())))
+
+  def leave_Attribute(self, node):
+    symbols = self.root_scope.symbols
+    value_symbol = symbols.symbol_for_node(node.value)
+    if value_symbol is not None:
+      symbols.add_read(symbols.attribute(value_symbol, node.attr), node)
+
+  def _define(self, name, node, qualified_name=None):
+    symbols = self.root_scope.symbols
+    symbols.define(symbols.bind(self.scope.scope_id, name), node,
+                   qualified_name)
+
+
+class SymbolTable(object):
+  """Names defined and referenced in a tree, stored in flat arrays.
+
+  Each distinct identifier, each scope and each symbol has an integer id. A
+  symbol is either a name bound in a scope or an attribute of another symbol
+  (e.g. `b` in `a.b`). Symbols are found in a single dict keyed by the ids of
+  their identifier and of the scope (or symbol) they belong to, so finding the
+  symbol a name refers to takes one dict lookup per enclosing scope, without
+  allocating any objects.
+
+  Reads are appended to a pair of arrays of nodes and the symbols they read.
+  Lists of the reads of each symbol, the symbols of each scope and the
+  attributes of each symbol are only made when they are asked for, by grouping
+  the arrays all at once. Name objects, and the `names` of each Scope, are views
+  of the table.
+
+  Symbols which refer to imported modules and names, and their attributes,
+  have a fully-qualified name; e.g. `c` after `from a.b import c` is `a.b.c`.
+  The Name and Attribute nodes reading them are indexed by that name as they
+  are added, so all uses of a qualified name can be found at once.
+  """
+
+  def __init__(self):
+    self._identifiers = []
+    self._identifier_ids = {}
+    # For each scope, the ids of it and its enclosing scopes, innermost first.
+    self._scope_chains = []
+    # Symbols bound in each scope and attributes of each symbol, keyed by the
+    # identifier id shifted by _OWNER_BITS, or'd with the scope or symbol id.
+    self._bindings = {}
+    self._attribute_bindings = {}
+    # For each symbol, its identifier, the scope it is bound in (or -1 for
+    # attributes), the symbol it is an attribute of (or -1 for names) and the
+    # node defining it (or None).
+    self._symbol_identifiers = array.array('i')
+    self._symbol_scopes = array.array('i')
+    self._symbol_parents = array.array('i')
+    self._definitions = []
+    # For each symbol, its fully-qualified name (or None) and whether it has
+    # been read or has attributes.
+    self._qualified_names = []
+    self._referenced = array.array('b')
+    # Nodes reading symbols, and the symbol each one reads.
+    self._read_nodes = []
+    self._read_symbols = array.array('i')
+    # Name and Attribute nodes reading each qualified name.
+    self._uses = {}
+    # Symbol each Name or Attribute node in a load context refers to.
+    self._node_symbols = {}
+    # Groupings of the arrays above, made by _group.
+    self._groups = {}
+    self._views = {}
+
+  def identifier_id(self, identifier):
+    """Get the id of an identifier, assigning a new one if needed."""
+    try:
+      return self._identifier_ids[identifier]
+    except KeyError:
+      self._identifiers.append(identifier)
+      result = self._identifier_ids[identifier] = len(self._identifiers) - 1
+      return result
+
+  def new_scope(self, parent_scope_id):
+    """Add a scope, nested in the given one (or None) and return its id."""
+    scope_id = len(self._scope_chains)
+    chain = (scope_id,)
+    if parent_scope_id is not None:
+      chain += self._scope_chains[parent_scope_id]
+    self._scope_chains.append(chain)
+    return scope_id
+
+  def _new_symbol(self, identifier_id, scope_id, parent):
+    self._symbol_identifiers.append(identifier_id)
+    self._symbol_scopes.append(scope_id)
+    self._symbol_parents.append(parent)
+    self._definitions.append(None)
+    self._qualified_names.append(None)
+    self._referenced.append(0)
+    return len(self._definitions) - 1
+
+  def find(self, scope_id, identifier):
+    """Get the symbol bound to an identifier in a scope, or None."""
+    identifier_id = self._identifier_ids.get(identifier)
+    if identifier_id is None:
+      return None
+    return self._bindings.get((identifier_id << _OWNER_BITS) | scope_id)
+
+  def bind(self, scope_id, identifier):
+    """Get the symbol bound to an identifier in a scope, adding it if needed."""
+    identifier_id = self.identifier_id(identifier)
+    key = (identifier_id << _OWNER_BITS) | scope_id
     try:
-      self.scope.define_name(node.name, node)
-      self.scope = Scope(self.scope)
-      self.generic_visit(node)
-    finally:
-      self.scope = self.scope.parent_scope
+      return self._bindings[key]
+    except KeyError:
+      symbol = self._bindings[key] = self._new_symbol(identifier_id, scope_id,
+                                                      -1)
+      return symbol
+
+  def lookup(self, scope_id, identifier):
+    """Get the symbol an identifier refers to in a scope.
 
-  def visit_Attribute(self, node):
-    self.generic_visit(node)
-    node_value_name = self.root_scope.get_name_for_node(node.value)
-    if node_value_name:
-      node_name = node_value_name.lookup_name(node.attr)
-      self.root_scope.set_name_for_node(node, node_name)
-      node_name.add_reference(node)
+    This is the symbol bound to it in the innermost scope enclosing the given
+    one (or that scope itself) which binds it. If no scope binds it, it is bound
+    in the outermost one.
+    """
+    try:
+      key = self._identifier_ids[identifier] << _OWNER_BITS
+    except KeyError:
+      key = self.identifier_id(identifier) << _OWNER_BITS
+    bindings = self._bindings
+    chain = self._scope_chains[scope_id]
+    for enclosing_scope_id in chain:
+      symbol = bindings.get(key | enclosing_scope_id)
+      if symbol is not None:
+        return symbol
+    return self.bind(chain[-1], identifier)
+
+  def find_attribute(self, symbol, identifier):
+    """Get the attribute of a symbol with an identifier, or None."""
+    identifier_id = self._identifier_ids.get(identifier)
+    if identifier_id is None:
+      return None
+    return self._attribute_bindings.get((identifier_id << _OWNER_BITS) | symbol)
+
+  def attribute(self, symbol, identifier):
+    """Get the attribute of a symbol with an identifier, adding it if needed."""
+    identifier_id = self.identifier_id(identifier)
+    key = (identifier_id << _OWNER_BITS) | symbol
+    try:
+      return self._attribute_bindings[key]
+    except KeyError:
+      attribute = self._attribute_bindings[key] = self._new_symbol(
+          identifier_id, -1, symbol)
+      self._referenced[symbol] = 1
+      qualified_name = self._qualified_names[symbol]
+      if qualified_name is not None:
+        self._qualified_names[attribute] = qualified_name + '.' + identifier
+      return attribute
+
+  def define(self, symbol, node, qualified_name=None):
+    """Record a node defining a symbol.
+
+    Only the first definition is kept as such; later ones count as reads.
+
+    Arguments:
+      symbol: (int) Id of the symbol.
+      node: (ast.AST) Node defining it.
+      qualified_name: (string) Fully-qualified name of what the node binds the
+        symbol to, if it is an import; only used for the first definition.
+    """
+    if self._definitions[symbol] is None:
+      self._definitions[symbol] = node
+      if qualified_name is not None:
+        self._qualify(symbol, qualified_name)
+    else:
+      self._read_nodes.append(node)
+      self._read_symbols.append(symbol)
+
+  def add_read(self, symbol, node):
+    """Record a node reading a symbol, and which symbol the node refers to."""
+    self._read_nodes.append(node)
+    self._read_symbols.append(symbol)
+    self._referenced[symbol] = 1
+    self._node_symbols[node] = symbol
+    qualified_name = self._qualified_names[symbol]
+    if qualified_name is not None:
+      try:
+        self._uses[qualified_name].append(node)
+      except KeyError:
+        self._uses[qualified_name] = [node]
+
+  def _qualify(self, symbol, qualified_name):
+    """Give a symbol, and its attributes, a fully-qualified name.
+
+    The symbol may already have been read, and have attributes, if it was used
+    before being imported (e.g. in a function defined before the import); their
+    uses are indexed now.
+    """
+    self._qualified_names[symbol] = qualified_name
+    stack = [symbol] if self._referenced[symbol] else []
+    while stack:
+      symbol = stack.pop()
+      qualified_name = self._qualified_names[symbol]
+      uses = [node for node in self.reads(symbol)
+              if isinstance(node, (ast.Name, ast.Attribute))]
+      if uses:
+        self._uses.setdefault(qualified_name, []).extend(uses)
+      for attribute in self.attributes(symbol):
+        self._qualified_names[attribute] = (
+            qualified_name + '.' + self.identifier(attribute))
+        stack.append(attribute)
+
+  def identifier(self, symbol):
+    return self._identifiers[self._symbol_identifiers[symbol]]
+
+  def parent(self, symbol):
+    """Get the symbol a symbol is an attribute of, or -1 for names."""
+    return self._symbol_parents[symbol]
+
+  def definition(self, symbol):
+    return self._definitions[symbol]
+
+  def qualified_name(self, symbol):
+    """Get the fully-qualified name of a symbol, or None if it has none."""
+    return self._qualified_names[symbol]
+
+  def uses(self, qualified_name):
+    """Get the Name and Attribute nodes reading a fully-qualified name.
+
+    For example, after `import a.b as c`, uses('a.b.d') finds `c.d`.
+    """
+    return list(self._uses.get(qualified_name, ()))
+
+  def reads(self, symbol):
+    """Get a list of the nodes reading a symbol, other than its definition."""
+    order, starts = _group(self, '_read_symbols', len(self._definitions))
+    return [self._read_nodes[read]
+            for read in order[starts[symbol]:starts[symbol + 1]]]
+
+  def attributes(self, symbol):
+    """Get a list of the ids of the attribute symbols of a symbol."""
+    order, starts = _group(self, '_symbol_parents', len(self._definitions))
+    return order[starts[symbol]:starts[symbol + 1]].tolist()
+
+  def scope_symbols(self, scope_id):
+    """Get a list of the ids of the symbols bound in a scope."""
+    order, starts = _group(self, '_symbol_scopes', len(self._scope_chains))
+    return order[starts[scope_id]:starts[scope_id + 1]].tolist()
+
+  def symbol_for_node(self, node):
+    """Get the symbol a Name or Attribute node reads, or None."""
+    return self._node_symbols.get(node)
+
+  def set_symbol_for_node(self, node, symbol):
+    self._node_symbols[node] = symbol
+
+  def name(self, symbol):
+    """Get the Name view of a symbol."""
+    try:
+      return self._views[symbol]
+    except KeyError:
+      view = self._views[symbol] = Name(self, symbol)
+      return view
 
 
 class Scope(object):
 
   def __init__(self, parent_scope):
     self.parent_scope = parent_scope
-    self.names = {}
+    if parent_scope is None:
+      self.symbols = SymbolTable()
+      self.scope_id = self.symbols.new_scope(None)
+    else:
+      self.symbols = parent_scope.symbols
+      self.scope_id = self.symbols.new_scope(parent_scope.scope_id)
+    # Names bound in this scope, by identifier.
+    self.names = _ScopeNames(self.symbols, self.scope_id)
 
   def add_external_reference(self, name, node, packages=True):
     self.parent_scope.add_external_reference(name, node, packages=packages)
 
   def define_name(self, name, node):
-    try:
-      name_obj = self.names[name]
-    except KeyError:
-      name_obj = self.names[name] = Name(name)
-    name_obj.define(node)
-    return name_obj
+    symbol = self.symbols.bind(self.scope_id, name)
+    self.symbols.define(symbol, node)
+    return self.symbols.name(symbol)
 
   def lookup_name(self, name):
-    try:
-      return self.names[name]
-    except KeyError:
-      pass
-    if self.parent_scope is None:
-      name_obj = self.names[name] = Name(name)
-      return name_obj
-    return self.parent_scope.lookup_name(name)
+    return self.symbols.name(self.symbols.lookup(self.scope_id, name))
 
   def get_root_scope(self):
     return self.parent_scope.get_root_scope()
@@ -160,62 +502,343 @@ class RootScope(Scope):
 
   def __init__(self):
     super(RootScope, self).__init__(None)
-    self.external_references = {}
+    # References to external modules and names, by their fully-qualified name.
+    self.external_references = ReferenceTrie()
+    # Structure of the tree, indexed as it is analyzed.
+    self.index = node_index.NodeIndex()
+    # Parents set with set_parent, which take precedence over the index.
     self._parents = {}
-    self._nodes_to_names = {}
 
   def add_external_reference(self, name, node, packages=True):
-    names_to_add = [name]
-    if packages:
-      parts = name.split('.')
-      names_to_add.extend('.'.join(parts[:i]) for i in range(1, len(parts)))
-
-    for n in names_to_add:
-      if n in self.external_references:
-        self.external_references[n].append(node)
-      else:
-        self.external_references[n] = [node]
+    self.external_references.add(name, node, packages=packages)
 
   def get_root_scope(self):
     return self
 
   def parent(self, node):
-    return self._parents[node]
+    if self._parents:
+      try:
+        return self._parents[node]
+      except KeyError:
+        pass
+    return self.index.parent(node)
 
   def set_parent(self, node, parent):
+    """Set the parent of a node, such as one added to the tree after analysis.
+
+    The index only holds the nodes reached by the analysis, in preorder, so
+    parents set here are kept alongside it.
+    """
     self._parents[node] = parent
 
+  def uses(self, qualified_name):
+    """Get the Name and Attribute nodes using an imported name.
+
+    Arguments:
+      qualified_name: (string) Fully-qualified name of an imported module or
+        name, or of an attribute of one; e.g. `a.b.c` for `c` after
+        `from a.b import c`, or for `b.c` after `import a.b as b`.
+    Returns:
+      A list of the nodes, in the order they were analyzed.
+    """
+    return self.symbols.uses(qualified_name)
+
   def get_name_for_node(self, node):
-    return self._nodes_to_names.get(node, None)
+    symbol = self.symbols.symbol_for_node(node)
+    return None if symbol is None else self.symbols.name(symbol)
 
   def set_name_for_node(self, node, name):
-    self._nodes_to_names[node] = name
+    self.symbols.set_symbol_for_node(node, name.symbol)
+
+
+class ReferenceTrie(object):
+  """References to external modules and names, in a trie of dotted names.
+
+  Each reference is stored once, at the trie node of the name it was made with;
+  e.g. `import a.b.c` is stored under a -> b -> c. References can be found by
+  their exact name, by a prefix of their name, or by a pattern of it.
+
+  As in SymbolTable, trie nodes are integer ids, and the references made at
+  each node are grouped from flat arrays only when asked for.
+
+  The trie can also be used as a read-only dict, as RootScope's
+  external_references used to be: it maps each name to the references made to
+  it, including references to modules inside a package, which are references to
+  the package too.
+  """
+
+  def __init__(self):
+    # For each trie node, the last component of its name, its parent, its
+    # children by their component (or None if it has none) and the number of
+    # references its name maps to when the trie is used as a dict. The root,
+    # with id 0, has no name and no parent.
+    self._trie_components = [None]
+    self._trie_parents = array.array('i', [-1])
+    self._trie_children = [None]
+    self._counts = array.array('i', [0])
+    # For each reference, its node, the trie node of the name it was made with
+    # and whether it also refers to the packages its name is in.
+    self._nodes = []
+    self._reference_names = array.array('i')
+    self._packages = array.array('b')
+    # Groupings of the arrays above, made by _group.
+    self._groups = {}
+
+  def add(self, name, node, packages=True):
+    """Add a reference.
+
+    Arguments:
+      name: (string) Fully-qualified name the reference is to.
+      node: (ast.AST) Node making the reference.
+      packages: (bool) Whether the reference is also to each package the name
+        is in; e.g. `import a.b` refers to `a`, but `from a import b` only
+        refers to `a.b` through the alias `b`.
+    """
+    trie_node = 0
+    for part in name.split('.'):
+      children = self._trie_children[trie_node]
+      if children is None:
+        children = self._trie_children[trie_node] = {}
+      child = children.get(part)
+      if child is None:
+        child = children[part] = len(self._counts)
+        self._trie_components.append(part)
+        self._trie_parents.append(trie_node)
+        self._trie_children.append(None)
+        self._counts.append(0)
+      trie_node = child
+      if packages:
+        self._counts[trie_node] += 1
+    if not packages:
+      self._counts[trie_node] += 1
+    self._nodes.append(node)
+    self._reference_names.append(trie_node)
+    self._packages.append(packages)
+
+  def exact(self, name):
+    """Get the nodes of the references made with exactly a name, in order."""
+    trie_node = self._find(name)
+    if trie_node is None:
+      return []
+    return [self._nodes[reference]
+            for reference in self._references([trie_node])]
+
+  def with_prefix(self, name):
+    """Get the nodes of the references to a name or to any name inside it.
+
+    For example, with_prefix('a.b') finds references to `a.b`, `a.b.c` and
+    `a.b.c.d`, but not to `a` or `a.bc`.
+    """
+    trie_node = self._find(name)
+    if trie_node is None:
+      return []
+    return [self._nodes[reference]
+            for reference in self._references(self._subtrie(trie_node))]
+
+  def matching(self, pattern):
+    """Get the nodes of the references made with a name matching a pattern.
+
+    Arguments:
+      pattern: (string) Dotted name, each component of which may be a shell
+        style wildcard, as understood by fnmatch; e.g. `a.*.c` matches `a.b.c`
+        but not `a.b.b.c`, and `a.b*` matches `a.b` and `a.bc`.
+    Returns:
+      A list of the nodes, in the order the references were added.
+    """
+    trie_nodes = [0]
+    for part in pattern.split('.'):
+      wildcard = any(c in part for c in '*?[')
+      matches = []
+      for trie_node in trie_nodes:
+        children = self._trie_children[trie_node]
+        if not children:
+          continue
+        if wildcard:
+          matches.extend(child for component, child in six.iteritems(children)
+                         if fnmatch.fnmatchcase(component, part))
+        elif part in children:
+          matches.append(children[part])
+      trie_nodes = matches
+    return [self._nodes[reference]
+            for reference in self._references(trie_nodes)]
+
+  def _find(self, name):
+    """Get the trie node of a name, or None."""
+    trie_node = 0
+    for part in name.split('.'):
+      children = self._trie_children[trie_node]
+      if not children or part not in children:
+        return None
+      trie_node = children[part]
+    return trie_node
+
+  def _name(self, trie_node):
+    parts = []
+    while trie_node > 0:
+      parts.append(self._trie_components[trie_node])
+      trie_node = self._trie_parents[trie_node]
+    return '.'.join(reversed(parts))
+
+  def _subtrie(self, trie_node):
+    """Get a list of a trie node and all of its descendants."""
+    result = [trie_node]
+    i = 0
+    while i < len(result):
+      result.extend(six.itervalues(self._trie_children[result[i]] or {}))
+      i += 1
+    return result
+
+  def _references(self, trie_nodes):
+    """Get a sorted list of the ids of the references made at trie nodes."""
+    order, starts = _group(self, '_reference_names', len(self._counts))
+    result = []
+    for trie_node in trie_nodes:
+      result.extend(order[starts[trie_node]:starts[trie_node + 1]])
+    result.sort()
+    return result
+
+  def __getitem__(self, name):
+    trie_node = self._find(name)
+    if trie_node is None or not self._counts[trie_node]:
+      raise KeyError(name)
+    # References below this name only count if they refer to their packages.
+    subtrie = self._subtrie(trie_node)
+    references = self._references(subtrie[:1]) + [
+        reference for reference in self._references(subtrie[1:])
+        if self._packages[reference]]
+    return [self._nodes[reference] for reference in sorted(references)]
+
+  def __contains__(self, name):
+    trie_node = self._find(name)
+    return trie_node is not None and self._counts[trie_node] > 0
+
+  def __iter__(self):
+    return iter(self.keys())
+
+  def __len__(self):
+    return sum(1 for count in self._counts if count)
+
+  def get(self, name, default=None):
+    return self[name] if name in self else default
+
+  def keys(self):
+    return [self._name(trie_node) for trie_node in range(1, len(self._counts))
+            if self._counts[trie_node]]
+
+  def values(self):
+    return [self[name] for name in self.keys()]
+
+  def items(self):
+    return [(name, self[name]) for name in self.keys()]
 
 
 # Should probably also have a scope?
 class Name(object):
+  """A name or attribute, as a view of its symbol in a SymbolTable."""
+
+  __slots__ = ('_table', 'symbol')
+
+  def __init__(self, table, symbol):
+    self._table = table
+    self.symbol = symbol
+
+  @property
+  def id(self):
+    return self._table.identifier(self.symbol)
 
-  def __init__(self, id):
-    self.id = id
-    self.definition = None
-    self.reads = []
-    self.attrs = {}
+  @property
+  def definition(self):
+    return self._table.definition(self.symbol)
+
+  @property
+  def qualified_name(self):
+    return self._table.qualified_name(self.symbol)
+
+  @property
+  def reads(self):
+    return self._table.reads(self.symbol)
+
+  @property
+  def attrs(self):
+    return _AttributeNames(self._table, self.symbol)
 
   def add_reference(self, node):
-    self.reads.append(node)
+    self._table.add_read(self.symbol, node)
 
   def define(self, node):
-    if self.definition:
-      self.reads.append(node)
-    else:
-      self.definition = node
+    self._table.define(self.symbol, node)
 
   def lookup_name(self, name):
-    try:
-      return self.attrs[name]
-    except KeyError:
-      name_obj = self.attrs[name] = Name(name)
-      return name_obj
+    return self._table.name(self._table.attribute(self.symbol, name))
+
+
+class _NameMap(object):
+  """Read-only mapping from identifiers to the Name views of some symbols."""
+
+  __slots__ = ('_table', '_owner')
+
+  def __init__(self, table, owner):
+    self._table = table
+    self._owner = owner
+
+  def _symbols(self):
+    raise NotImplementedError()
+
+  def _find(self, identifier):
+    raise NotImplementedError()
+
+  def __getitem__(self, identifier):
+    symbol = self._find(identifier)
+    if symbol is None:
+      raise KeyError(identifier)
+    return self._table.name(symbol)
+
+  def __contains__(self, identifier):
+    return self._find(identifier) is not None
+
+  def __iter__(self):
+    return iter(self.keys())
+
+  def __len__(self):
+    return len(self._symbols())
+
+  def get(self, identifier, default=None):
+    symbol = self._find(identifier)
+    return default if symbol is None else self._table.name(symbol)
+
+  def keys(self):
+    return [self._table.identifier(symbol) for symbol in self._symbols()]
+
+  def values(self):
+    return [self._table.name(symbol) for symbol in self._symbols()]
+
+  def items(self):
+    return [(self._table.identifier(symbol), self._table.name(symbol))
+            for symbol in self._symbols()]
+
+
+class _ScopeNames(_NameMap):
+  """Names bound in a scope."""
+
+  __slots__ = ()
+
+  def _symbols(self):
+    return self._table.scope_symbols(self._owner)
+
+  def _find(self, identifier):
+    return self._table.find(self._owner, identifier)
+
+
+class _AttributeNames(_NameMap):
+  """Attributes of a name."""
+
+  __slots__ = ()
+
+  def _symbols(self):
+    return self._table.attributes(self._owner)
+
+  def _find(self, identifier):
+    return self._table.find_attribute(self._owner, identifier)
 
 
 def analyze(tree):
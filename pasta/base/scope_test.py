@@ -22,6 +22,7 @@ import ast
 import textwrap
 import unittest
 
+import pasta
 from pasta.base import ast_utils
 from pasta.base import scope
 from pasta.base import test_utils
@@ -336,10 +337,262 @@ class ScopeTest(test_utils.TestCase):
     self.assertItemsEqual(s.names['aaa'].attrs['bbb'].attrs['ccc'].reads,
                           [call3])
 
+  def test_long_attribute_chain(self):
+    source = 'import aaa\naaa' + '.bbb' * 2500 + '\n'
+    tree = ast.parse(source)
+
+    s = scope.analyze(tree)
+
+    name = s.names['aaa']
+    for _ in range(2500):
+      self.assertEqual(1, len(name.reads))
+      name = name.attrs['bbb']
+    self.assertEqual(tree.body[1].value, name.reads[0])
+
+  def test_analyze_while_parsing(self):
+    source = textwrap.dedent("""\
+        import aaa
+        from ccc import ddd as eee
+        @aaa.decorator
+        def foo(aaa=aaa.bbb, fff=eee):
+          return aaa + fff
+        class Bar(aaa.Base):
+          ggg = eee.hhh
+          def baz(self):
+            return ggg
+        """)
+    tree, s = pasta.parse(source, analyze=True)
+    expected = scope.analyze(pasta.parse(source))
+
+    def describe(sc):
+      return {name: (describe_node(name_obj.definition),
+                     sorted(describe_node(n) for n in name_obj.reads))
+              for name, name_obj in sc.names.items()}
+    def describe_node(node):
+      return (type(node).__name__, getattr(node, 'lineno', None),
+              getattr(node, 'col_offset', None))
+
+    self.assertEqual(describe(expected), describe(s))
+    self.assertEqual(
+        {k: sorted(describe_node(n) for n in v)
+         for k, v in expected.external_references.items()},
+        {k: sorted(describe_node(n) for n in v)
+         for k, v in s.external_references.items()})
+    func = tree.body[2]
+    self.assertIs(tree, s.parent(func))
+    self.assertIs(func.args, s.parent(func.args.defaults[0]))
+
+    added = ast.Pass()
+    s.set_parent(added, func)
+    self.assertIs(func, s.parent(added))
+    s.set_parent(func, tree.body[0])
+    self.assertIs(tree.body[0], s.parent(func))
+    self.assertItemsEqual(s.names['aaa'].reads,
+                          [func.decorator_list[0].value,
+                           func.args.defaults[0].value,
+                           tree.body[3].bases[0].value])
+
+  def test_uses_of_qualified_names(self):
+    source = textwrap.dedent("""\
+        import aaa.bbb
+        import ccc.ddd as eee
+        from fff.ggg import hhh as iii
+        aaa.bbb.x
+        eee.y
+        iii
+        iii.z
+        def foo(eee):
+          return eee.y, aaa.bbb.x
+        """)
+    tree = ast.parse(source)
+    nodes = tree.body
+    ret = nodes[7].body[0].value
+
+    s = scope.analyze(tree)
+
+    self.assertEqual([nodes[3].value, ret.elts[1]], s.uses('aaa.bbb.x'))
+    self.assertEqual([nodes[3].value.value, ret.elts[1].value],
+                     s.uses('aaa.bbb'))
+    self.assertEqual([nodes[3].value.value.value, ret.elts[1].value.value],
+                     s.uses('aaa'))
+    # The argument eee masks the import
+    self.assertEqual([nodes[4].value], s.uses('ccc.ddd.y'))
+    self.assertEqual([nodes[4].value.value], s.uses('ccc.ddd'))
+    self.assertEqual([nodes[5].value, nodes[6].value.value],
+                     s.uses('fff.ggg.hhh'))
+    self.assertEqual([nodes[6].value], s.uses('fff.ggg.hhh.z'))
+    self.assertEqual([], s.uses('eee.y'))
+    self.assertEqual([], s.uses('iii'))
+
+    self.assertEqual('ccc.ddd', s.names['eee'].qualified_name)
+    self.assertEqual('fff.ggg.hhh.z', s.names['iii'].attrs['z'].qualified_name)
+    self.assertIsNone(s.names['foo'].qualified_name)
+
+  def test_uses_before_import(self):
+    source = textwrap.dedent("""\
+        def foo():
+          return aaa.bbb.ccc
+        import aaa.bbb
+        """)
+    tree = ast.parse(source)
+    ccc = tree.body[0].body[0].value
+
+    s = scope.analyze(tree)
+
+    self.assertEqual([ccc], s.uses('aaa.bbb.ccc'))
+    self.assertEqual([ccc.value], s.uses('aaa.bbb'))
+    self.assertEqual([ccc.value.value], s.uses('aaa'))
+
+
+class SymbolTableTest(test_utils.TestCase):
+
+  def test_lookup_through_enclosing_scopes(self):
+    table = scope.SymbolTable()
+    outer = table.new_scope(None)
+    inner = table.new_scope(outer)
+    aaa = table.bind(outer, 'aaa')
+
+    self.assertEqual(aaa, table.lookup(inner, 'aaa'))
+    self.assertIsNone(table.find(inner, 'aaa'))
+    local_aaa = table.bind(inner, 'aaa')
+    self.assertNotEqual(aaa, local_aaa)
+    self.assertEqual(local_aaa, table.lookup(inner, 'aaa'))
+
+    # Unbound names are bound in the outermost scope
+    bbb = table.lookup(inner, 'bbb')
+    self.assertEqual(bbb, table.find(outer, 'bbb'))
+    self.assertEqual([aaa, bbb], table.scope_symbols(outer))
+    self.assertEqual([local_aaa], table.scope_symbols(inner))
+
+  def test_reads_and_attributes(self):
+    table = scope.SymbolTable()
+    root = table.new_scope(None)
+    aaa = table.bind(root, 'aaa')
+    bbb = table.attribute(aaa, 'bbb')
+    nodes = [ast.Name(id='aaa'), ast.Name(id='aaa'), ast.Name(id='aaa')]
+
+    table.define(aaa, nodes[0])
+    table.add_read(aaa, nodes[1])
+    self.assertEqual([nodes[1]], table.reads(aaa))
+    # A second definition counts as a read
+    table.define(aaa, nodes[2])
+    self.assertIs(nodes[0], table.definition(aaa))
+    self.assertEqual(nodes[1:], table.reads(aaa))
+    self.assertEqual([], table.reads(bbb))
+    self.assertEqual([bbb], table.attributes(aaa))
+    self.assertEqual(aaa, table.parent(bbb))
+    self.assertEqual(aaa, table.symbol_for_node(nodes[1]))
+    self.assertIsNone(table.symbol_for_node(nodes[2]))
+
+  def test_name_views(self):
+    source = textwrap.dedent("""\
+        import aaa.bbb
+        def foo():
+          return aaa.bbb.ccc
+        """)
+    tree = ast.parse(source)
+    s = scope.analyze(tree)
+
+    aaa = s.names['aaa']
+    read = tree.body[1].body[0].value.value.value
+    self.assertIs(aaa, s.lookup_name('aaa'))
+    self.assertIs(aaa, s.get_name_for_node(read))
+    self.assertEqual('aaa', aaa.id)
+    self.assertIn('bbb', aaa.attrs)
+    self.assertNotIn('ccc', aaa.attrs)
+    self.assertEqual(['bbb'], list(aaa.attrs))
+    self.assertEqual(1, len(aaa.attrs['bbb'].attrs))
+    self.assertIsNone(s.names.get('bbb'))
+    with self.assertRaises(KeyError):
+      s.names['bbb']
+
+    # Changes through a view are seen by the analysis
+    node = ast.Name(id='aaa')
+    aaa.attrs['bbb'].lookup_name('ddd').add_reference(node)
+    self.assertEqual([node], aaa.attrs['bbb'].attrs['ddd'].reads)
+
+
+class ReferenceTrieTest(test_utils.TestCase):
+
+  def setUp(self):
+    super(ReferenceTrieTest, self).setUp()
+    source = textwrap.dedent("""\
+        import aaa.bbb.ccc
+        import aaa.bbbb
+        from aaa.ddd import eee
+        from fff import ggg as hhh
+        import aaa.bbb
+        """)
+    self.tree = ast.parse(source)
+    self.trie = scope.analyze(self.tree).external_references
+    nodes = self.tree.body
+    self.aaa_bbb_ccc = nodes[0].names[0]
+    self.aaa_bbbb = nodes[1].names[0]
+    self.aaa_ddd = nodes[2]
+    self.aaa_ddd_eee = nodes[2].names[0]
+    self.fff = nodes[3]
+    self.fff_ggg = nodes[3].names[0]
+    self.aaa_bbb = nodes[4].names[0]
+
+  def test_exact(self):
+    self.assertEqual([self.aaa_bbb_ccc], self.trie.exact('aaa.bbb.ccc'))
+    self.assertEqual([self.aaa_bbb], self.trie.exact('aaa.bbb'))
+    self.assertEqual([self.fff_ggg], self.trie.exact('fff.ggg'))
+    self.assertEqual([], self.trie.exact('aaa'))
+    self.assertEqual([], self.trie.exact('hhh'))
+
+  def test_with_prefix(self):
+    self.assertEqual([self.aaa_bbb_ccc, self.aaa_bbb],
+                     self.trie.with_prefix('aaa.bbb'))
+    self.assertEqual([self.aaa_bbb_ccc, self.aaa_bbbb, self.aaa_ddd,
+                      self.aaa_ddd_eee, self.aaa_bbb],
+                     self.trie.with_prefix('aaa'))
+    self.assertEqual([], self.trie.with_prefix('aaa.b'))
+
+  def test_matching(self):
+    self.assertEqual([self.aaa_bbbb, self.aaa_ddd, self.aaa_bbb],
+                     self.trie.matching('aaa.*'))
+    self.assertEqual([self.aaa_bbbb, self.aaa_bbb],
+                     self.trie.matching('aaa.bbb*'))
+    self.assertEqual([self.aaa_bbb_ccc, self.aaa_ddd_eee],
+                     self.trie.matching('aaa.*.*'))
+    self.assertEqual([self.aaa_ddd, self.fff_ggg],
+                     self.trie.matching('*.[dg]*'))
+    self.assertEqual([], self.trie.matching('*.*.*.*'))
+
+  def test_mapping(self):
+    # References to modules are references to the packages they are in too,
+    # but references to names imported from a module are not.
+    self.assertEqual([self.aaa_bbb_ccc, self.aaa_bbbb, self.aaa_ddd,
+                      self.aaa_bbb],
+                     self.trie['aaa'])
+    self.assertEqual([self.aaa_bbb_ccc, self.aaa_bbb], self.trie['aaa.bbb'])
+    self.assertEqual([self.fff], self.trie['fff'])
+    self.assertItemsEqual(
+        ['aaa', 'aaa.bbb', 'aaa.bbb.ccc', 'aaa.bbbb', 'aaa.ddd',
+         'aaa.ddd.eee', 'fff', 'fff.ggg'],
+        self.trie.keys())
+    self.assertEqual(8, len(self.trie))
+    self.assertIn('fff.ggg', self.trie)
+    self.assertNotIn('aaa.b', self.trie)
+    self.assertIsNone(self.trie.get('hhh'))
+    with self.assertRaises(KeyError):
+      self.trie['aaa.b']
+
+  def test_names_from_module_only(self):
+    trie = scope.ReferenceTrie()
+    node = ast.alias(name='ccc', asname=None)
+    trie.add('aaa.bbb.ccc', node, packages=False)
+    self.assertEqual(['aaa.bbb.ccc'], trie.keys())
+    self.assertNotIn('aaa.bbb', trie)
+    self.assertEqual([node], trie.with_prefix('aaa'))
+
 
 def suite():
   result = unittest.TestSuite()
   result.addTests(unittest.makeSuite(ScopeTest))
+  result.addTests(unittest.makeSuite(SymbolTableTest))
+  result.addTests(unittest.makeSuite(ReferenceTrieTest))
   return result
 
 
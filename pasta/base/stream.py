@@ -0,0 +1,124 @@
+# coding=utf-8
+"""Parse, transform and print a module one top-level statement at a time.
+
+Only one top-level statement is held at a time, as source, tokens and an
+annotated tree, so memory use is bounded by the size of the largest statement
+rather than that of the module.
+"""
+# Copyright 2017 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import tokenize
+
+from pasta.base import chunks
+from pasta.base import codegen
+
+# Keywords which continue a compound statement rather than starting a new one.
+_CONTINUATIONS = frozenset(('elif', 'else', 'except', 'finally'))
+
+# Tokens which are not part of any statement.
+_NON_CODE = frozenset((tokenize.COMMENT, tokenize.NL, tokenize.INDENT,
+                       tokenize.DEDENT))
+
+
+def split_statements(lines):
+  """Split lines of source into top-level statements, reading them lazily.
+
+  Statements which share a line, like `a = 1; b = 2`, stay together, as do
+  decorators and the statements they decorate. Comments and blank lines
+  between two statements go with the second one.
+
+  Arguments:
+    lines: (iterable of string) Lines of python source, including line endings;
+      e.g. an open file.
+  Yields:
+    (lineno, src) tuples, where src is the source of one or more complete
+    statements and lineno is the line it starts at. Joined, they give the
+    whole source.
+  """
+  lines = iter(lines)
+  buffered = []
+  # Line number of the first buffered line.
+  start = 1
+
+  def readline():
+    line = next(lines, '')
+    if line:
+      buffered.append(line)
+    return line
+
+  # Line after the end of the last complete logical line.
+  end = None
+  depth = 0
+  # Whether the last top-level logical line was a decorator.
+  decorated = False
+  new_line = True
+  for token in tokenize.generate_tokens(readline):
+    kind, value, (row, _), _, _ = token
+    if kind == tokenize.INDENT:
+      depth += 1
+    elif kind == tokenize.DEDENT:
+      depth -= 1
+    if kind in _NON_CODE:
+      continue
+    if kind == tokenize.ENDMARKER:
+      break
+    if kind == tokenize.NEWLINE:
+      new_line = True
+      end = row + 1
+      continue
+    if new_line and depth == 0:
+      if end is not None and not decorated and not (
+          kind == tokenize.NAME and value in _CONTINUATIONS):
+        yield start, ''.join(buffered[:end - start])
+        del buffered[:end - start]
+        start = end
+      decorated = value == '@'
+    new_line = False
+
+  if buffered:
+    yield start, ''.join(buffered)
+
+
+def transform(lines, out, transforms=()):
+  """Parse, transform and print a module one top-level statement at a time.
+
+  Each top-level statement (or group of statements sharing a line) is parsed
+  and annotated on its own, as an ast.Module holding just that statement and
+  the comments before it. Each transform is called with that module, and can
+  change its statements in place; they cannot see the rest of the module. The
+  module is then printed, and dropped before the next statement is read.
+
+  Arguments:
+    lines: (iterable of string) Lines of python source, including line endings;
+      e.g. an open file.
+    out: (file-like object) Object to write the transformed source to; only its
+      `write` method is used.
+    transforms: (list of callable) Functions to call with each statement's
+      module, in order.
+  """
+  printer = codegen.Printer(out)
+  flags = 0
+  for lineno, src in split_statements(lines):
+    tree = chunks.annotate_source(src, lineno, flags=flags)
+    # Imports from __future__ change how the rest of the module is parsed.
+    flags |= chunks.future_flags(tree)
+    for transform_function in transforms:
+      transform_function(tree)
+    printer.visit(tree)
+  printer.flush()
@@ -0,0 +1,118 @@
+# coding=utf-8
+"""Tests for stream."""
+# Copyright 2017 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import ast
+import unittest
+
+import pasta
+from pasta.base import chunks
+from pasta.base import stream
+from pasta.base import test_utils
+
+_SRC = '''\
+"""Docstring."""
+from __future__ import print_function
+
+# Comment
+@decorator
+def f(a):
+  if a:
+    return 1
+  # Inner comment
+  else:
+    return 2
+try:
+  x = 1
+except E:
+  pass
+finally:
+  y = [1,
+2]
+s = """
+text
+"""
+
+# Trailing comment
+'''
+
+
+class StreamTest(test_utils.TestCase):
+
+  def test_split_statements(self):
+    lines = iter(_SRC.splitlines(True))
+    starts = []
+    for lineno, src in stream.split_statements(lines):
+      starts.append((lineno, src.splitlines()[0]))
+    self.assertEqual([(1, '"""Docstring."""'),
+                      (2, 'from __future__ import print_function'),
+                      (3, ''),
+                      (12, 'try:'),
+                      (19, 's = """')], starts)
+
+  def test_split_reads_lazily(self):
+    read = []
+
+    def lines():
+      for line in _SRC.splitlines(True):
+        read.append(line)
+        yield line
+
+    statements = stream.split_statements(lines())
+    next(statements)
+    next(statements)
+    # Reading stops at the first token of the next statement.
+    self.assertEqual(_SRC.splitlines(True)[:5], read)
+
+  def test_round_trip(self):
+    out = test_utils.RecordingFile()
+    pasta.stream(iter(_SRC.splitlines(True)), out)
+    self.assertMultiLineEqual(_SRC, ''.join(out.writes))
+
+  def test_transform(self):
+    seen = []
+
+    def rename(tree):
+      seen.append([chunks.statement_start(stmt) for stmt in tree.body])
+      for node in ast.walk(tree):
+        if isinstance(node, ast.Name) and node.id == 'x':
+          node.id = 'z'
+
+    out = test_utils.RecordingFile()
+    stream.transform(_SRC.splitlines(True), out, [rename])
+    self.assertMultiLineEqual(_SRC.replace('  x = 1', '  z = 1'),
+                              ''.join(out.writes))
+    self.assertEqual([[1], [2], [5], [12], [19]], seen)
+
+  def test_future_imports(self):
+    # Without the __future__ import, print is a keyword in python 2.
+    src = 'from __future__ import print_function\nprint_ = print\n'
+    out = test_utils.RecordingFile()
+    stream.transform(src.splitlines(True), out)
+    self.assertMultiLineEqual(src, ''.join(out.writes))
+
+
+def suite():
+  result = unittest.TestSuite()
+  result.addTests(unittest.makeSuite(StreamTest))
+  return result
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -37,6 +37,16 @@ if not hasattr(TestCase, 'assertItemsEqual'):
   setattr(TestCase, 'assertItemsEqual', TestCase.assertCountEqual)
 
 
+class RecordingFile(object):
+  """File-like object which records each string written to it."""
+
+  def __init__(self):
+    self.writes = []
+
+  def write(self, value):
+    self.writes.append(value)
+
+
 def requires_features(*features):
   return unittest.skipIf(
       any(not supports_feature(feature) for feature in features),
@@ -267,18 +267,22 @@ def _scope_helper(node):
   Returns:
     A closure of nodes which that scope might apply to.
   """
-  if isinstance(node, ast.Attribute):
-    return (node,) + _scope_helper(node.value)
-  if isinstance(node, ast.Assign):
-    return (node,) + _scope_helper(node.targets[0])
-  if isinstance(node, ast.AugAssign):
-    return (node,) + _scope_helper(node.target)
-  if isinstance(node, ast.Expr):
-    return (node,) + _scope_helper(node.value)
-  if isinstance(node, ast.Compare):
-    return (node,) + _scope_helper(node.left)
-  if isinstance(node, ast.BoolOp):
-    return (node,) + _scope_helper(node.values[0])
-  if isinstance(node, ast.BinOp):
-    return (node,) + _scope_helper(node.left)
-  return (node,)
+  result = [node]
+  while True:
+    if isinstance(node, ast.Attribute):
+      node = node.value
+    elif isinstance(node, ast.Assign):
+      node = node.targets[0]
+    elif isinstance(node, ast.AugAssign):
+      node = node.target
+    elif isinstance(node, ast.Expr):
+      node = node.value
+    elif isinstance(node, ast.Compare):
+      node = node.left
+    elif isinstance(node, ast.BoolOp):
+      node = node.values[0]
+    elif isinstance(node, ast.BinOp):
+      node = node.left
+    else:
+      return tuple(result)
+    result.append(node)
@@ -0,0 +1,412 @@
+# coding=utf-8
+"""Hash syntax trees structurally and find the differences between them.
+
+Each node is hashed from its type, its non-node fields and the hashes of its
+children, so that two subtrees have the same hash exactly when they have the
+same structure (barring hash collisions, which are ruled out by comparing the
+subtrees when their hashes match). Hashes are cached per node, so after a change
+only the changed nodes and their ancestors need to be hashed again. They are
+built from python's hash(), which is salted per process for strings, so they
+must not be stored or compared across processes.
+
+Diffs match the nodes of an old tree to those of a new tree, starting with
+identical subtrees found by their hashes, then nodes whose children were
+matched, then the remaining children of matched nodes by their position.
+"""
+# Copyright 2017 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import ast
+import bisect
+import collections
+
+from pasta.base import formatting as fmt
+from pasta.base import node_index
+
+# Smallest subtree which is matched to an identical subtree elsewhere in the
+# tree, rather than only to one in the same place. Smaller subtrees (such as a
+# single name) have too many identical copies for a match to be meaningful.
+MIN_MOVE_SIZE = 2
+
+
+def _scalar(value):
+  # Include the type, so that e.g. 1, 1.0 and True are told apart.
+  return value.__class__, value
+
+
+class TreeHasher(object):
+  """Computes and caches structural hashes of the subtrees of syntax trees.
+
+  Cached hashes are not updated when a tree is changed; after changing the
+  fields of a node (including replacing any of its children), call invalidate
+  with that node.
+  """
+
+  def __init__(self, formatting=False):
+    """Create a hasher.
+
+    Arguments:
+      formatting: (bool) Whether to include the formatting of nodes in their
+        hashes, so that subtrees only hash the same if they would print the
+        same.
+    """
+    self.formatting = formatting
+    self._hashes = {}
+    self._parents = {}
+
+  def hash(self, tree):
+    """Get the hash of a subtree, computing any hashes not already cached."""
+    hashes = self._hashes
+    parents = self._parents
+    if tree in hashes:
+      return hashes[tree]
+    # Find the nodes to hash in preorder, so that in reverse every node comes
+    # after its children.
+    order = []
+    stack = [tree]
+    while stack:
+      node = stack.pop()
+      values = [getattr(node, name, None) for name in node._fields]
+      order.append((node, values))
+      for value in values:
+        if isinstance(value, list):
+          for v in value:
+            if isinstance(v, ast.AST):
+              parents[v] = node
+              if v not in hashes:
+                stack.append(v)
+        elif isinstance(value, ast.AST):
+          if not value._fields:
+            # Shared nodes such as ast.Load have no parent of their own.
+            if value not in hashes:
+              hashes[value] = hash((value.__class__,))
+          else:
+            parents[value] = node
+            if value not in hashes:
+              stack.append(value)
+
+    formatting = self.formatting
+    for node, values in reversed(order):
+      parts = [node.__class__]
+      for value in values:
+        if isinstance(value, ast.AST):
+          parts.append(hashes[value])
+        elif isinstance(value, list):
+          parts.append(tuple(hashes[v] if isinstance(v, ast.AST)
+                             else _scalar(v) for v in value))
+        else:
+          parts.append(_scalar(value))
+      if formatting:
+        parts.append(_formatting(node))
+      hashes[node] = hash(tuple(parts))
+    return hashes[tree]
+
+  def label(self, node):
+    """Get a hash of a node itself, ignoring its children."""
+    return hash(_label(node, self.formatting))
+
+  def invalidate(self, node):
+    """Drop the cached hashes of a changed node and all of its ancestors."""
+    while node is not None:
+      self._hashes.pop(node, None)
+      node = self._parents.get(node)
+
+
+def _label(node, formatting):
+  """Get the fields of a node itself (and its formatting) as a tuple."""
+  parts = [node.__class__]
+  for _, value in ast.iter_fields(node):
+    if isinstance(value, list):
+      parts.append(tuple(_scalar(v) for v in value
+                         if not isinstance(v, ast.AST)))
+    elif not isinstance(value, ast.AST):
+      parts.append(_scalar(value))
+  if formatting:
+    parts.append(_formatting(node))
+  return tuple(parts)
+
+
+def _formatting(node):
+  if not hasattr(node, 'a'):
+    return ()
+  # Spans only say where a node came from, not how it prints.
+  return tuple(sorted(item for item in node.a.items()
+                      if item[0] != fmt.SPAN))
+
+
+def _same(a, b, formatting):
+  """Compare two subtrees field by field."""
+  stack = [(a, b)]
+  while stack:
+    x, y = stack.pop()
+    if x.__class__ is not y.__class__:
+      return False
+    if formatting and _formatting(x) != _formatting(y):
+      return False
+    for name in x._fields:
+      u = getattr(x, name, None)
+      v = getattr(y, name, None)
+      if isinstance(u, list):
+        if not isinstance(v, list) or len(u) != len(v):
+          return False
+        pairs = zip(u, v)
+      else:
+        pairs = ((u, v),)
+      for p, q in pairs:
+        if isinstance(p, ast.AST) and isinstance(q, ast.AST):
+          stack.append((p, q))
+        elif (isinstance(p, ast.AST) or isinstance(q, ast.AST) or
+              _scalar(p) != _scalar(q)):
+          return False
+  return True
+
+
+def equal(a, b, formatting=False):
+  """Whether two syntax trees have the same structure.
+
+  Arguments:
+    a: (ast.AST) Syntax tree to compare.
+    b: (ast.AST) Syntax tree to compare.
+    formatting: (bool) Whether the trees must also have the same formatting.
+  """
+  hasher = TreeHasher(formatting)
+  return hasher.hash(a) == hasher.hash(b) and _same(a, b, formatting)
+
+
+class TreeDiff(object):
+  """Differences between an old and a new syntax tree.
+
+  Attributes:
+    inserted: (list of ast.AST) Nodes of the new tree with no match in the old
+      tree, in preorder.
+    deleted: (list of ast.AST) Nodes of the old tree with no match in the new
+      tree, in preorder.
+    moved: (list of (ast.AST, ast.AST)) Matched pairs of old and new nodes
+      which are in a different place: under a node not matched to their old
+      parent, in a different field of it, or out of order with their siblings.
+    updated: (list of (ast.AST, ast.AST)) Matched pairs of old and new nodes
+      whose own fields (or formatting, if compared) differ.
+  """
+
+  def __init__(self, inserted, deleted, moved, updated):
+    self.inserted = inserted
+    self.deleted = deleted
+    self.moved = moved
+    self.updated = updated
+
+  def __bool__(self):
+    return bool(self.inserted or self.deleted or self.moved or self.updated)
+
+  __nonzero__ = __bool__
+
+
+class _Tree(object):
+  """Index of one side of a diff."""
+
+  def __init__(self, tree, hasher):
+    index = node_index.NodeIndex(tree)
+    self.index = index
+    self.nodes = [index.node(i) for i in range(len(index))]
+    self.hashes = [hasher.hash(node) for node in self.nodes]
+    self.parents = [index.parent_id(i) for i in range(len(index))]
+    self.ends = [index.subtree_end(i) for i in range(len(index))]
+    # Field and list index of each node in its parent, found when needed.
+    self._places = [None] * len(self.nodes)
+
+  def place(self, node_id):
+    """Get the field of its parent a node is in, and its index in the field."""
+    if self._places[node_id] is None and self.parents[node_id] >= 0:
+      parent = self.nodes[self.parents[node_id]]
+      for name, value in ast.iter_fields(parent):
+        if isinstance(value, list):
+          for i, child in enumerate(value):
+            if isinstance(child, ast.AST) and child in self.index:
+              self._places[self.index.node_id(child)] = (name, i)
+        elif isinstance(value, ast.AST) and value in self.index:
+          self._places[self.index.node_id(value)] = (name, None)
+    return self._places[node_id] or (None, None)
+
+  def children(self, node_id):
+    """Get the ids of a node's children, in order."""
+    result = []
+    i = node_id + 1
+    while i < self.ends[node_id]:
+      result.append(i)
+      i = self.ends[i]
+    return result
+
+
+def diff(old, new, formatting=False):
+  """Find the differences between two syntax trees.
+
+  Arguments:
+    old: (ast.AST) Syntax tree before a change.
+    new: (ast.AST) Syntax tree after the change.
+    formatting: (bool) Whether to compare formatting as well as structure, so
+      that nodes whose formatting changed are reported as updated.
+  Returns:
+    A TreeDiff.
+  """
+  hasher = TreeHasher(formatting)
+  a = _Tree(old, hasher)
+  b = _Tree(new, hasher)
+  # Ids of the matched node in the other tree, or -1.
+  a_match = [-1] * len(a.nodes)
+  b_match = [-1] * len(b.nodes)
+  # Whether each new node is in a subtree matched to an identical one, and so
+  # is unchanged apart from possibly the place of the subtree's root.
+  identical = [False] * len(b.nodes)
+
+  def match(i, j):
+    a_match[i] = j
+    b_match[j] = i
+
+  # Match identical subtrees, largest first. Candidates are kept in reverse
+  # preorder and matched ones are dropped lazily, which keeps this linear.
+  by_hash = collections.defaultdict(list)
+  by_place = collections.defaultdict(list)
+  for i in range(len(a.nodes) - 1, -1, -1):
+    by_hash[a.hashes[i]].append(i)
+    by_place[a.hashes[i], a.parents[i]].append(i)
+
+  def candidate(candidates):
+    while candidates and a_match[candidates[-1]] >= 0:
+      candidates.pop()
+    return candidates[-1] if candidates else -1
+
+  j = 0
+  while j < len(b.nodes):
+    parent = b.parents[j]
+    i = -1
+    if parent >= 0 and b_match[parent] >= 0:
+      i = candidate(by_place.get((b.hashes[j], b_match[parent]), []))
+    if i < 0 and b.ends[j] - j >= MIN_MOVE_SIZE:
+      i = candidate(by_hash.get(b.hashes[j], []))
+    if i >= 0 and not _same(a.nodes[i], b.nodes[j], formatting):
+      # The hashes collided.
+      i = -1
+    if i < 0:
+      j += 1
+      continue
+    for offset in range(b.ends[j] - j):
+      match(i + offset, j + offset)
+      identical[j + offset] = True
+    j = b.ends[j]
+
+  # Match the nodes whose children were mostly matched to the children of the
+  # same node, children first.
+  for j in range(len(b.nodes) - 1, -1, -1):
+    if b_match[j] >= 0:
+      continue
+    votes = collections.Counter(
+        a.parents[b_match[child]] for child in b.children(j)
+        if b_match[child] >= 0)
+    for i, _ in votes.most_common():
+      if (i >= 0 and a_match[i] < 0 and
+          a.nodes[i].__class__ is b.nodes[j].__class__):
+        match(i, j)
+        break
+  if (a.nodes and b.nodes and a_match[0] < 0 and b_match[0] < 0 and
+      a.nodes[0].__class__ is b.nodes[0].__class__):
+    match(0, 0)
+
+  # Match the remaining children of matched nodes by their place.
+  for j in range(len(b.nodes)):
+    i = b_match[j]
+    if i < 0 or identical[j]:
+      continue
+    unmatched = collections.defaultdict(list)
+    for child in a.children(i):
+      if a_match[child] < 0:
+        unmatched[a.place(child)[0], a.nodes[child].__class__].append(child)
+    for key in unmatched:
+      unmatched[key].reverse()
+    for child in b.children(j):
+      if b_match[child] < 0:
+        candidates = unmatched.get((b.place(child)[0],
+                                    b.nodes[child].__class__))
+        if candidates:
+          match(candidates.pop(), child)
+
+  moved = []
+  updated = []
+  for j in range(len(b.nodes)):
+    i = b_match[j]
+    parent = b.parents[j]
+    if i < 0 or identical[j] and parent >= 0 and identical[parent]:
+      continue
+    if (not identical[j] and
+        _label(a.nodes[i], formatting) != _label(b.nodes[j], formatting)):
+      updated.append((a.nodes[i], b.nodes[j]))
+    if parent >= 0 and (a.parents[i] != b_match[parent] or
+                        a.place(i)[0] != b.place(j)[0]):
+      moved.append((a.nodes[i], b.nodes[j]))
+  moved.extend(_reordered(a, b, b_match, identical))
+  moved.sort(key=lambda pair: b.index.node_id(pair[1]))
+
+  return TreeDiff(
+      inserted=[b.nodes[j] for j in range(len(b.nodes)) if b_match[j] < 0],
+      deleted=[a.nodes[i] for i in range(len(a.nodes)) if a_match[i] < 0],
+      moved=moved,
+      updated=updated)
+
+
+def _reordered(a, b, b_match, identical):
+  """Find matched nodes which kept their parent but not their order."""
+  result = []
+  for j in range(len(b.nodes)):
+    if b_match[j] < 0 or identical[j]:
+      continue
+    # Old list indexes of children which stayed in the same list field.
+    fields = collections.defaultdict(list)
+    for child in b.children(j):
+      i = b_match[child]
+      if i < 0 or a.parents[i] != b_match[j]:
+        continue
+      name, position = b.place(child)
+      if position is not None and a.place(i)[0] == name:
+        fields[name].append((a.place(i)[1], child))
+    for children in fields.values():
+      # Children outside a longest increasing run of old indexes were moved.
+      kept = set(_longest_increasing(
+          [index for index, _ in children]))
+      result.extend((a.nodes[b_match[child]], b.nodes[child])
+                    for k, (_, child) in enumerate(children) if k not in kept)
+  return result
+
+
+def _longest_increasing(values):
+  """Get the positions of a longest increasing subsequence of values."""
+  tails = []
+  tail_positions = []
+  previous = [-1] * len(values)
+  for k, value in enumerate(values):
+    t = bisect.bisect_left(tails, value)
+    if t == len(tails):
+      tails.append(value)
+      tail_positions.append(k)
+    else:
+      tails[t] = value
+      tail_positions[t] = k
+    previous[k] = tail_positions[t - 1] if t > 0 else -1
+  result = []
+  k = tail_positions[-1] if tail_positions else -1
+  while k >= 0:
+    result.append(k)
+    k = previous[k]
+  return result
@@ -0,0 +1,152 @@
+# coding=utf-8
+"""Tests for tree_diff."""
+# Copyright 2017 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import ast
+import copy
+import textwrap
+import unittest
+
+import pasta
+from pasta.base import test_utils
+from pasta.base import tree_diff
+
+
+def _number(value):
+  """Parse a module assigning a number, which can be one that parses as -n."""
+  tree = ast.parse('x = 0\n')
+  num = tree.body[0].value
+  setattr(num, num._fields[0], value)
+  return tree
+
+
+class TreeHasherTest(test_utils.TestCase):
+
+  def test_equal(self):
+    src = 'def f(a, b=1):\n  return a + b\n'
+    self.assertTrue(tree_diff.equal(ast.parse(src), ast.parse(src)))
+    self.assertFalse(tree_diff.equal(ast.parse(src),
+                                     ast.parse(src.replace('1', '2'))))
+    self.assertFalse(tree_diff.equal(ast.parse('a = 1'), ast.parse('a = 1.0')))
+    self.assertFalse(tree_diff.equal(ast.parse('a = b'), ast.parse('b = a')))
+
+  def test_equal_hash_collision(self):
+    # hash(-1) == hash(-2) in CPython.
+    self.assertFalse(tree_diff.equal(_number(-1), _number(-2)))
+    self.assertTrue(tree_diff.equal(_number(-1), _number(-1)))
+
+  def test_formatting(self):
+    a = pasta.parse('a = (1)\n')
+    b = pasta.parse('a = 1\n')
+    self.assertTrue(tree_diff.equal(a, b))
+    self.assertFalse(tree_diff.equal(a, b, formatting=True))
+    self.assertTrue(tree_diff.equal(a, copy.deepcopy(a), formatting=True))
+
+  def test_ignores_spans(self):
+    src = 'a = 1\nb = 2\n'
+    self.assertTrue(tree_diff.equal(pasta.parse(src, record_spans=True),
+                                    pasta.parse(src), formatting=True))
+
+  def test_invalidate(self):
+    t = ast.parse('a = 1\nb = c\n')
+    hasher = tree_diff.TreeHasher()
+    before = hasher.hash(t)
+    first = hasher.hash(t.body[0])
+    t.body[1].value.id = 'd'
+    self.assertEqual(before, hasher.hash(t))
+    hasher.invalidate(t.body[1].value)
+    self.assertNotEqual(before, hasher.hash(t))
+    self.assertEqual(first, hasher.hash(t.body[0]))
+    self.assertEqual(tree_diff.TreeHasher().hash(t), hasher.hash(t))
+
+
+class DiffTest(test_utils.TestCase):
+
+  def _diff(self, old_src, new_src, **kwargs):
+    old = ast.parse(textwrap.dedent(old_src))
+    new = ast.parse(textwrap.dedent(new_src))
+    return old, new, tree_diff.diff(old, new, **kwargs)
+
+  def test_no_change(self):
+    _, _, d = self._diff('a = 1\nif b:\n  c()\n', 'a = 1\nif b:\n  c()\n')
+    self.assertFalse(d)
+
+  def test_update(self):
+    old, new, d = self._diff('a = 1\nb = c + d\n', 'a = 1\nb = c + e\n')
+    self.assertEqual([(old.body[1].value.right, new.body[1].value.right)],
+                     d.updated)
+    self.assertEqual([], d.inserted + d.deleted + d.moved)
+
+  def test_update_hash_collision(self):
+    old = _number(-1)
+    new = _number(-2)
+    d = tree_diff.diff(old, new)
+    self.assertEqual([(old.body[0].value, new.body[0].value)], d.updated)
+    self.assertEqual([], d.inserted + d.deleted + d.moved)
+
+  def test_insert_and_delete(self):
+    old, new, d = self._diff('a = 1\nb = 2\nc = 3\n', 'a = 1\nc = 3\nd()\n')
+    self.assertEqual([old.body[1], old.body[1].targets[0], old.body[1].value],
+                     d.deleted)
+    self.assertEqual(new.body[2], d.inserted[0])
+    self.assertEqual([], d.moved + d.updated)
+
+  def test_replace_children(self):
+    old, new, d = self._diff('a = 1\nb = 2\n', 'a = 1\nc = d\n')
+    self.assertEqual([(old.body[1].targets[0], new.body[1].targets[0])],
+                     d.updated)
+    self.assertEqual([old.body[1].value], d.deleted)
+    self.assertEqual([new.body[1].value], d.inserted)
+
+  def test_reorder(self):
+    old, new, d = self._diff('a = 1\nb = 2\nc = 3\n', 'c = 3\na = 1\nb = 2\n')
+    self.assertEqual([(old.body[2], new.body[0])], d.moved)
+    self.assertEqual([], d.inserted + d.deleted + d.updated)
+
+  def test_move_between_blocks(self):
+    old, new, d = self._diff("""\
+        def f():
+          a = g(1)
+          return a
+        """, """\
+        a = g(1)
+        def f():
+          return a
+        """)
+    self.assertEqual([(old.body[0].body[0], new.body[0])], d.moved)
+    self.assertEqual([], d.inserted + d.deleted + d.updated)
+
+  def test_formatting(self):
+    old = pasta.parse('a = (1)\nb = 2\n')
+    new = pasta.parse('a = 1\nb = 2\n')
+    self.assertFalse(tree_diff.diff(old, new))
+    d = tree_diff.diff(old, new, formatting=True)
+    self.assertIn((old.body[0].value, new.body[0].value), d.updated)
+    self.assertEqual([], d.inserted + d.deleted + d.moved)
+
+
+def suite():
+  result = unittest.TestSuite()
+  result.addTests(unittest.makeSuite(TreeHasherTest))
+  result.addTests(unittest.makeSuite(DiffTest))
+  return result
+
+
+if __name__ == '__main__':
+  unittest.main()